@@ -12,6 +12,119 @@ import { Widget } from "@lumino/widgets";
 import { ServerConnection } from "@jupyterlab/services";
 import { JupyterFrontEnd } from "@jupyterlab/application";
 import { IDocumentManager } from "@jupyterlab/docmanager";
+import { DocumentRegistry } from "@jupyterlab/docregistry";
+import { INotebookModel } from "@jupyterlab/notebook";
+
+import { CELLTESTS_CELL_METADATA } from "./utils";
+
+/**
+ * Just the parts of a notebook needed for linting and testing: cell types,
+ * sources and celltests metadata, plus the notebook's metadata. Unlike
+ * model.toJSON(), no outputs are serialized (and uploaded).
+ */
+export function notebookSources(model: INotebookModel) {
+  const cells: {[key: string]: any}[] = [];
+  for (const cell of model.cells) {
+    const metadata: {[key: string]: any} = {};
+    for (const key of CELLTESTS_CELL_METADATA) {
+      const value = cell.getMetadata(key);
+      if (value !== undefined) {
+        metadata[key] = value;
+      }
+    }
+    cells.push({ cell_type: cell.type, metadata, source: cell.sharedModel.getSource() });
+  }
+  return { cells, metadata: model.metadata };
+}
+
+type NotebookSources = ReturnType<typeof notebookSources>;
+
+/**
+ * What the server holds of each notebook (by path): the revision of its
+ * copy, and the sources it was made from.
+ */
+const sent = new Map<string, { revision: string; sources: NotebookSources }>();
+
+/**
+ * Insert/delete/modify operations turning the cells of previous into
+ * those of current: cells outside the changed range (found by comparing
+ * from both ends) are left out, so a typical edit sends one cell.
+ */
+export function cellDeltas(previous: NotebookSources["cells"], current: NotebookSources["cells"]) {
+  const same = (a: any, b: any) => JSON.stringify(a) === JSON.stringify(b);
+  let start = 0;
+  while (start < previous.length && start < current.length && same(previous[start], current[start])) {
+    start++;
+  }
+  let end = 0;
+  while (end < previous.length - start && end < current.length - start && same(previous[previous.length - 1 - end], current[current.length - 1 - end])) {
+    end++;
+  }
+  const removed = previous.length - start - end;
+  const added = current.length - start - end;
+  const deltas: {[key: string]: any}[] = [];
+  for (let i = 0; i < Math.min(removed, added); i++) {
+    deltas.push({ cell: current[start + i], index: start + i, op: "modify" });
+  }
+  for (let i = added; i < removed; i++) {
+    deltas.push({ index: start + added, op: "delete" });
+  }
+  for (let i = removed; i < added; i++) {
+    deltas.push({ cell: current[start + i], index: start + i, op: "insert" });
+  }
+  return deltas;
+}
+
+/**
+ * Post a notebook to a celltests endpoint, sending only what changed
+ * since the previous post if the server still holds that revision, or
+ * nothing but its path if the notebook is saved (the server reads the
+ * saved file).
+ */
+export async function postNotebook(endpoint: string, context: DocumentRegistry.IContext<INotebookModel>) {
+  const settings = ServerConnection.makeSettings();
+  const url = `${settings.baseUrl}celltests/${endpoint}/run`;
+  const path = context.path;
+  const sources = notebookSources(context.model);
+  const previous = sent.get(path);
+  const lastModified = context.contentsModel?.last_modified;
+  let res: Response | undefined;
+  if (previous === undefined && !context.model.dirty && lastModified) {
+    res = await ServerConnection.makeRequest(url, { body: JSON.stringify({ path, saved: lastModified }), method: "post" }, settings);
+  } else if (previous !== undefined) {
+    const body: {[key: string]: any} = { deltas: cellDeltas(previous.sources.cells, sources.cells), path, revision: previous.revision };
+    if (JSON.stringify(previous.sources.metadata) !== JSON.stringify(sources.metadata)) {
+      body.metadata = sources.metadata;
+    }
+    res = await ServerConnection.makeRequest(url, { body: JSON.stringify(body), method: "post" }, settings);
+  }
+  if (res === undefined || res.status === 409) {
+    // first post of an unsaved notebook, or the server's copy is out of date
+    res = await ServerConnection.makeRequest(url, { body: JSON.stringify({ path, sources }), method: "post" }, settings);
+  }
+  if (!res.ok) {
+    sent.delete(path);
+    return res;
+  }
+  const data = await res.clone().json();
+  // metadata is serialized and compared, so keep a copy
+  sent.set(path, { revision: data.revision, sources: JSON.parse(JSON.stringify(sources)) });
+  return res;
+}
+
+/**
+ * Structured lint results for a few cells (e.g. the one being edited),
+ * with names defined by the notebook's earlier cells (as last sent to
+ * the server) treated as defined.
+ */
+export async function lintCells(path: string, cells: { index: number; source: string }[]) {
+  const settings = ServerConnection.makeSettings();
+  const res = await ServerConnection.makeRequest(`${settings.baseUrl}celltests/lint/cells`, { body: JSON.stringify({ cells, path }), method: "post" }, settings);
+  if (!res.ok) {
+    return [];
+  }
+  return (await res.json()).diagnostics as {[key: string]: any}[];
+}
 
 export async function runCellTests(app: JupyterFrontEnd, docManager: IDocumentManager) {
   const result = await showDialog({
@@ -30,11 +143,7 @@ export async function runCellTests(app: JupyterFrontEnd, docManager: IDocumentMa
     return;
   }
 
-  const path = context.path;
-  const model = context.model.toJSON();
-
-  const settings = ServerConnection.makeSettings();
-  const res = await ServerConnection.makeRequest(`${settings.baseUrl}celltests/test/run`, { method: "post", body: JSON.stringify({ path, model }) }, settings);
+  const res = await postNotebook("test", context as DocumentRegistry.IContext<INotebookModel>);
 
   if (res.ok) {
     const iframe = document.createElement("iframe");
@@ -83,11 +192,7 @@ export async function runCellLints(app: JupyterFrontEnd, docManager: IDocumentMa
     return;
   }
 
-  const path = context.path;
-  const model = context.model.toJSON();
-
-  const settings = ServerConnection.makeSettings();
-  const res = await ServerConnection.makeRequest(`${settings.baseUrl}celltests/lint/run`, { method: "post", body: JSON.stringify({ path, model }) }, settings);
+  const res = await postNotebook("lint", context as DocumentRegistry.IContext<INotebookModel>);
 
   if (res.ok) {
     const div = document.createElement("div");
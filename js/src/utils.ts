@@ -29,6 +29,9 @@ export const CELLTEST_TOOL_RULES_CLASS = "CelltestsRules";
 
 export const CELLTEST_TOOL_EDITOR_CLASS = "CelltestsEditor";
 
+// cell metadata used by nbcelltests (see CELL_METADATA in extension.py)
+export const CELLTESTS_CELL_METADATA = ["celltests", "celltests_timeout"];
+
 export const CELLTEST_RULES = [
   // TODO fetch from server
   {
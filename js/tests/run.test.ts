@@ -0,0 +1,180 @@
+/******************************************************************************
+ *
+ * Copyright (c) 2019, the nbcelltests authors.
+ *
+ * This file is part of the nbcelltests library, distributed under the terms of
+ * the Apache License 2.0.  The full license can be found in the LICENSE file.
+ *
+ */
+import "isomorphic-fetch";
+
+import { ServerConnection } from "@jupyterlab/services";
+
+import { cellDeltas, notebookSources, postNotebook } from "../src/run";
+
+jest.mock("@jupyterlab/services", () => ({
+  ServerConnection: {
+    makeRequest: jest.fn(),
+    makeSettings: () => ({ baseUrl: "/" }),
+  },
+}));
+
+const makeRequest = ServerConnection.makeRequest as jest.Mock;
+
+function cell(source: string, metadata: {[key: string]: any} = {}, type = "code") {
+  return {
+    getMetadata: (key: string) => metadata[key],
+    sharedModel: { getSource: () => source },
+    type,
+  };
+}
+
+function model(cells: any[], metadata: {[key: string]: any} = {}) {
+  return { cells, dirty: true, metadata } as any;
+}
+
+function source(text: string) {
+  return { cell_type: "code", metadata: {}, source: text };
+}
+
+function response(status: number, data: {[key: string]: any} = {}) {
+  const res = { clone: () => res, json: async () => data, ok: status === 200, status };
+  return res;
+}
+
+function bodies() {
+  return makeRequest.mock.calls.map((call) => JSON.parse(call[1].body));
+}
+
+describe("notebookSources", () => {
+  test("keeps only types, sources and celltests metadata", () => {
+    const nb = model([
+      cell("# title", {}, "markdown"),
+      cell("x = 1", { celltests: ["%cell"], celltests_timeout: 5, collapsed: true }),
+    ], { celltests: { lines_per_cell: 2 } });
+    expect(notebookSources(nb)).toEqual({
+      cells: [
+        { cell_type: "markdown", metadata: {}, source: "# title" },
+        { cell_type: "code", metadata: { celltests: ["%cell"], celltests_timeout: 5 }, source: "x = 1" },
+      ],
+      metadata: { celltests: { lines_per_cell: 2 } },
+    });
+  });
+});
+
+describe("cellDeltas", () => {
+  const [a, b, c, d] = ["a", "b", "c", "d"].map(source);
+
+  test("no change", () => {
+    expect(cellDeltas([a, b, c], [a, b, c])).toEqual([]);
+  });
+
+  test("modify", () => {
+    expect(cellDeltas([a, b, c], [a, d, c])).toEqual([{ cell: d, index: 1, op: "modify" }]);
+  });
+
+  test("insert", () => {
+    expect(cellDeltas([a, c], [a, b, c])).toEqual([{ cell: b, index: 1, op: "insert" }]);
+    expect(cellDeltas([], [a, b])).toEqual([
+      { cell: a, index: 0, op: "insert" },
+      { cell: b, index: 1, op: "insert" },
+    ]);
+  });
+
+  test("delete", () => {
+    expect(cellDeltas([a, b, c], [a, c])).toEqual([{ index: 1, op: "delete" }]);
+    expect(cellDeltas([a, b, c, d], [a, d])).toEqual([
+      { index: 1, op: "delete" },
+      { index: 1, op: "delete" },
+    ]);
+  });
+
+  test("move", () => {
+    // (as the cells in between changing)
+    expect(cellDeltas([a, b, c, d], [a, c, b, d])).toEqual([
+      { cell: c, index: 1, op: "modify" },
+      { cell: b, index: 2, op: "modify" },
+    ]);
+    expect(cellDeltas([a, b, c], [b, c, a])).toEqual([
+      { cell: b, index: 0, op: "modify" },
+      { cell: c, index: 1, op: "modify" },
+      { cell: a, index: 2, op: "modify" },
+    ]);
+  });
+
+  test("applying the deltas gives the current cells", () => {
+    const cases = [[[a, b, c], [a, c, b, d]], [[a, b, c, d], [d]], [[a], [b, a, c]], [[a, b], []]];
+    for (const [previous, current] of cases) {
+      const cells = previous.slice();
+      for (const delta of cellDeltas(previous, current)) {
+        if (delta.op === "modify") {
+          cells[delta.index] = delta.cell;
+        } else if (delta.op === "insert") {
+          cells.splice(delta.index, 0, delta.cell);
+        } else {
+          cells.splice(delta.index, 1);
+        }
+      }
+      expect(cells).toEqual(current);
+    }
+  });
+});
+
+describe("postNotebook", () => {
+  beforeEach(() => {
+    makeRequest.mockReset();
+  });
+
+  test("sends deltas against the server's revision", async () => {
+    const cells = [cell("x = 1"), cell("y = 2")];
+    const context = { model: model(cells), path: "deltas.ipynb" } as any;
+
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "1" }));
+    await postNotebook("lint", context);
+    cells[1] = cell("y = 3");
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "2" }));
+    await postNotebook("lint", context);
+
+    expect(makeRequest.mock.calls[0][0]).toBe("/celltests/lint/run");
+    expect(bodies()).toEqual([
+      { path: "deltas.ipynb", sources: notebookSources(model([cell("x = 1"), cell("y = 2")])) },
+      { deltas: [{ cell: source("y = 3"), index: 1, op: "modify" }], path: "deltas.ipynb", revision: "1" },
+    ]);
+  });
+
+  test("resends everything after a revision mismatch", async () => {
+    const cells = [cell("x = 1")];
+    const context = { model: model(cells), path: "mismatch.ipynb" } as any;
+
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "1" }));
+    await postNotebook("test", context);
+    // (e.g. the server restarted, so no longer holds revision 1)
+    cells.push(cell("y = 2"));
+    makeRequest.mockResolvedValueOnce(response(409));
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "7" }));
+    const res = await postNotebook("test", context);
+    expect(res.ok).toBe(true);
+    cells.push(cell("z = 3"));
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "8" }));
+    await postNotebook("test", context);
+
+    const sources = notebookSources(model([cell("x = 1"), cell("y = 2")]));
+    expect(bodies().slice(1)).toEqual([
+      { deltas: [{ cell: source("y = 2"), index: 1, op: "insert" }], path: "mismatch.ipynb", revision: "1" },
+      { path: "mismatch.ipynb", sources },
+      // and then deltas against the new revision
+      { deltas: [{ cell: source("z = 3"), index: 2, op: "insert" }], path: "mismatch.ipynb", revision: "7" },
+    ]);
+  });
+
+  test("sends only the path of a saved notebook", async () => {
+    const context = {
+      contentsModel: { last_modified: "2019-01-01T00:00:00Z" },
+      model: { ...model([cell("x = 1")]), dirty: false },
+      path: "saved.ipynb",
+    } as any;
+    makeRequest.mockResolvedValueOnce(response(200, { revision: "1" }));
+    await postNotebook("lint", context);
+    expect(bodies()).toEqual([{ path: "saved.ipynb", saved: "2019-01-01T00:00:00Z" }]);
+  });
+});
@@ -5,12 +5,23 @@
 # This file is part of the nbcelltests library, distributed under the terms of
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
-from .lint import run as runLint  # noqa: F401
-from .test import run as runTest  # noqa: F401
-
 __version__ = "0.3.2"
 
 
+def __getattr__(name):
+    # runLint and runTest are imported on first use, so that e.g. the
+    # command line can talk to a daemon without importing nbconvert
+    if name == "runLint":
+        from .lint import run
+
+        return run
+    if name == "runTest":
+        from .test import run
+
+        return run
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 def _jupyter_server_extension_paths():
     return [{"module": "nbcelltests"}]
 
@@ -1,16 +1,101 @@
 import argparse
+import concurrent.futures
+import os
 import sys
 
-from .lint import run as runLint
-from .test import run as runTest
+from . import tracing
+from .discover import find_notebooks
 
+# note: lint and test (and so nbconvert etc) are imported when used, so
+# that handing a command to a running daemon is quick
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("option", help="Which option to run", default="lint", choices=("lint", "test"))
 
-    parser.add_argument("notebook", help="On which notebook to run")
+# notebooks linted together (with one run of the python linter)
+LINT_BATCH_SIZE = 50
+
+
+def _lint_notebooks(notebooks, rules, executable, validate, cache=None, linter="flake8"):
+    # [(notebook, messages, passed)] for some notebooks of a directory
+    from .lint import run_many
+
+    with tracing.span("lint.run_many", notebooks=len(notebooks)):
+        return run_many(
+            notebooks,
+            rules=rules,
+            executable=executable,
+            run_python_linter=True,
+            validate=validate,
+            cache=cache,
+            linter=linter,
+        )
+
+
+def _test_notebook(notebook, rules, executable, fail_fast, validate):
+    # [(notebook, messages, passed)] for one notebook of a directory
+    from .test import runWithOutput
+
+    output, passed = runWithOutput(notebook, executable=executable, rules=rules, fail_fast=fail_fast, validate=validate)
+    # pytest's summary is enough for notebooks that passed
+    lines = output.rstrip().splitlines()
+    return [(notebook, lines if not passed else lines[-1:], passed)]
+
 
+def _run_directory(args, rules, executable, cache=None):
+    """
+    Lint/test each notebook in a directory, printing each notebook's
+    results as it finishes. Notebooks are linted in batches, each with
+    one run of the python linter.
+    """
+    results = {"count": 0, "failed": 0}
+
+    def report(future, batch):
+        try:
+            checked = future.result()
+        except Exception as e:
+            checked = [(notebook, ["ERROR: %s: %s" % (type(e).__name__, e)], False) for notebook in batch]
+        for notebook, ret, passed in checked:
+            results["count"] += 1
+            results["failed"] += not passed
+            print("%s %s" % ("PASSED" if passed else "FAILED", os.path.relpath(notebook, args.notebook)))
+            for message in ret:
+                print("\t%s" % (message,))
+        sys.stdout.flush()
+
+    def submit(executor, batch):
+        if args.option == "lint":
+            return executor.submit(
+                _lint_notebooks, batch, rules, executable and list(executable), args.validate, cache, args.linter
+            )
+        (notebook,) = batch
+        return executor.submit(
+            _test_notebook, notebook, rules, executable and list(executable), args.fail_fast, args.validate
+        )
+
+    notebooks = find_notebooks(
+        args.notebook, include=args.include or (), exclude=args.exclude or (), gitignore=not args.no_gitignore
+    )
+    batch_size = LINT_BATCH_SIZE if args.option == "lint" else 1
+    pending = {}
+    batch = []
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        # start on notebooks as they're found, reporting any finished meanwhile
+        for notebook in notebooks:
+            batch.append(notebook)
+            if len(batch) == batch_size:
+                pending[submit(executor, batch)] = batch
+                batch = []
+            for future in [future for future in pending if future.done()]:
+                report(future, pending.pop(future))
+        if batch:
+            pending[submit(executor, batch)] = batch
+        for future in concurrent.futures.as_completed(pending):
+            report(future, pending[future])
+
+    print("%d of %d notebooks failed" % (results["failed"], results["count"]))
+    return 1 if results["failed"] else 0
+
+
+def _add_lint_rule_arguments(parser):
     parser.add_argument(
         "--lines_per_cell",
         help="How many lines to allowed per cell",
@@ -55,14 +140,17 @@ def main():
         help="Magics to explicitly deny",
     )
 
+
+def _add_linter_argument(parser):
     parser.add_argument(
-        "--executable",
-        help="String executable to execute lint/test",
+        "--linter",
+        help="Python linter to lint with (ruff reports each problem in its cell)",
+        choices=("flake8", "ruff"),
+        default="flake8",
     )
 
-    # process args
-    args = parser.parse_args()
 
+def _lint_rules(args):
     rules = {}
     if args.lines_per_cell:
         rules["lines_per_cell"] = args.lines_per_cell
@@ -79,23 +167,447 @@ def main():
         rules["magics_allowlist"] = args.magics_allowlist
     if args.magics_denylist:
         rules["magics_denylist"] = args.magics_denylist
+    return rules
+
+
+def _pre_commit(argv):
+    from .precommit import lint_staged
+
+    parser = argparse.ArgumentParser(
+        prog="nbcelltests pre-commit", description="Lint the notebooks staged for commit, as they are in the index"
+    )
+    parser.add_argument("notebook", help="Only lint these notebooks (if staged)", nargs="*")
+    _add_lint_rule_arguments(parser)
+    _add_linter_argument(parser)
+    parser.add_argument("--no_python_linter", help="Don't run the python linter", action="store_true")
+    parser.add_argument("--no_cache", help="Don't use (or update) the cache of earlier results", action="store_true")
+    parser.add_argument("--executable", help="String executable to lint with")
+    args = parser.parse_args(argv)
+
+    results = lint_staged(
+        args.notebook,
+        rules=_lint_rules(args),
+        executable=args.executable.split(" ") if args.executable else None,
+        run_python_linter=not args.no_python_linter,
+        use_cache=not args.no_cache,
+        linter=args.linter,
+    )
+    failed = 0
+    for path, messages, passed in results:
+        failed += not passed
+        print("%s %s" % ("PASSED" if passed else "FAILED", path))
+        for message in messages:
+            print("\t%s" % (message,))
+    print("%d of %d staged notebooks failed" % (failed, len(results)))
+    return 1 if failed else 0
+
+
+def _format_seconds(seconds):
+    return "-" if seconds is None else "%.2fs" % seconds
+
+
+def _format_memory(memory):
+    return "-" if memory is None else "%.1f MiB" % (memory / (1024 * 1024))
+
+
+# query: columns of its table, as (key, heading, format)
+_HISTORY_COLUMNS = {
+    "slowest": [
+        ("notebook", "notebook", str),
+        ("cell", "cell", str),
+        ("runs", "runs", str),
+        ("mean_seconds", "mean", _format_seconds),
+        ("max_seconds", "max", _format_seconds),
+        ("max_peak_memory", "peak memory", _format_memory),
+    ],
+    "flakiest": [
+        ("notebook", "notebook", str),
+        ("cell", "cell", str),
+        ("runs", "runs", str),
+        ("failures", "failures", str),
+        ("flips", "flips", str),
+    ],
+    "trends": [
+        ("period", "period", str),
+        ("kind", "kind", str),
+        ("runs", "runs", str),
+        ("failed", "failed", str),
+        ("mean_seconds", "mean time", _format_seconds),
+        ("max_peak_memory", "peak memory", _format_memory),
+    ],
+}
+
+
+def _history(argv):
+    import json
+    import time
+
+    from .history import RUN_KINDS, TREND_PERIODS, RunHistory
+
+    parser = argparse.ArgumentParser(
+        prog="nbcelltests history", description="Query the lint and test runs recorded with --run_history"
+    )
+    parser.add_argument(
+        "query",
+        help="slowest: cells with the longest mean execution time; flakiest: cells whose unchanged tests both passed "
+        "and failed; trends: runs, failures, time and memory per period",
+        choices=tuple(_HISTORY_COLUMNS),
+    )
+    parser.add_argument("database", help="SQLite database the runs were recorded in")
+    parser.add_argument("--notebook", help="Only runs of this notebook")
+    parser.add_argument("--days", help="Only runs in this many most recent days", type=float)
+    parser.add_argument("--limit", help="How many cells to list (slowest and flakiest)", type=int, default=20)
+    parser.add_argument("--period", help="Period of trends", choices=tuple(TREND_PERIODS), default="day")
+    parser.add_argument("--kind", help="Only lint or test runs (trends)", choices=RUN_KINDS)
+    parser.add_argument("--json", help="Print JSON rather than a table", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        print("No run history at %s" % args.database, file=sys.stderr)
+        return 1
+    history = RunHistory(args.database)
+    since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    if args.query == "slowest":
+        rows = history.slowest(args.limit, since=since, notebook=args.notebook)
+    elif args.query == "flakiest":
+        rows = history.flakiest(args.limit, since=since, notebook=args.notebook)
+    else:
+        rows = history.trends(args.period, since=since, notebook=args.notebook, kind=args.kind)
+
+    if args.json:
+        print(json.dumps(rows, indent=1))
+        return 0
+    columns = _HISTORY_COLUMNS[args.query]
+    table = [[heading for _, heading, _ in columns]]
+    table += [[formatter(row[key]) for key, _, formatter in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)).rstrip())
+    return 0
+
+
+def _daemon(argv):
+    from . import daemon
+
+    parser = argparse.ArgumentParser(prog="nbcelltests daemon", description=daemon.__doc__.split("\n")[0])
+    parser.add_argument("--socket", help="Unix socket to listen on (default: %s)" % daemon.socket_path())
+    parser.add_argument(
+        "--kernel",
+        help="Kernel to keep started, ready for the next notebook (can be repeated; default: python3)",
+        action="append",
+    )
+    parser.add_argument("--stop", help="Stop the running daemon", action="store_true")
+    args = parser.parse_args(argv)
+    if args.stop:
+        return 0 if daemon.stop(args.socket) else 1
+    daemon.serve(args.socket, kernel_names=args.kernel or ["python3"])
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["daemon"]:
+        sys.exit(_daemon(argv[1:]))
+
+    # tests run in the daemon's process, which can't use another executable
+    # (or be traced)
+    from .daemon import NO_DAEMON_ENV, request
+
+    if not os.environ.get(NO_DAEMON_ENV) and not any(arg.startswith(("--executable", "--trace")) for arg in argv):
+        status = request(argv)
+        if status is not None:
+            sys.exit(status)
+
+    sys.exit(run(argv))
+
+
+def run(argv, daemon=False):
+    """Run the lint/test/pre-commit/history command line argv, returning the exit status."""
+    if argv[:1] == ["pre-commit"]:
+        return _pre_commit(argv[1:])
+    if argv[:1] == ["history"]:
+        return _history(argv[1:])
+
+    parser = argparse.ArgumentParser(prog="nbcelltests")
+    parser.add_argument("option", help="Which option to run", default="lint", choices=("lint", "test"))
+
+    parser.add_argument("notebook", help="On which notebook (or directory of notebooks) to run")
+
+    parser.add_argument(
+        "--include",
+        help="In a directory, only run on notebooks matching this glob (relative to the directory; can be repeated)",
+        action="append",
+    )
+
+    parser.add_argument(
+        "--exclude",
+        help="In a directory, skip notebooks and directories matching this glob (can be repeated)",
+        action="append",
+    )
+
+    parser.add_argument(
+        "--no_gitignore",
+        help="In a directory, don't skip notebooks ignored by .gitignore files",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        help="In a directory, how many notebooks to lint/test at once",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+
+    _add_lint_rule_arguments(parser)
+
+    parser.add_argument(
+        "--cell_timeout",
+        help="How many seconds each cell+test may run before the kernel is interrupted",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--timeout_policy",
+        help="Whether to continue with the remaining cells or abort the notebook after a timeout",
+        choices=("continue", "abort"),
+    )
+
+    parser.add_argument(
+        "--code_coverage",
+        help="Minimum percentage of the notebook's code lines that must run during the tests",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--code_coverage_per_cell",
+        help="Minimum percentage of each cell's code lines that must run during the tests",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max_memory_per_cell",
+        help="How many MiB the kernel's memory may grow by while each cell+test runs",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max_memory_per_notebook",
+        help="How many MiB of memory the kernel may use while running the notebook",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max_seconds_per_cell",
+        help="How many seconds the kernel may spend executing each cell+test",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max_seconds_per_notebook",
+        help="How many seconds the kernel may spend executing the whole notebook",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--timing_history",
+        help="SQLite database to record each cell's execution time in",
+    )
+
+    parser.add_argument(
+        "--timing_regression_threshold",
+        help="Fail cells that took this many standard deviations longer than their recorded history",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--memory_top_allocators",
+        help="How many of the lines allocating the most memory to report when a memory limit is exceeded",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--snapshot_cell",
+        help="Run each cell+test after this code cell in its own fork of the kernel (Python kernels on Linux)",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--checkpoint_dir",
+        help="Directory to keep checkpoints of the kernel's user namespace in",
+    )
+
+    parser.add_argument(
+        "--checkpoint_cell",
+        help="Save a checkpoint after this code cell, to restore in later runs if the cells up to it are unchanged "
+        "(can be repeated)",
+        type=int,
+        action="append",
+    )
+
+    parser.add_argument(
+        "--checkpoint_serializer",
+        help="How to save checkpoints (dill also saves functions and classes defined in the notebook)",
+        choices=("pickle", "dill"),
+    )
+
+    parser.add_argument(
+        "--checkpoint_exclude",
+        help="Leave names matching this glob out of checkpoints (can be repeated)",
+        action="append",
+    )
+
+    parser.add_argument(
+        "--run_history",
+        help="SQLite database to record the run in (see nbcelltests history)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Profile each cell+test in the kernel, writing flame graphs of the cells to this directory",
+    )
+
+    parser.add_argument(
+        "--profile_format",
+        help="How to write profiles (collapsed stacks, or a speedscope file)",
+        choices=("collapsed", "speedscope"),
+    )
+
+    parser.add_argument(
+        "--profile_interval",
+        help="Seconds between samples of the kernel's stack when profiling",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--fail_fast",
+        help="Stop testing at the first failing cell and report the remaining cells as not run",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--validate",
+        help="Check the notebook matches the nbformat schema",
+        action="store_true",
+    )
+
+    _add_linter_argument(parser)
+
+    parser.add_argument(
+        "--executable",
+        help="String executable to execute lint/test",
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="Trace the run to this file (Chrome trace format, e.g. for https://ui.perfetto.dev)",
+    )
+
+    # process args
+    args = parser.parse_args(argv)
+
+    rules = _lint_rules(args)
+    if args.cell_timeout is not None:
+        rules["cell_timeout"] = args.cell_timeout
+    if args.timeout_policy is not None:
+        rules["timeout_policy"] = args.timeout_policy
+    if args.code_coverage is not None:
+        rules["code_coverage"] = args.code_coverage
+    if args.code_coverage_per_cell is not None:
+        rules["code_coverage_per_cell"] = args.code_coverage_per_cell
+    if args.max_memory_per_cell is not None:
+        rules["max_memory_per_cell"] = args.max_memory_per_cell
+    if args.max_memory_per_notebook is not None:
+        rules["max_memory_per_notebook"] = args.max_memory_per_notebook
+    if args.max_seconds_per_cell is not None:
+        rules["max_seconds_per_cell"] = args.max_seconds_per_cell
+    if args.max_seconds_per_notebook is not None:
+        rules["max_seconds_per_notebook"] = args.max_seconds_per_notebook
+    if args.timing_history is not None:
+        rules["timing_history"] = args.timing_history
+    if args.timing_regression_threshold is not None:
+        rules["timing_regression_threshold"] = args.timing_regression_threshold
+    if args.memory_top_allocators is not None:
+        rules["memory_top_allocators"] = args.memory_top_allocators
+    if args.snapshot_cell is not None:
+        rules["snapshot_cell"] = args.snapshot_cell
+    if args.checkpoint_dir is not None:
+        rules["checkpoint_dir"] = args.checkpoint_dir
+    if args.checkpoint_cell is not None:
+        rules["checkpoint_cells"] = args.checkpoint_cell
+    if args.checkpoint_serializer is not None:
+        rules["checkpoint_serializer"] = args.checkpoint_serializer
+    if args.checkpoint_exclude is not None:
+        rules["checkpoint_exclude"] = args.checkpoint_exclude
+    if args.run_history is not None:
+        rules["run_history"] = args.run_history
+    if args.profile is not None:
+        rules["profile"] = args.profile
+    if args.profile_format is not None:
+        rules["profile_format"] = args.profile_format
+    if args.profile_interval is not None:
+        rules["profile_interval"] = args.profile_interval
+
+    if not args.trace:
+        return _run_option(args, rules, daemon)
+    tracing.start(args.trace)
+    try:
+        with tracing.span("nbcelltests %s" % args.option, notebook=args.notebook):
+            return _run_option(args, rules, daemon)
+    finally:
+        tracing.stop()
+
+
+def _run_option(args, rules, daemon):
+    executable = args.executable.split(" ") if args.executable else None
+    cache = None
+    if daemon:
+        from .daemon import lint_cache, run_pytest
+
+        cache = lint_cache
+        if args.option == "test":
+            notebooks = [args.notebook]
+            if os.path.isdir(args.notebook):
+                notebooks = list(
+                    find_notebooks(
+                        args.notebook,
+                        include=args.include or (),
+                        exclude=args.exclude or (),
+                        gitignore=not args.no_gitignore,
+                    )
+                )
+            if not notebooks:
+                print("No notebooks found")
+                return 0
+            return run_pytest(notebooks, rules=rules, fail_fast=args.fail_fast, validate=args.validate)
+
+    if os.path.isdir(args.notebook):
+        return _run_directory(args, rules, executable, cache)
 
     if args.option == "lint":
+        from .lint import run as runLint
+
         ret, passed = runLint(
             args.notebook,
             html=False,
-            executable=args.executable.split(" ") if args.executable else None,
+            executable=executable,
             rules=rules,
             run_python_linter=True,
+            validate=args.validate,
+            cache=cache,
+            linter=args.linter,
         )
         print("\n".join(str(r) for r in ret))
-        sys.exit(passed)
+        return 0 if passed else 1
     else:
-        runTest(
+        from .test import run as runTest
+
+        return runTest(
             args.notebook,
             html=False,
-            executable=args.executable.split(" ") if args.executable else None,
+            executable=executable,
             rules=rules,
+            fail_fast=args.fail_fast,
+            validate=args.validate,
         )
 
 
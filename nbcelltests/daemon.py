@@ -0,0 +1,272 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""A resident nbcelltests process serving the command line.
+
+`nbcelltests daemon` keeps imports, lint caches and started kernels
+warm, and runs lint and test commands sent over a Unix socket. The
+command line sends its arguments to the daemon when one is running, and
+prints what comes back, so e.g. editor integrations and pre-commit
+hooks don't pay for Python startup, imports and kernel startup on
+every run.
+
+Commands are run one at a time, in the client's working directory but
+the daemon's environment (apart from git's variables, e.g. the index a
+pre-commit hook should read). Tests run in the daemon's process (with the
+pytest plugin), so --executable is only honoured without a daemon.
+
+The command line only uses a socket private to the user (see _trusted),
+so another user can't answer in the daemon's place or read what's sent.
+
+Protocol: a request is one JSON line, {"argv": [...], "cwd": ..., "env":
+{GIT_* variables}} (or
+{"stop": true}); the daemon replies with JSON lines of {"output": text},
+then {"status": exit status}.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import traceback
+
+# environment variables: socket to use, and (if set) never use a daemon
+SOCKET_ENV = "NBCELLTESTS_DAEMON_SOCKET"
+NO_DAEMON_ENV = "NBCELLTESTS_NO_DAEMON"
+
+# cell analyses kept for linting (cleared when full)
+LINT_CACHE_SIZE = 100000
+
+lint_cache = {}
+
+# commands change directory and redirect output, so run one at a time
+_lock = threading.Lock()
+
+
+def socket_path():
+    """
+    The daemon's socket: $NBCELLTESTS_DAEMON_SOCKET, or one per user in
+    $XDG_RUNTIME_DIR, or else in a directory of the user's own in the
+    temporary directory.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    name = "nbcelltests-%s" % (os.getuid() if hasattr(os, "getuid") else "user")
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], name + ".sock")
+    return os.path.join(tempfile.gettempdir(), name, "daemon.sock")
+
+
+def _private(path, is_kind, modes, owners):
+    # whether path is an is_kind file owned by one of owners, with none of modes
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return is_kind(st.st_mode) and st.st_uid in owners and not st.st_mode & modes
+
+
+def _private_directory(directory):
+    # (so nobody else can put a socket in it)
+    return _private(directory, stat.S_ISDIR, stat.S_IWGRP | stat.S_IWOTH, (os.getuid(), 0))
+
+
+def _trusted(path):
+    """
+    Whether the socket at path can only have been created, and be used,
+    by the user: it must be theirs with mode 0600, in a directory only
+    they (or root) can write to.
+    """
+    return (
+        hasattr(os, "getuid")
+        and _private(path, stat.S_ISSOCK, 0o077, (os.getuid(),))
+        and _private_directory(os.path.dirname(os.path.abspath(path)))
+    )
+
+
+def _connect(path):
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    if not _trusted(path):
+        if os.path.lexists(path):
+            # e.g. another user's, who could fake results or read what's sent
+            print("nbcelltests: ignoring %s, a socket not private to this user" % path, file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _git_environment(environ):
+    return {name: value for name, value in environ.items() if name.startswith("GIT_")}
+
+
+def request(argv, path=None):
+    """
+    Run the command line argv in the running daemon, copying its output
+    to stdout, and return the exit status (None if no daemon is running).
+    """
+    sock = _connect(path or socket_path())
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as f:
+        message = {"argv": list(argv), "cwd": os.getcwd(), "env": _git_environment(os.environ)}
+        f.write((json.dumps(message) + "\n").encode("utf-8"))
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            if "output" in message:
+                sys.stdout.write(message["output"])
+                sys.stdout.flush()
+            else:
+                return message["status"]
+    print("nbcelltests daemon connection lost", file=sys.stderr)
+    return 1
+
+
+def stop(path=None):
+    """Stop the running daemon; returns whether one was running."""
+    sock = _connect(path or socket_path())
+    if sock is None:
+        return False
+    with sock:
+        sock.sendall(b'{"stop": true}\n')
+        sock.recv(1)
+    return True
+
+
+class _Output(object):
+    # file-like, sending what's written to the client
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.connected = True
+
+    def send(self, message):
+        if self.connected:
+            try:
+                self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # the client went away; finish the command regardless
+                self.connected = False
+
+    def write(self, text):
+        if text:
+            self.send({"output": text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def run_pytest(notebooks, rules=None, fail_fast=False, validate=False):
+    """Run notebooks' celltests in this process with the pytest plugin; returns pytest's exit status."""
+    import pytest
+    from importlib.metadata import entry_points
+
+    from . import plugin
+
+    # not registered if nbcelltests isn't installed (e.g. running from a checkout)
+    plugins = [] if "nbcelltests" in {ep.name for ep in entry_points(group="pytest11")} else [plugin]
+    argv = list(notebooks) + ["--nbcelltests", "-p", "no:cacheprovider", "-q", "--tb=short"]
+    argv += ["--nbcelltests-rules", json.dumps(rules or {})]
+    if fail_fast:
+        argv.append("--nbcelltests-fail-fast")
+    if validate:
+        argv.append("--nbcelltests-validate")
+    return int(pytest.main(argv, plugins=plugins))
+
+
+def _run_command(argv, cwd, env=None):
+    from .__main__ import run
+
+    if len(lint_cache) > LINT_CACHE_SIZE:
+        lint_cache.clear()
+    previous = os.getcwd()
+    previous_env = _git_environment(os.environ)
+    for name in previous_env:
+        del os.environ[name]
+    os.environ.update(env or {})
+    os.chdir(cwd)
+    try:
+        return run(argv, daemon=True)
+    except SystemExit as e:
+        # e.g. argparse errors
+        return e.code
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        os.chdir(previous)
+        for name in _git_environment(os.environ):
+            del os.environ[name]
+        os.environ.update(previous_env)
+
+
+def serve(path=None, kernel_names=()):
+    """Serve commands on the socket at path until stopped, keeping kernel_names' kernels ready."""
+    import socketserver
+
+    from .kernels import keep_kernels, prestart_kernels, shutdown_kernels
+
+    path = path or socket_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not _private_directory(directory):
+        raise RuntimeError("Not serving on %s: others can write to %s" % (path, directory))
+    if _connect(path) is not None:
+        raise RuntimeError("An nbcelltests daemon is already running on %s" % path)
+    if os.path.exists(path):
+        # left by a daemon that didn't stop cleanly
+        os.unlink(path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            message = json.loads(self.rfile.readline())
+            if message.get("stop"):
+                self.wfile.write(b"\n")
+                threading.Thread(target=server.shutdown).start()
+                return
+            output = _Output(self.wfile)
+            with _lock, contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                status = _run_command(message["argv"], message["cwd"], message.get("env"))
+            output.send({"status": status})
+
+    keep_kernels()
+    prestart_kernels(kernel_names=kernel_names)
+    # only the user may connect
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    print("nbcelltests daemon listening on %s" % path)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        keep_kernels(False)
+        prestart_kernels(False)
+        shutdown_kernels(force=True)
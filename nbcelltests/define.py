@@ -20,6 +20,7 @@ class LintType(Enum):
 
 class TestType(Enum):
     CELL_COVERAGE = "cell_coverage"
+    CODE_COVERAGE = "code_coverage"
     CELL_TEST = "cell_test"
 
 
@@ -0,0 +1,167 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Finding the notebooks in a directory tree.
+
+Directories are scanned in parallel, and notebooks are yielded as
+they're found. Like git, .gitignore files (in the scanned directories)
+are honoured, and ignored directories aren't descended into.
+"""
+
+import concurrent.futures
+import fnmatch
+import os
+import re
+
+# directories never scanned
+SKIPPED_DIRECTORIES = (".git", ".ipynb_checkpoints")
+
+DEFAULT_WORKERS = 8
+
+
+def _translate(pattern):
+    # gitignore glob to regex ("**" matches across directories, "*" doesn't)
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                regex += re.escape("[")
+                i += 1
+            else:
+                body = pattern[i + 1 : end].replace("\\", "\\\\")
+                regex += "[^" + body[1:] + "]" if body.startswith("!") else "[" + body + "]"
+                i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex + r"\Z"
+
+
+class IgnoreRule(object):
+    """One line of a .gitignore file in directory base."""
+
+    def __init__(self, base, line):
+        self.base = base
+        self.negated = line.startswith("!")
+        if self.negated:
+            line = line[1:]
+        self.directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        # patterns containing a slash are relative to base; others
+        # match a name at any depth
+        self.anchored = "/" in line
+        self.regex = re.compile(_translate(line.lstrip("/")))
+
+    def matches(self, path, is_directory):
+        if self.directory_only and not is_directory:
+            return False
+        relative = os.path.relpath(path, self.base).replace(os.path.sep, "/")
+        if relative.startswith("../"):
+            return False
+        return bool(self.regex.match(relative if self.anchored else relative.rsplit("/", 1)[-1]))
+
+
+def read_gitignore(directory):
+    """IgnoreRules from directory's .gitignore (none if it doesn't have one)."""
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        if not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith(("\\#", "\\!")):
+            line = line[1:]
+        rules.append(IgnoreRule(directory, line))
+    return rules
+
+
+def ignored(path, is_directory, rules):
+    """Whether path is ignored by rules (later rules take precedence)."""
+    result = False
+    for rule in rules:
+        if rule.negated == result and rule.matches(path, is_directory):
+            result = not rule.negated
+    return result
+
+
+def _matches_any(relative, patterns):
+    return any(fnmatch.fnmatch(relative, pattern) for pattern in patterns)
+
+
+def _scan(directory, root, rules, gitignore, exclude):
+    # (notebooks, (subdirectory, rules) pairs) of one directory
+    if gitignore:
+        rules = rules + read_gitignore(directory)
+    notebooks, subdirectories = [], []
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return notebooks, subdirectories
+    for entry in entries:
+        is_directory = entry.is_dir()
+        if is_directory and entry.name in SKIPPED_DIRECTORIES:
+            continue
+        if not is_directory and not entry.name.endswith(".ipynb"):
+            continue
+        if ignored(entry.path, is_directory, rules):
+            continue
+        if _matches_any(os.path.relpath(entry.path, root).replace(os.path.sep, "/"), exclude):
+            continue
+        if is_directory:
+            subdirectories.append((entry.path, rules))
+        else:
+            notebooks.append(entry.path)
+    return notebooks, subdirectories
+
+
+def find_notebooks(root, include=(), exclude=(), gitignore=True, workers=DEFAULT_WORKERS):
+    """
+    Yield the notebooks under directory root, as they're found.
+
+    include and exclude are globs matched against paths relative to
+    root ("/"-separated; "*" also matches "/"). Notebooks must match
+    one of include (if supplied) and none of exclude; directories
+    matching exclude aren't scanned. If gitignore, files and
+    directories ignored by .gitignore files under root are skipped.
+    """
+    root = os.path.abspath(root)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = {executor.submit(_scan, root, root, [], gitignore, exclude)}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                notebooks, subdirectories = future.result()
+                for directory, rules in subdirectories:
+                    pending.add(executor.submit(_scan, directory, root, rules, gitignore, exclude))
+                for notebook in notebooks:
+                    if not include or _matches_any(os.path.relpath(notebook, root).replace(os.path.sep, "/"), include):
+                        yield notebook
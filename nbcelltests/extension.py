@@ -5,16 +5,18 @@
 # This file is part of the nbcelltests library, distributed under the terms of
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
+import abc
 import json
 import nbformat
 import os
 import os.path
 import sys
+import time
 import tornado.gen
 import tornado.web
 from concurrent.futures import ThreadPoolExecutor
 from jupyter_server.base.handlers import JupyterHandler
-from jupyter_server.utils import url_path_join
+from jupyter_server.utils import ensure_async, url_path_join
 from tornado.concurrent import run_on_executor
 
 try:
@@ -23,68 +25,354 @@ except ImportError:
     from backports.tempfile import TemporaryDirectory
 
 from .lint import run as runLint
+from .lint.live import lint_cells
+from .metrics import CONTENT_TYPE, Registry
+from .sessions import RevisionMismatch, SessionStore
 from .test import run as runTest
 
+# cell metadata used by nbcelltests (the only cell metadata sent by the frontend)
+CELL_METADATA = ("celltests", "celltests_timeout")
 
-class RunCelltestsHandler(JupyterHandler):
-    executor = ThreadPoolExecutor(4)
+_NEW_CELL = {
+    "code": nbformat.v4.new_code_cell,
+    "markdown": nbformat.v4.new_markdown_cell,
+    "raw": nbformat.v4.new_raw_cell,
+}
 
-    def initialize(self, rules=None, executable=None):
+# threads running lint runs, and (separately) test runs
+EXECUTOR_THREADS = 4
+
+# the extension's metrics (see MetricsHandler)
+METRICS = Registry()
+REQUESTS = METRICS.counter(
+    "nbcelltests_requests_total", "Requests handled, by handler and response status.", ("handler", "status")
+)
+EXECUTOR_QUEUED = METRICS.gauge("nbcelltests_executor_queued", "Runs waiting for an executor thread.", ("kind",))
+EXECUTOR_ACTIVE = METRICS.gauge("nbcelltests_executor_active", "Runs on an executor thread.", ("kind",))
+EXECUTOR_THREADS_GAUGE = METRICS.gauge("nbcelltests_executor_threads", "Executor threads for runs.", ("kind",))
+EXECUTOR_THREADS_GAUGE.set(EXECUTOR_THREADS, kind="lint")
+EXECUTOR_THREADS_GAUGE.set(EXECUTOR_THREADS, kind="test")
+RUN_PHASE_SECONDS = METRICS.histogram(
+    "nbcelltests_run_phase_seconds",
+    "Time taken by each phase of lint and test runs (parse, queue, generate, startup, kernel_start, execution, lint).",
+    ("kind", "phase"),
+)
+ACTIVE_KERNELS = METRICS.gauge("nbcelltests_active_kernels", "Kernels running notebooks' tests.")
+CACHE_REQUESTS = METRICS.counter(
+    "nbcelltests_cache_requests_total",
+    "Lookups in the results of earlier lint runs of a notebook (results), and in analysis of its cells (cells).",
+    ("cache", "result"),
+)
+
+
+def notebook_from_sources(sources):
+    """
+    Build a notebook from the frontend's sources-only request format:
+
+      {"metadata": {...notebook metadata...},
+       "cells": [{"cell_type": ..., "source": ..., "metadata": {...celltests metadata...}}, ...]}
+
+    which leaves out outputs (and any other cell metadata), so is
+    much smaller to upload and parse than the full notebook model.
+    """
+    cells = []
+    for cell in sources.get("cells", []):
+        if cell.get("cell_type") not in _NEW_CELL:
+            raise ValueError("Unknown cell type %r" % (cell.get("cell_type"),))
+        metadata = {key: value for key, value in cell.get("metadata", {}).items() if key in CELL_METADATA}
+        cells.append(_NEW_CELL[cell["cell_type"]](source=cell.get("source", ""), metadata=metadata))
+    return nbformat.v4.new_notebook(cells=cells, metadata=sources.get("metadata", {}))
+
+
+def sources_from_notebook(nb):
+    """The sources-only format (see notebook_from_sources) of a notebook."""
+    cells = []
+    for cell in nb.get("cells", []):
+        metadata = {key: value for key, value in cell.get("metadata", {}).items() if key in CELL_METADATA}
+        cells.append({"cell_type": cell.get("cell_type"), "source": cell.get("source", ""), "metadata": metadata})
+    return {"metadata": nb.get("metadata", {}), "cells": cells}
+
+
+def _last_modified_token(last_modified):
+    # as serialized in contents API responses
+    return last_modified.isoformat().replace("+00:00", "Z")
+
+
+def _notebook_from_request(body):
+    if "sources" in body:
+        return notebook_from_sources(body["sources"])
+    # full notebook model (older frontends)
+    return nbformat.from_dict(body.get("model"))
+
+
+class _CountedHandler(JupyterHandler):
+    """Counts its requests, by metrics_name and response status."""
+
+    metrics_name = None
+
+    def on_finish(self):
+        REQUESTS.inc(handler=self.metrics_name, status=self.get_status())
+        super().on_finish()
+
+
+class _RunHandler(_CountedHandler, abc.ABC):
+    """
+    Runs something on a notebook posted as either:
+
+      {"path": ..., "sources": {...}}  (see notebook_from_sources)
+      {"path": ..., "revision": ..., "deltas": [...], "metadata": {...}}  (see sessions)
+      {"path": ..., "saved": ...}  (the saved file, with the supplied last_modified)
+      {"path": ..., "model": {...}}  (full notebook; older frontends)
+
+    The first three update the server's copy of the notebook, whose
+    revision is returned for the next request's deltas to be made
+    against. If the server doesn't hold the revision deltas were made
+    against, or the saved file has been modified since, the response
+    is 409 and the whole notebook must be sent.
+
+    If cache_results, the result of the last run of a session is
+    returned again while the notebook is unchanged.
+
+    The time taken by each phase of a run is observed in
+    nbcelltests_run_phase_seconds (see MetricsHandler).
+    """
+
+    # "lint" or "test"
+    kind = None
+    cache_results = False
+
+    def initialize(self, rules=None, executable=None, sessions=None):
         self.rules = rules
         self.executable = executable
+        self.sessions = sessions if sessions is not None else SessionStore()
 
     @tornado.web.authenticated
     def get(self):
         self.finish({"status": 0, "rules": self.rules})
 
+    @abc.abstractmethod
+    def _run_notebook(self, path, session=None, sources=None):
+        """Run on the notebook written to path (from session's sources, if any)."""
+
+    def _write_notebook(self, path, to_notebook, request):
+        started = time.monotonic()
+        nbformat.write(to_notebook(request), path)
+        self._phases["parse"] += time.monotonic() - started
+
     @run_on_executor
-    def _run(self, body, path, name):
-        with TemporaryDirectory() as tempdir:
-            path = os.path.abspath(os.path.join(tempdir, name))
-            node = nbformat.from_dict(body.get("model"))
-            nbformat.write(node, path)
-            ret = runTest(path, html=True, executable=self.executable, rules=self.rules)
-            return ret
+    def _run(self, body, name, session=None, sources=None, key=None):
+        EXECUTOR_QUEUED.dec(kind=self.kind)
+        EXECUTOR_ACTIVE.inc(kind=self.kind)
+        self._phases["queue"] = time.monotonic() - self._queued
+        try:
+            if key is not None:
+                with session.lock:
+                    cached_key, result = session.results.get(self.kind, (None, None))
+                CACHE_REQUESTS.inc(cache="results", result="hit" if cached_key == key else "miss")
+                if cached_key == key:
+                    return result
+
+            with TemporaryDirectory() as tempdir:
+                path = os.path.abspath(os.path.join(tempdir, name))
+                if session is None:
+                    self._write_notebook(path, _notebook_from_request, body)
+                    return self._run_notebook(path)
+                self._write_notebook(path, notebook_from_sources, sources)
+                result = self._run_notebook(path, session, sources)
+
+            if key is not None:
+                with session.lock:
+                    session.results[self.kind] = (key, result)
+            return result
+        finally:
+            EXECUTOR_ACTIVE.dec(kind=self.kind)
 
-    @tornado.web.authenticated
     @tornado.gen.coroutine
-    def post(self):
+    def _post(self):
+        # phase: seconds
+        self._phases = {}
+        started = time.monotonic()
         body = json.loads(self.request.body)
         path = os.path.join(os.getcwd(), body.get("path"))
         name = os.path.basename(path)
-        ret = yield self._run(body, path, name)
-        self.finish({"status": 0, "test": ret})
+        # (runs are of a copy, but histories are of the notebook itself)
+        self._origin = path
+        if "model" in body:
+            ret = yield self._run_timed(started, body, name)
+            return ret, None
 
+        try:
+            if "saved" in body:
+                session = yield self._saved_session(path, body)
+            else:
+                session = self.sessions.update(path, body)
+        except RevisionMismatch as e:
+            self.set_status(409)
+            self.finish({"status": -1, "error": str(e)})
+            return None, None
+        except ValueError as e:
+            self.set_status(400)
+            self.finish({"status": -1, "error": str(e)})
+            return None, None
+        # taken now, as further deltas may arrive while running
+        revision, sources = session.revision, session.sources()
+        key = session.key() if self.cache_results else None
+        ret = yield self._run_timed(started, body, name, session, sources, key)
+        return ret, revision
 
-class RunLintsHandler(JupyterHandler):
-    executor = ThreadPoolExecutor(4)
+    @tornado.gen.coroutine
+    def _run_timed(self, started, *args):
+        self._phases["parse"] = time.monotonic() - started
+        self._queued = time.monotonic()
+        EXECUTOR_QUEUED.inc(kind=self.kind)
+        try:
+            ret = yield self._run(*args)
+        finally:
+            for phase, seconds in self._phases.items():
+                RUN_PHASE_SECONDS.observe(seconds, kind=self.kind, phase=phase)
+        return ret
 
-    def initialize(self, rules=None, executable=None):
-        self.rules = rules
-        self.executable = executable
+    @tornado.gen.coroutine
+    def _saved_session(self, path, body):
+        """
+        path's session, read from the saved file through the contents
+        manager unless already read at the same last_modified.
+        """
+        session = self.sessions.get(path)
+        if session is None or session.saved != body["saved"]:
+            model = yield ensure_async(self.contents_manager.get(body["path"], content=True, type="notebook"))
+            saved = _last_modified_token(model["last_modified"])
+            if saved != body["saved"]:
+                raise RevisionMismatch(path, body["saved"], saved)
+            session = self.sessions.update(path, {"sources": sources_from_notebook(model["content"])})
+            session.saved = saved
+        return session
+
+
+class RunCelltestsHandler(_RunHandler):
+    # (separate from lint runs', so slow test runs don't hold up lints)
+    executor = ThreadPoolExecutor(EXECUTOR_THREADS)
+    kind = "test"
+    metrics_name = "test/run"
+
+    def initialize(self, rules=None, executable=None, fail_fast=False, sessions=None):
+        super().initialize(rules, executable, sessions)
+        self.fail_fast = fail_fast
+
+    def _run_notebook(self, path, session=None, sources=None):
+        # (each run starts a kernel)
+        ACTIVE_KERNELS.inc()
+        try:
+            return runTest(
+                path,
+                html=True,
+                executable=self.executable,
+                phases=self._phases,
+                rules=self.rules,
+                fail_fast=self.fail_fast,
+                origin=self._origin,
+            )
+        finally:
+            ACTIVE_KERNELS.dec()
 
     @tornado.web.authenticated
-    def get(self):
-        self.finish({"status": 0, "rules": self.rules})
+    @tornado.gen.coroutine
+    def post(self):
+        ret, revision = yield self._post()
+        if ret is not None:
+            self.finish({"status": 0, "test": ret, "revision": revision})
 
-    @run_on_executor
-    def _run(self, body, path, name):
-        with TemporaryDirectory() as tempdir:
-            path = os.path.abspath(os.path.join(tempdir, name))
-            node = nbformat.from_dict(body.get("model"))
-            nbformat.write(node, path)
-            ret, status = runLint(path, html=True, executable=self.executable, rules=self.rules)
-            return ret, status
-            self.finish({"status": status, "lint": ret})
+
+class RunLintsHandler(_RunHandler):
+    executor = ThreadPoolExecutor(EXECUTOR_THREADS)
+    kind = "lint"
+    metrics_name = "lint/run"
+    cache_results = True
+
+    def _run_notebook(self, path, session=None, sources=None):
+        cache = None
+        if session is not None:
+            # (a copy, so the lock isn't held while linting)
+            with session.lock:
+                session.prune()
+                cache = dict(session.lint_cache)
+            for source in set(cell.get("source", "") for cell in sources["cells"] if cell.get("cell_type") == "code"):
+                CACHE_REQUESTS.inc(cache="cells", result="hit" if source in cache else "miss")
+        started = time.monotonic()
+        try:
+            return runLint(
+                path, html=True, executable=self.executable, rules=self.rules, cache=cache, origin=self._origin
+            )
+        finally:
+            self._phases["lint"] = time.monotonic() - started
+            if session is not None:
+                with session.lock:
+                    session.lint_cache.update(cache)
 
     @tornado.web.authenticated
     @tornado.gen.coroutine
     def post(self):
+        ret, revision = yield self._post()
+        if ret is not None:
+            ret, status = ret
+            self.finish({"status": status, "lint": ret, "revision": revision})
+
+
+class LintCellsHandler(_CountedHandler):
+    """
+    Lints a few cells, quickly (e.g. while they're being edited):
+
+      {"path": ..., "cells": [{"index": ..., "source": ...}, ...], "context": [...]}
+
+    returning {"status": 0, "diagnostics": [...]} (see
+    lint.live.lint_cells). Names defined in context (names, or cells
+    as {"source": ...}) are treated as defined, as are those defined by
+    the code cells before each cell's index in the server's copy of the
+    notebook (if it holds one).
+    """
+
+    metrics_name = "lint/cells"
+
+    def initialize(self, rules=None, sessions=None):
+        self.rules = rules
+        self.sessions = sessions if sessions is not None else SessionStore()
+
+    @tornado.web.authenticated
+    def post(self):
+        # quick enough to run here rather than on an executor
         body = json.loads(self.request.body)
         path = os.path.join(os.getcwd(), body.get("path"))
-        name = os.path.basename(path)
-        ret, status = yield self._run(body, path, name)
-        self.finish({"status": status, "lint": ret})
+        context = body.get("context", [])
+        session = self.sessions.get(path)
+        rules = {}
+        if session is not None:
+            rules.update(session.metadata.get("celltests", {}))
+        rules.update(self.rules or {})
+
+        diagnostics = []
+        for cell in body.get("cells", []):
+            cell_context = context
+            if session is not None and isinstance(cell.get("index"), int):
+                previous = session.cells[: cell["index"]]
+                cell_context = context + [c for c in previous if c.get("cell_type") == "code"]
+            diagnostics.extend(lint_cells([cell], cell_context, rules))
+        self.finish({"status": 0, "diagnostics": diagnostics})
+
+
+class MetricsHandler(JupyterHandler):
+    """
+    The extension's metrics, in Prometheus' text format: requests
+    handled, runs waiting for and on executor threads, the time taken
+    by each phase of runs (parse: reading the request and writing the
+    notebook; queue: waiting for an executor thread; generate,
+    startup, kernel_start and execution: of test runs, see test.run;
+    lint: of lint runs), kernels running tests, and cache lookups.
+    """
+
+    @tornado.web.authenticated
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.finish(METRICS.render())
 
 
 def _load_jupyter_server_extension(nb_server_app):
@@ -108,6 +396,9 @@ def _load_jupyter_server_extension(nb_server_app):
     lint_executable = nb_server_app.config.get("JupyterLabCelltests", {}).get(
         "lint_executable", [sys.executable, "-m", "flake8", "--ignore=W391"]
     )
+    fail_fast = nb_server_app.config.get("JupyterLabCelltests", {}).get("fail_fast", False)
+    # copies of notebooks being edited, shared by the lint and test handlers
+    sessions = SessionStore()
 
     web_app.add_handlers(
         host_pattern,
@@ -115,7 +406,7 @@ def _load_jupyter_server_extension(nb_server_app):
             (
                 url_path_join(base_url, "celltests/test/run"),
                 RunCelltestsHandler,
-                {"rules": rules, "executable": test_executable},
+                {"rules": rules, "executable": test_executable, "fail_fast": fail_fast, "sessions": sessions},
             )
         ],
     )
@@ -125,7 +416,18 @@ def _load_jupyter_server_extension(nb_server_app):
             (
                 url_path_join(base_url, "celltests/lint/run"),
                 RunLintsHandler,
-                {"rules": rules, "executable": lint_executable},
+                {"rules": rules, "executable": lint_executable, "sessions": sessions},
+            )
+        ],
+    )
+    web_app.add_handlers(
+        host_pattern,
+        [
+            (
+                url_path_join(base_url, "celltests/lint/cells"),
+                LintCellsHandler,
+                {"rules": rules, "sessions": sessions},
             )
         ],
     )
+    web_app.add_handlers(host_pattern, [(url_path_join(base_url, "celltests/metrics"), MetricsHandler)])
@@ -0,0 +1,302 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Local (SQLite) history of celltest runs.
+
+TimingHistory keeps each cell+test's execution times, to spot cells
+getting slower. RunHistory keeps a record of every lint and test run of
+a notebook (the outcome of each check, with its cell's timing and
+memory), for finding the slowest and flakiest cells across many
+notebooks, and how runs change over time.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import time
+
+from .shared import MIN_RUNS
+
+# spread assumed for cells whose previous timings hardly vary (so that
+# e.g. a cell that always took 0.01s isn't flagged for taking 0.02s):
+# fraction of the mean, and seconds
+MIN_STDEV_FRACTION = 0.05
+MIN_STDEV = 0.01
+
+# seconds to wait for other processes (e.g. pytest-xdist workers)
+# writing to the same database
+LOCK_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cell_timings (
+    notebook TEXT NOT NULL,
+    cell_hash TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cell_timings_key ON cell_timings (notebook, cell_hash, environment, recorded);
+"""
+
+_RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    notebook TEXT NOT NULL,
+    notebook_hash TEXT,
+    kernel TEXT,
+    host TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL,
+    passed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS run_results (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    cell INTEGER,
+    cell_hash TEXT,
+    name TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    seconds REAL,
+    peak_memory INTEGER,
+    memory_used INTEGER,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS run_results_run ON run_results (run);
+"""
+
+# kinds of run, and outcomes of their checks
+RUN_KINDS = ("lint", "test")
+OUTCOMES = ("passed", "failed", "skipped")
+
+# sqlite strftime formats of the periods trends are reported over
+TREND_PERIODS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+
+def cell_hash(source):
+    """Hash identifying a cell+test's content."""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def notebook_hash(sources):
+    """Hash identifying a notebook's content (the sources of its cells or cells+tests)."""
+    return hashlib.sha256(json.dumps(list(sources)).encode("utf-8")).hexdigest()
+
+
+def _notebook_key(database, notebook):
+    # relative, so history follows a repository around (e.g. between CI checkouts)
+    return os.path.relpath(os.path.abspath(notebook), os.path.dirname(database)).replace(os.path.sep, "/")
+
+
+@contextlib.contextmanager
+def _connect(path):
+    db = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def default_environment(kernel_name):
+    """Environment timings are compared within: the kernel and machine."""
+    return "%s@%s" % (kernel_name, platform.node())
+
+
+def regression(seconds, previous, threshold):
+    """
+    Return (mean, stdev) of previous timings if seconds is more than
+    threshold standard deviations above their mean, otherwise None
+    (including when there are fewer than MIN_RUNS previous timings).
+    """
+    if len(previous) < MIN_RUNS:
+        return None
+    mean = statistics.mean(previous)
+    stdev = max(statistics.stdev(previous), mean * MIN_STDEV_FRACTION, MIN_STDEV)
+    if seconds > mean + threshold * stdev:
+        return mean, stdev
+    return None
+
+
+class TimingHistory(object):
+    """
+    Per-cell execution times of previous runs, keyed by notebook
+    (path relative to the database), cell+test content hash, and
+    environment.
+    """
+
+    def __init__(self, path, environment):
+        self.path = os.path.abspath(path)
+        self.environment = environment
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self):
+        return _connect(self.path)
+
+    def _notebook_key(self, notebook):
+        return _notebook_key(self.path, notebook)
+
+    def recent(self, notebook, source, window):
+        """Up to window most recent timings (seconds) of source in notebook."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT seconds FROM cell_timings WHERE notebook = ? AND cell_hash = ? AND environment = ? "
+                "ORDER BY recorded DESC LIMIT ?",
+                (self._notebook_key(notebook), cell_hash(source), self.environment, window),
+            ).fetchall()
+        return [seconds for (seconds,) in rows]
+
+    def record(self, notebook, source, seconds):
+        """Add a timing of source in notebook."""
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO cell_timings VALUES (?, ?, ?, ?, ?)",
+                (self._notebook_key(notebook), cell_hash(source), self.environment, seconds, time.time()),
+            )
+
+
+class RunHistory(object):
+    """
+    Lint and test runs of notebooks (path relative to the database):
+    when and where each ran, and the outcome of each of its checks.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with _connect(self.path) as db:
+            db.executescript(_RUNS_SCHEMA)
+
+    def record(self, kind, notebook, results, started, seconds=None, kernel=None, notebook_hash=None):
+        """
+        Add a run of notebook. results is a list of dictionaries, one
+        per check, of name and outcome ("passed", "failed" or
+        "skipped"), plus (where known) cell, cell_hash, seconds,
+        peak_memory, memory_used (bytes) and message. The run passed if
+        none of its checks failed.
+        """
+        passed = all(result["outcome"] != "failed" for result in results)
+        with _connect(self.path) as db:
+            run = db.execute(
+                "INSERT INTO runs (kind, notebook, notebook_hash, kernel, host, started, seconds, passed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    kind,
+                    _notebook_key(self.path, notebook),
+                    notebook_hash,
+                    kernel,
+                    platform.node(),
+                    started,
+                    seconds,
+                    passed,
+                ),
+            ).lastrowid
+            db.executemany(
+                "INSERT INTO run_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run,
+                        result.get("cell"),
+                        result.get("cell_hash"),
+                        result["name"],
+                        result["outcome"],
+                        result.get("seconds"),
+                        result.get("peak_memory"),
+                        result.get("memory_used"),
+                        result.get("message"),
+                    )
+                    for result in results
+                ],
+            )
+        return run
+
+    def _query(self, sql, parameters):
+        with _connect(self.path) as db:
+            db.row_factory = sqlite3.Row
+            return [dict(row) for row in db.execute(sql, parameters)]
+
+    def _filters(self, since, notebook, kind=None):
+        # (WHERE clause on runs, parameters)
+        clauses, parameters = ["1"], []
+        if since is not None:
+            clauses.append("runs.started >= ?")
+            parameters.append(since)
+        if notebook is not None:
+            clauses.append("runs.notebook = ?")
+            parameters.append(_notebook_key(self.path, notebook))
+        if kind is not None:
+            clauses.append("runs.kind = ?")
+            parameters.append(kind)
+        return " AND ".join(clauses), parameters
+
+    def slowest(self, limit=20, since=None, notebook=None):
+        """
+        Cells that took longest to execute on average in test runs
+        (since the time since, if supplied): a list of dictionaries of
+        notebook, cell, runs, mean_seconds, max_seconds and
+        max_peak_memory, slowest first.
+        """
+        where, parameters = self._filters(since, notebook, "test")
+        return self._query(
+            "SELECT runs.notebook AS notebook, cell, COUNT(*) AS runs, AVG(run_results.seconds) AS mean_seconds, "
+            "MAX(run_results.seconds) AS max_seconds, MAX(peak_memory) AS max_peak_memory "
+            "FROM run_results JOIN runs ON runs.id = run_results.run "
+            "WHERE %s AND cell IS NOT NULL AND run_results.seconds IS NOT NULL "
+            "GROUP BY runs.notebook, cell ORDER BY mean_seconds DESC LIMIT ?" % where,
+            parameters + [limit],
+        )
+
+    def flakiest(self, limit=20, since=None, notebook=None):
+        """
+        Cells whose tests both passed and failed without their
+        cell+test changing: a list of dictionaries of notebook, cell,
+        runs, failures and flips (how often the outcome changed from
+        one run to the next), flakiest first.
+        """
+        where, parameters = self._filters(since, notebook, "test")
+        rows = self._query(
+            "SELECT runs.notebook AS notebook, cell, cell_hash, outcome FROM run_results "
+            "JOIN runs ON runs.id = run_results.run "
+            "WHERE %s AND cell IS NOT NULL AND outcome != 'skipped' ORDER BY runs.started, runs.id" % where,
+            parameters,
+        )
+        cells = {}
+        for row in rows:
+            counts = cells.setdefault((row["notebook"], row["cell"], row["cell_hash"]), [0, 0, 0, None])
+            counts[0] += 1
+            counts[1] += row["outcome"] == "failed"
+            counts[2] += counts[3] is not None and counts[3] != row["outcome"]
+            counts[3] = row["outcome"]
+        flaky = [
+            {"notebook": notebook, "cell": cell, "runs": runs, "failures": failures, "flips": flips}
+            for (notebook, cell, _), (runs, failures, flips, _) in cells.items()
+            if 0 < failures < runs
+        ]
+        flaky.sort(key=lambda row: (-row["flips"] / (row["runs"] - 1), -row["failures"], row["notebook"], row["cell"]))
+        return flaky[:limit]
+
+    def trends(self, period="day", since=None, notebook=None, kind=None):
+        """
+        Runs per period ("day", "week" or "month", in local time): a
+        list of dictionaries of period, kind, runs, failed,
+        mean_seconds (of a run) and max_peak_memory (of a cell), oldest
+        first.
+        """
+        if period not in TREND_PERIODS:
+            raise ValueError("period must be one of %s, not %r" % (tuple(TREND_PERIODS), period))
+        where, parameters = self._filters(since, notebook, kind)
+        return self._query(
+            "SELECT strftime(?, started, 'unixepoch', 'localtime') AS period, kind, COUNT(*) AS runs, "
+            "SUM(NOT passed) AS failed, AVG(seconds) AS mean_seconds, "
+            "MAX((SELECT MAX(peak_memory) FROM run_results WHERE run = runs.id)) AS max_peak_memory "
+            "FROM runs WHERE %s GROUP BY period, kind ORDER BY period, kind" % where,
+            [TREND_PERIODS[period]] + parameters,
+        )
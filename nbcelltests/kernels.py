@@ -0,0 +1,165 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import ast
+import importlib
+import inspect
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from nbval.kernel import RunningKernel
+
+# seconds to wait for a reused kernel to change directory
+CHDIR_TIMEOUT = 10
+
+# seconds to wait for the kernel to evaluate an expression for us
+EVALUATE_TIMEOUT = 30
+
+
+class KernelPool(object):
+    """Starts kernels for notebooks.
+
+    With prestart enabled, a spare kernel is started in the background
+    whenever a kernel is handed out, so the next notebook using the
+    same kernel name doesn't have to wait for one to boot. Useful when
+    one process tests many notebooks one after another (e.g. a
+    pytest-xdist worker). Kernels are never shared between notebooks:
+    each spare is used once, after moving it to the notebook's
+    directory.
+    """
+
+    def __init__(self, prestart=False):
+        self.prestart = prestart
+        # keep spares through shutdown() (e.g. between pytest runs in one process)
+        self.keep = False
+        self._spares = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1)
+
+    def acquire(self, kernel_name, cwd):
+        """Return a running kernel with working directory cwd."""
+        with self._lock:
+            spare = self._spares.pop(kernel_name, None)
+            if self.prestart:
+                self._spares[kernel_name] = self._executor.submit(RunningKernel, kernel_name, cwd)
+
+        kernel = None
+        if spare is not None:
+            try:
+                kernel = spare.result()
+                _chdir(kernel, cwd)
+            except Exception:
+                # fall back to starting a kernel as usual
+                _stop_quietly(kernel)
+                kernel = None
+
+        return kernel or RunningKernel(kernel_name, cwd)
+
+    def warm(self, kernel_name, cwd=None):
+        """Start a spare kernel_name kernel, unless there already is one."""
+        with self._lock:
+            if kernel_name not in self._spares:
+                self._spares[kernel_name] = self._executor.submit(RunningKernel, kernel_name, cwd)
+
+    def shutdown(self, force=False):
+        """Stop any spare kernels (unless keeping them, and not force)."""
+        if self.keep and not force:
+            return
+        with self._lock:
+            spares, self._spares = self._spares, {}
+        for spare in spares.values():
+            try:
+                _stop_quietly(spare.result())
+            except Exception:
+                pass
+
+
+def _chdir(kernel, cwd):
+    msg_id = kernel.kc.execute(
+        "__import__('os').chdir(%r)" % os.path.abspath(cwd or os.curdir),
+        silent=True,
+        store_history=False,
+    )
+    kernel.await_reply(msg_id, timeout=CHDIR_TIMEOUT)
+
+
+def evaluate(kernel, expression, timeout=EVALUATE_TIMEOUT):
+    """
+    Evaluate expression in kernel's user namespace and return its
+    (JSON-serializable) value.
+
+    The expression is evaluated as a user expression of an empty
+    silent execution, so it doesn't appear in the kernel's history and
+    no code is registered as a cell.
+    """
+    msg_id = kernel.kc.execute(
+        "",
+        silent=True,
+        store_history=False,
+        user_expressions={"value": "__import__('json').dumps(%s)" % expression},
+    )
+    while True:
+        msg = kernel.get_message(stream="shell", timeout=timeout)
+        if msg["parent_header"].get("msg_id") == msg_id:
+            break
+    value = msg["content"]["user_expressions"]["value"]
+    if value["status"] != "ok":
+        raise Exception("Evaluating %s in kernel failed: %s: %s" % (expression, value["ename"], value["evalue"]))
+    return json.loads(ast.literal_eval(value["data"]["text/plain"]))
+
+
+def install_module(kernel, name):
+    """
+    Make nbcelltests.kernelside.<name> available in kernel, and return
+    an expression referring to it (for use with evaluate()).
+
+    The module's source is sent to the kernel, so nbcelltests doesn't
+    need to be installed in the kernel's environment.
+    """
+    module = "nbcelltests.kernelside." + name
+    installed = "_nbcelltests_" + name
+    source = inspect.getsource(importlib.import_module(module))
+    evaluate(
+        kernel,
+        "(lambda m: [exec(compile(%r, %r, 'exec'), m.__dict__), __import__('sys').modules.setdefault(%r, m)] and None)"
+        "(__import__('types').ModuleType(%r))" % (source, "<%s>" % module, installed, installed),
+    )
+    return "__import__('sys').modules[%r]" % installed
+
+
+def _stop_quietly(kernel):
+    if kernel is not None:
+        try:
+            kernel.stop()
+        except Exception:
+            pass
+
+
+_pool = KernelPool()
+
+
+def start_kernel(kernel_name, cwd):
+    """Start (or take a prestarted) kernel; see KernelPool."""
+    return _pool.acquire(kernel_name, cwd)
+
+
+def prestart_kernels(enable=True, kernel_names=()):
+    """Keep a spare kernel ready for the next notebook (starting kernel_names' now)."""
+    _pool.prestart = enable
+    for kernel_name in kernel_names:
+        _pool.warm(kernel_name)
+
+
+def keep_kernels(enable=True):
+    """Keep spare kernels when shutdown_kernels() is called (until forced)."""
+    _pool.keep = enable
+
+
+def shutdown_kernels(force=False):
+    """Stop any spare kernels."""
+    _pool.shutdown(force)
@@ -0,0 +1,13 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Helper modules that run inside the kernel under test.
+
+Their source is sent to the kernel (see kernels.install_module), which
+need not have nbcelltests installed, so they must be standalone and only
+use the standard library.
+"""
@@ -0,0 +1,157 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Saving the kernel's user namespace to a file, and restoring it.
+
+Modules are saved by name (and imported again on restore), as are the
+other modules the notebook imported (e.g. matplotlib.pyplot after
+"import matplotlib.pyplot", which only names matplotlib); everything
+else is serialized together with pickle, or dill if requested (which
+also handles functions and classes defined in the notebook). IPython's
+own names are left out, as are names matching the exclude globs.
+
+Only the namespace is restored: modules are imported afresh, so state
+the notebook changed inside them (e.g. random seeds, matplotlib.use(),
+pandas options) is lost, as are any other effects of the cells (e.g.
+files they wrote).
+
+Unpickling runs whatever code the file asks for, so only checkpoints
+private to the user (see untrusted) are restored: the checkpoint
+directory comes from the notebook's metadata, and could be shared.
+"""
+
+import fnmatch
+import importlib
+import os
+import pickle
+import re
+import stat
+import sys
+import types
+
+# names IPython keeps its history in (_, __, _i, _ii, _5, _i5, ...)
+_HISTORY = re.compile(r"(_+|_i+|_i?\d+)\Z")
+
+# modules already imported when this was installed (before the notebook ran)
+_preloaded = set(sys.modules)
+
+
+def _shell():
+    from IPython import get_ipython  # (the kernel's own)
+
+    return get_ipython()
+
+
+def _serializer(name):
+    if name == "dill":
+        import dill
+
+        return dill
+    return pickle
+
+
+def _not_saved(reason):
+    return {"saved": False, "names": 0, "reason": reason}
+
+
+def save(path, serializer="pickle", exclude=()):
+    """
+    Save the user namespace to path with serializer ("pickle" or
+    "dill"), leaving out names matching any of the exclude globs.
+
+    Returns a dictionary of saved (whether it was), names (how many)
+    and reason (why it wasn't saved).
+    """
+    shell = _shell()
+    hidden = shell.user_ns_hidden
+    modules, objects = {}, {}
+    for name, value in shell.user_ns.items():
+        if (name in hidden and hidden[name] is value) or _HISTORY.match(name):
+            continue
+        if name.startswith("__") and name.endswith("__"):
+            continue
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude):
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+        else:
+            objects[name] = value
+
+    try:
+        module = _serializer(serializer)
+    except ImportError:
+        return _not_saved("%s is not installed in the kernel" % serializer)
+    if module is pickle:
+        for name, value in objects.items():
+            defined = value if isinstance(value, (type, types.FunctionType)) else type(value)
+            if getattr(defined, "__module__", None) == "__main__":
+                # pickle refers to it by name, which won't exist on restore
+                return _not_saved("%r is defined in the notebook (use dill, or exclude it)" % name)
+    try:
+        data = module.dumps((modules, objects, _imported()), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        for name, value in objects.items():
+            try:
+                module.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as error:
+                return _not_saved("can't serialize %r: %s: %s" % (name, type(error).__name__, error))
+        return _not_saved("%s: %s" % (type(e).__name__, e))
+
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    # written in full then renamed, so a checkpoint is never seen half
+    # written (and readable and writable by the user only)
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return {"saved": True, "names": len(modules) + len(objects), "reason": None}
+
+
+def _imported():
+    # (not nbcelltests' own modules, installed in the kernel as _nbcelltests_*)
+    return sorted(name for name in set(sys.modules) - _preloaded if not name.startswith("_nbcelltests_"))
+
+
+def _untrusted(st):
+    if not stat.S_ISREG(st.st_mode):
+        return "not a regular file"
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return "owned by another user"
+    if st.st_mode & 0o022:
+        return "writable by others"
+    return None
+
+
+def untrusted(path):
+    """
+    Why the checkpoint at path can't be trusted (e.g. another user
+    could have written it), or None if it can.
+    """
+    return _untrusted(os.lstat(path))
+
+
+def restore(path, serializer="pickle"):
+    """
+    Restore the user namespace saved at path; returns how many names
+    were restored. Raises ValueError if the checkpoint can't be trusted.
+    """
+    # (checked after opening, so it's the file that was checked that's loaded)
+    with open(os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0)), "rb") as f:
+        reason = _untrusted(os.fstat(f.fileno()))
+        if reason is not None:
+            raise ValueError("not restoring %s: %s" % (path, reason))
+        modules, objects, imported = _serializer(serializer).load(f)
+    for module_name in imported:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            # (e.g. created at run time rather than imported)
+            pass
+    namespace = {name: importlib.import_module(module_name) for name, module_name in modules.items()}
+    namespace.update(objects)
+    _shell().user_ns.update(namespace)
+    return len(namespace)
@@ -0,0 +1,123 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Line coverage of notebook cell code, collected inside the kernel.
+
+Cell code is recognised by IPython having registered its source with
+linecache (with no file behind it). On Python 3.12+, lines are recorded
+using sys.monitoring, and each line location is disabled after its first
+hit, so instrumented code runs at full speed once its lines have been
+seen. Older versions fall back to sys.settrace, tracing only cell code.
+"""
+
+import ast
+import dis
+import linecache
+import sys
+import threading
+import types
+
+# cell filename: executed line numbers
+_executed = {}
+# cell filenames first executed since the last new_files()
+_new_files = []
+# filename: whether it's cell code
+_cell_files = {}
+# sys.monitoring tool id
+_tool = None
+
+
+def _is_cell(filename):
+    try:
+        return _cell_files[filename]
+    except KeyError:
+        entry = linecache.cache.get(filename)
+        is_cell = _cell_files[filename] = entry is not None and len(entry) == 4 and entry[1] is None
+        return is_cell
+
+
+def _record(filename, line):
+    lines = _executed.get(filename)
+    if lines is None:
+        lines = _executed[filename] = set()
+        _new_files.append(filename)
+    lines.add(line)
+
+
+def _py_start(code, offset):
+    if _is_cell(code.co_filename):
+        sys.monitoring.set_local_events(_tool, code, sys.monitoring.events.LINE)
+    return sys.monitoring.DISABLE
+
+
+def _line(code, line):
+    _record(code.co_filename, line)
+    return sys.monitoring.DISABLE
+
+
+def _trace(frame, event, arg):
+    if _is_cell(frame.f_code.co_filename):
+        return _trace_lines
+    return None
+
+
+def _trace_lines(frame, event, arg):
+    if event == "line":
+        _record(frame.f_code.co_filename, frame.f_lineno)
+    return _trace_lines
+
+
+def start():
+    """Start recording executed lines of cell code."""
+    global _tool
+    monitoring = getattr(sys, "monitoring", None)
+    if monitoring is not None:
+        # prefer the coverage tool id, but e.g. coverage.py may already be using it
+        free = [i for i in (monitoring.COVERAGE_ID, 3, 4) if monitoring.get_tool(i) is None]
+        if free:
+            _tool = free[0]
+            monitoring.use_tool_id(_tool, "nbcelltests")
+            monitoring.register_callback(_tool, monitoring.events.PY_START, _py_start)
+            monitoring.register_callback(_tool, monitoring.events.LINE, _line)
+            monitoring.set_events(_tool, monitoring.events.PY_START)
+            return
+    sys.settrace(_trace)
+    threading.settrace(_trace)
+
+
+def new_files():
+    """Cell files first executed since the previous call."""
+    files = list(_new_files)
+    del _new_files[:]
+    return files
+
+
+def _executable_lines(filename):
+    try:
+        code = compile(
+            "".join(linecache.getlines(filename)),
+            filename,
+            "exec",
+            getattr(ast, "PyCF_ALLOW_TOP_LEVEL_AWAIT", 0),
+            dont_inherit=True,
+        )
+    except SyntaxError:
+        return set()
+    lines = set()
+    codes = [code]
+    while codes:
+        code = codes.pop()
+        lines.update(line for _, line in dis.findlinestarts(code) if line)
+        codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+    return lines
+
+
+def report(filenames):
+    """{filename: [executable lines, executed lines]} for the supplied cell files."""
+    return {
+        filename: [sorted(_executable_lines(filename)), sorted(_executed.get(filename, ()))] for filename in filenames
+    }
@@ -0,0 +1,105 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Memory use of the kernel process while a cell runs.
+
+A background thread samples the process's resident set size (RSS)
+while the cell runs. Where available, the process's high-water mark
+(ru_maxrss) also catches peaks between samples (e.g. inside C code
+holding the GIL). Optionally, tracemalloc records which lines allocated
+the most memory.
+"""
+
+import linecache
+import sys
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# seconds between RSS samples
+SAMPLE_INTERVAL = 0.01
+
+_sampler = None
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def rss():
+    """Current resident set size (bytes), or the best estimate available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return _max_rss()
+
+
+class _Sampler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="nbcelltests-memory", daemon=True)
+        self.start_rss = self.peak_rss = rss()
+        self.start_max_rss = _max_rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, rss())
+
+    def finish(self):
+        self._done.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, rss())
+        max_rss = _max_rss()
+        if max_rss is not None and max_rss > self.start_max_rss:
+            # the process's peak was reached during the cell
+            self.peak_rss = max(self.peak_rss, max_rss)
+
+
+def begin(top_allocators=0):
+    """Start measuring (call just before the cell runs)."""
+    global _sampler
+    if top_allocators:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.clear_traces()
+    if rss() is not None:
+        _sampler = _Sampler()
+        _sampler.start()
+
+
+def end(top_allocators=0):
+    """
+    Stop measuring, and return a dictionary of start_memory and
+    peak_memory (bytes; None if unavailable), plus top_allocators: a
+    list of [filename, line number, source line, bytes] for the lines
+    that allocated the most memory still in use.
+    """
+    global _sampler
+    sampler, _sampler = _sampler, None
+    if sampler is not None:
+        sampler.finish()
+    result = {
+        "start_memory": sampler and sampler.start_rss,
+        "peak_memory": sampler and sampler.peak_rss,
+        "top_allocators": [],
+    }
+    if top_allocators and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        for stat in snapshot.statistics("lineno")[:top_allocators]:
+            frame = stat.traceback[0]
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            result["top_allocators"].append([frame.filename, frame.lineno, source, stat.size])
+    return result
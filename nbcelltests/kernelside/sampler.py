@@ -0,0 +1,130 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Sampling the kernel's stack while a cell runs (for flame graphs).
+
+A background thread samples the main thread's stack while the cell
+runs, weighting each sample by the time since the previous one (samples
+can be late, e.g. while C code holds the GIL). Only the cell's own
+frames, and those of what it calls, are kept: the kernel's frames below
+the cell are dropped, as are samples taken while the kernel wasn't
+running a cell.
+"""
+
+import os
+import sys
+import threading
+import time
+
+# default seconds between samples
+SAMPLE_INTERVAL = 0.001
+
+# filename: label, of the code cells seen so far
+_cell_files = {}
+# filename: label, of other files
+_file_labels = {}
+_sampler = None
+
+
+def _compiled_files():
+    # files IPython has compiled cells as (in order)
+    try:
+        from IPython import get_ipython  # (the kernel's own)
+
+        return list(getattr(get_ipython().compile, "_filename_map", {}))
+    except Exception:
+        return []
+
+
+def _file_label(filename):
+    label = _cell_files.get(filename)
+    if label is None:
+        label = _file_labels.get(filename)
+    if label is None:
+        # relative to the sys.path entry it was imported from (e.g. pandas/core/frame.py)
+        label = filename
+        for entry in sorted((os.path.join(os.path.abspath(p), "") for p in sys.path if p), key=len, reverse=True):
+            if filename.startswith(entry):
+                label = filename[len(entry) :]
+                break
+        _file_labels[filename] = label
+    return label
+
+
+def _frame_label(code):
+    # (";" separates frames in collapsed stacks)
+    return ("%s (%s:%d)" % (code.co_name, _file_label(code.co_filename), code.co_firstlineno)).replace(";", ",")
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, cell, interval):
+        super().__init__(name="nbcelltests-sampler", daemon=True)
+        self.cell = cell
+        self.interval = interval
+        self.main = threading.main_thread().ident
+        self.compiled = len(_compiled_files())
+        # stack: seconds
+        self.stacks = {}
+        self._done = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.main)
+            if frame is not None:
+                self._add(frame, now - last)
+            last = now
+
+    def _add(self, frame, seconds):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        # the cell's frames are those IPython's run_code runs (the first
+        # run_code: the cell may run more code itself, e.g. with %run)
+        for i, code in enumerate(codes):
+            if code.co_name == "run_code" and code.co_filename.endswith("interactiveshell.py"):
+                codes = codes[i + 1 :]
+                break
+        else:
+            return
+        if not codes:
+            return
+        _cell_files.setdefault(codes[0].co_filename, "code cell %d" % self.cell)
+        stack = ";".join(_frame_label(code) for code in codes)
+        self.stacks[stack] = self.stacks.get(stack, 0) + seconds
+
+    def finish(self):
+        self._done.set()
+        self.join()
+
+
+def begin(cell, interval=SAMPLE_INTERVAL):
+    """Start sampling (call just before code cell number cell runs)."""
+    global _sampler
+    _sampler = _Sampler(cell, interval)
+    _sampler.start()
+
+
+def end():
+    """
+    Stop sampling, and return a dictionary of the sampled stacks (as
+    frames separated by ";", outermost first) to the microseconds spent
+    in them.
+    """
+    global _sampler
+    sampler, _sampler = _sampler, None
+    if sampler is None:
+        return {}
+    sampler.finish()
+    # (so functions the cell defined are named after it in later cells' profiles)
+    for filename in _compiled_files()[sampler.compiled :]:
+        _cell_files.setdefault(filename, "code cell %d" % sampler.cell)
+    stacks = {stack: int(round(seconds * 1e6)) for stack, seconds in sampler.stacks.items()}
+    return {stack: microseconds for stack, microseconds in stacks.items() if microseconds > 0}
@@ -0,0 +1,175 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Running cells in forked copies of the kernel process (Linux only).
+
+Each cell+test started here runs in a child process forked from the
+kernel, i.e. on a copy of the kernel's state at the time, and the
+kernel itself is left as it was. Children run in parallel (up to a
+number of workers at once) and can't affect each other.
+
+Only the forking thread survives a fork, and the kernel's connections
+to the frontend can't be shared with a child, so a child doesn't run
+its cell as a kernel execution: it runs the (transformed) code in the
+user namespace directly, discards anything it prints or displays, and
+writes its result to a file for the kernel to pick up.
+"""
+
+import io
+import json
+import linecache
+import os
+import signal
+import sys
+import tempfile
+import time
+import traceback
+import warnings
+
+# prctl option: signal to get when the parent exits
+PR_SET_PDEATHSIG = 1
+
+# cell: [pid, result file, start time, timeout] of running children
+_children = {}
+# [cell, source, timeout] of cells waiting for a worker
+_queue = []
+# cell: result of finished children (until polled)
+_results = {}
+_workers = 1
+
+
+def supported():
+    """Whether cells can be run in forks of this process."""
+    return sys.platform.startswith("linux") and hasattr(os, "fork")
+
+
+def start(cells, workers=None):
+    """
+    Run cells (a list of [cell, source, timeout in seconds or None])
+    in forks of the kernel as it is now, up to workers (default: the
+    number of CPUs) at a time.
+    """
+    global _workers
+    _workers = workers or os.cpu_count() or 1
+    _queue.extend(cells)
+    _launch()
+
+
+def poll(cell):
+    """
+    None while cell is still running (or waiting to start); otherwise
+    a dictionary of status ("ok", "error" or "timeout"), seconds, and
+    (for errors) traceback lines.
+    """
+    _reap()
+    _launch()
+    return _results.pop(cell, None)
+
+
+def stop():
+    """Kill any running children, and forget about cells not yet started."""
+    del _queue[:]
+    _results.clear()
+    for cell in list(_children):
+        pid, path = _children.pop(cell)[:2]
+        _kill(pid, path)
+
+
+def _launch():
+    while _queue and len(_children) < _workers:
+        cell, source, timeout = _queue.pop(0)
+        fd, path = tempfile.mkstemp(prefix="nbcelltests-snapshot-", suffix=".json")
+        os.close(fd)
+        parent = os.getpid()
+        with warnings.catch_warnings():
+            # forking a multi-threaded process: fine, as the child only runs the cell and exits
+            warnings.simplefilter("ignore", DeprecationWarning)
+            pid = os.fork()
+        if pid == 0:
+            _child(parent, cell, source, path)
+        _children[cell] = [pid, path, time.monotonic(), timeout]
+
+
+def _child(parent, cell, source, path):
+    # never returns
+    status = 1
+    try:
+        _die_with(parent)
+        from IPython import get_ipython  # (the kernel's own)
+
+        shell = get_ipython()
+        sys.stdout = sys.stderr = io.StringIO()
+        shell.display_pub.publish = lambda *args, **kwargs: None
+        code = shell.transform_cell(source)
+        filename = "<code cell %d>" % cell
+        linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+        start = time.perf_counter()
+        try:
+            exec(compile(code, filename, "exec"), shell.user_ns)
+            result = {"status": "ok"}
+        except BaseException:
+            error_type, error, tb = sys.exc_info()
+            # (without this function's frame)
+            lines = traceback.format_exception(error_type, error, tb.tb_next)
+            result = {"status": "error", "traceback": "".join(lines).splitlines()}
+        result["seconds"] = time.perf_counter() - start
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def _die_with(parent):
+    # don't outlive a kernel that's shut down
+    try:
+        import ctypes
+
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except Exception:
+        pass
+    if os.getppid() != parent:
+        os._exit(1)
+
+
+def _reap():
+    now = time.monotonic()
+    for cell, (pid, path, started, timeout) in list(_children.items()):
+        if timeout is not None and now - started > timeout:
+            _kill(pid, path)
+            result = {"status": "timeout", "seconds": now - started}
+        else:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+            result = _read(path, status)
+            os.remove(path)
+        del _children[cell]
+        _results[cell] = result
+
+
+def _read(path, status):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # e.g. the cell called os._exit(), or crashed the interpreter
+        code = os.waitstatus_to_exitcode(status)
+        reason = "killed by signal %d" % -code if code < 0 else "exited with status %d" % code
+        return {"status": "error", "seconds": 0.0, "traceback": ["Forked kernel process %s" % reason]}
+
+
+def _kill(pid, path):
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,84 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Tracing the kernel's cell executions to a trace file.
+
+Appends a span for each cell the kernel runs (not silent executions,
+such as nbcelltests' own) to the same file, in the same format, as
+nbcelltests.tracing.
+"""
+
+import json
+import os
+import threading
+import time
+
+# path of the trace file, while tracing
+_path = None
+_started = None
+
+
+def _write(events):
+    data = "".join(json.dumps(event) + ",\n" for event in events).encode("utf-8")
+    fd = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _shell():
+    from IPython import get_ipython  # (the kernel's own)
+
+    return get_ipython()
+
+
+def _pre_run_cell(info):
+    global _started
+    _started = (time.time() * 1e6, info.raw_cell)
+
+
+def _post_run_cell(result):
+    global _started
+    if _started is None or _path is None:
+        return
+    start, source = _started
+    _started = None
+    lines = source.strip().split("\n")
+    event = {
+        "name": "run_cell",
+        "cat": "kernel",
+        "ph": "X",
+        "ts": start,
+        "dur": max(0.0, time.time() * 1e6 - start),
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": {"source": lines[0] + (" ..." if len(lines) > 1 else ""), "success": result.success},
+    }
+    _write([event])
+
+
+def start(path, name="kernel"):
+    """Trace cells run from now on to path, naming this process name."""
+    global _path
+    stop()
+    _path = path
+    _write([{"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0, "args": {"name": name}}])
+    events = _shell().events
+    events.register("pre_run_cell", _pre_run_cell)
+    events.register("post_run_cell", _post_run_cell)
+
+
+def stop():
+    """Stop tracing."""
+    global _path
+    if _path is None:
+        return
+    _path = None
+    events = _shell().events
+    events.unregister("pre_run_cell", _pre_run_cell)
+    events.unregister("post_run_cell", _post_run_cell)
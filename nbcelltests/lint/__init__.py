@@ -5,15 +5,18 @@
 # This file is part of the nbcelltests library, distributed under the terms of
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
-import nbformat
+import json
 import os
+import re
 import subprocess
 import sys
-from nbconvert import PythonExporter
-from tempfile import NamedTemporaryFile
+import tempfile
+import time
 
+from .. import tracing
 from ..define import LintMessage, LintType
-from ..shared import extract_extrametadata
+from ..reader import read
+from ..shared import extract_extrametadata, ipython_to_python, resolve_metadata_paths
 from .rules import (
     lint_cells_per_notebook,
     lint_class_definitions,
@@ -25,7 +28,18 @@ from .rules import (
 
 # noqa: F401
 
+# python linters: flake8 checks the notebook converted to a script, and
+# ruff reads notebooks itself; each problem either finds is reported
+# for its cell
+LINTERS = ("flake8", "ruff")
+DEFAULT_LINTER = ("flake8", "--ignore=W391")
+DEFAULT_RUFF = ("ruff", "check")
 
+# flake8's (default) output format
+_LINTER_OUTPUT = re.compile(r"^(?P<path>.+?):(?P<row>\d+):(?P<column>\d+): (?P<problem>.*)$")
+
+
+@tracing.traced("lint.run")
 def run(
     notebook,
     html=False,
@@ -33,16 +47,91 @@ def run(
     rules=None,
     noqa_regex=None,
     run_python_linter=False,
+    validate=False,
+    cache=None,
+    linter="flake8",
+    origin=None,
 ):
-    nb = nbformat.read(notebook, 4)
-    extra_metadata = extract_extrametadata(nb, noqa_regex=noqa_regex)
-    print(executable)
-    executable = executable or ["flake8", "--ignore=W391"]
+    """
+    Lint notebook against rules (plus any in its celltests metadata),
+    and with the python linter if run_python_linter; returns
+    (LintMessages, passed), or (html, passed) if html, passed being
+    whether the rules passed and the linter found nothing. origin is
+    the notebook's own path if notebook is a copy of it (e.g. the
+    server extension's).
+    """
+    if linter not in LINTERS:
+        raise ValueError("Unknown linter %r (expected one of %s)" % (linter, ", ".join(LINTERS)))
+    started = time.time()
+    with tracing.span("read"):
+        nb = read(notebook, validate=validate)
+    with tracing.span("extract_extrametadata"):
+        extra_metadata = extract_extrametadata(nb, noqa_regex=noqa_regex, cache=cache)
+    resolve_metadata_paths(extra_metadata, origin or notebook)
+    ret, passed = check_rules(extra_metadata, rules)
+
+    if run_python_linter:
+        # (as for many notebooks, so both report findings the same way)
+        name = origin or notebook
+        with tracing.span("lint_batch", linter=linter):
+            findings, _ = lint_batch({name: nb}, executable, linter, paths={name: notebook})
+        ret.extend(linter_messages(findings[name]))
+    # (as with pre-commit, the python linter's findings fail a notebook)
+    passed = passed and all(message.passed for message in ret if message.type == LintType.LINTER)
+
+    if extra_metadata.get("run_history"):
+        with tracing.span("record_run_history"):
+            record_run(
+                extra_metadata["run_history"], origin or notebook, nb, ret, started, seconds=time.time() - started
+            )
+
+    if html:
+        ret_html = ""
+        for lint in ret:
+            lint = lint.to_html()
+            ret_html += "<p>" + lint + "</p>"
+        return (
+            '<div style="display: flex; flex-direction: column;">' + ret_html + "</div>",
+            passed,
+        )
+
+    return ret, passed
+
+
+def record_run(path, notebook, nb, messages, started, seconds=None):
+    """Record a lint run of notebook (nb, or None if it couldn't be read) in the RunHistory at path."""
+    from ..history import RunHistory, notebook_hash
+
+    results = []
+    for message in messages:
+        if isinstance(message, LintMessage):
+            results.append(
+                {
+                    "cell": message.cell if message.cell > 0 else None,
+                    "name": message.type.value,
+                    "outcome": "passed" if message.passed else "failed",
+                    "message": message.message.strip().split("\n")[0],
+                }
+            )
+        else:
+            # an error
+            results.append({"name": "error", "outcome": "failed", "message": str(message)})
+    content = None
+    if nb is not None:
+        content = notebook_hash(cell.source for cell in nb.cells if cell.cell_type == "code")
+    RunHistory(path).record("lint", notebook, results, started, seconds=seconds, notebook_hash=content)
+
+
+def check_rules(extra_metadata, rules=None):
+    """
+    Check the notebook described by extra_metadata (see
+    shared.extract_extrametadata) against rules (plus any in its
+    celltests metadata); returns (LintMessages, passed).
+    """
     ret = []
     passed = True
 
-    rules = rules or {}
-    extra_metadata.update(rules)
+    extra_metadata.update(rules or {})
 
     # TODO: consider warning if referring to non-existent rules
     # set() is for python 2; remove when py2 is fully dropped
@@ -99,43 +188,212 @@ def run(
         ret.extend(lintret)
         passed = passed and lintpassed
 
-    if run_python_linter:
-        exp = PythonExporter(exclude_raw=True)
-        (body, resources) = exp.from_notebook_node(nb)
-        tf = NamedTemporaryFile(mode="w", suffix=".py", delete=False, encoding="utf8")
-        tf_name = tf.name
-        try:
-            tf.write(body)
-            tf.close()
-            executable.append(tf_name)
-            ret2 = _run_and_capture_utf8(executable)
-            msg = ret2.stdout + "\t" + ret2.stderr
-            msg = "\n".join(
-                "\t{}".format(_)
-                for _ in msg.strip().replace(tf_name, "{} (in {})".format(notebook, tf_name)).split("\n")
-            )
-            ret.append(
-                LintMessage(
-                    -1,
-                    "Checking lint:\n" + msg,
-                    LintType.LINTER,
-                    False if msg else True,
-                )
-            )
-        finally:
-            os.remove(tf_name)
+    return ret, passed
 
-    if html:
-        ret_html = ""
-        for lint in ret:
-            lint = lint.to_html()
-            ret_html += "<p>" + lint + "</p>"
-        return (
-            '<div style="display: flex; flex-direction: column;">' + ret_html + "</div>",
-            passed,
+
+def run_ruff(notebooks, executable=None):
+    """
+    Lint notebooks (paths) with one run of ruff, returning {notebook:
+    diagnostics}. Diagnostics are as in ruff's json output: "cell" (the
+    cell's 1-based position in the notebook), "location" ({"row",
+    "column"} in the cell), "code", "message", etc.
+    """
+    if not notebooks:
+        return {}
+    executable = list(executable or DEFAULT_RUFF)
+    result = _run_and_capture_utf8(executable + ["--output-format=json", "--exit-zero", "--"] + list(notebooks))
+    try:
+        diagnostics = json.loads(result.stdout)
+    except ValueError:
+        raise RuntimeError("ruff failed: %s" % (result.stderr.strip() or result.stdout.strip()))
+
+    found = {notebook: [] for notebook in notebooks}
+    # ruff reports absolute paths
+    paths = {os.path.realpath(notebook): notebook for notebook in notebooks}
+    for diagnostic in diagnostics:
+        notebook = paths.get(os.path.realpath(diagnostic["filename"]))
+        if notebook is not None:
+            found[notebook].append(diagnostic)
+    return found
+
+
+def _ruff_finding(diagnostic, name):
+    # (cell, text) of one of ruff's diagnostics
+    location = diagnostic.get("location") or {}
+    problem = " ".join(filter(None, [diagnostic.get("code"), diagnostic["message"]]))
+    return diagnostic.get("cell") or -1, "{}:{}:{}: {}".format(
+        name, location.get("row"), location.get("column"), problem
+    )
+
+
+def linter_messages(findings):
+    """A LintMessage for each (cell, text) finding of the linter (or one saying there were none)."""
+    if not findings:
+        return [LintMessage(-1, "Checking lint", LintType.LINTER, True)]
+    return [LintMessage(cell, "Checking lint: " + text, LintType.LINTER, False) for cell, text in findings]
+
+
+def _script(nb):
+    """
+    The notebook as a python script, as linted by flake8 (see
+    lint_batch), and
+    the (first line, last line, cell) of each code cell's code in it
+    (cell being the 1-based position of the cell in the notebook).
+    """
+    from nbconvert import PythonExporter
+
+    body, _ = PythonExporter(exclude_raw=True).from_notebook_node(nb)
+    spans = []
+    pos = 0
+    for cell_number, cell in enumerate(nb.cells, start=1):
+        if cell.cell_type != "code":
+            continue
+        # as the exporter converts it (and at the start of a line, so
+        # not in a markdown cell's comment)
+        code = ipython_to_python(cell.source).rstrip("\n")
+        if not code:
+            continue
+        start = body.find("\n" + code, pos)
+        if start < 0:
+            continue
+        first = body.count("\n", 0, start) + 2
+        spans.append((first, first + code.count("\n"), cell_number))
+        pos = start + 1 + len(code)
+    return body, spans
+
+
+def _cell_row(spans, row):
+    # (cell, row in the cell) of a script row; (-1, row) if no cell's
+    for first, last, cell_number in spans:
+        if first <= row <= last:
+            return cell_number, row - first + 1
+    return -1, row
+
+
+def lint_batch(notebooks, executable=None, linter="flake8", paths=None):
+    """
+    Run the python linter once on notebooks ({name: notebook}, as read
+    by reader.read), with the linter's own parallelism.
+
+    Returns ({name: [(cell, text), ...]}, whether all of the linter's
+    output could be attributed to a notebook), cell being the 1-based
+    position in the notebook of the cell a problem was found in (-1 if
+    none), and text being like "name:row:column: code message" (row
+    within the cell, or of the script flake8 checked if not in a
+    cell). Output that can't be attributed (e.g. an error from the
+    linter itself) is included for every notebook, with cell -1.
+
+    paths ({name: path}) are the notebooks' files, if on disk; ruff
+    lints those directly (with their directories' ruff configuration).
+    """
+    names = list(notebooks)
+    findings = {name: [] for name in names}
+    paths = paths or {}
+    with tempfile.TemporaryDirectory() as directory:
+        if linter == "ruff":
+            import nbformat
+
+            filenames = []
+            for i, name in enumerate(names):
+                filename = paths.get(name)
+                if filename is None:
+                    filename = os.path.join(directory, "notebook%d.ipynb" % i)
+                    with open(filename, "w", encoding="utf-8") as f:
+                        f.write(nbformat.writes(notebooks[name]))
+                filenames.append(filename)
+            try:
+                diagnostics = run_ruff(filenames, executable)
+            except RuntimeError as e:
+                return {name: [(-1, str(e))] for name in names}, False
+            for name, filename in zip(names, filenames):
+                findings[name].extend(_ruff_finding(diagnostic, name) for diagnostic in diagnostics[filename])
+            return findings, True
+
+        spans = []
+        filenames = []
+        for i, name in enumerate(names):
+            body, cell_spans = _script(notebooks[name])
+            spans.append(cell_spans)
+            filenames.append(os.path.join(directory, "notebook%d.py" % i))
+            with open(filenames[-1], "w", encoding="utf8") as f:
+                f.write(body)
+        result = _run_and_capture_utf8(list(executable or DEFAULT_LINTER) + filenames)
+
+    indexes = {filename: i for i, filename in enumerate(filenames)}
+    attributed = True
+    for line in (result.stdout + "\n" + result.stderr).splitlines():
+        if not line.strip():
+            continue
+        match = _LINTER_OUTPUT.match(line)
+        i = indexes.get(match.group("path")) if match else None
+        if i is None:
+            attributed = False
+            for name in names:
+                findings[name].append((-1, line))
+            continue
+        cell, row = _cell_row(spans[i], int(match.group("row")))
+        # (outside the code cells, e.g. in markdown as comments, rows are the script's)
+        name = names[i] if cell > 0 else "%s (as a script)" % names[i]
+        findings[names[i]].append(
+            (cell, "{}:{}:{}: {}".format(name, row, match.group("column"), match.group("problem")))
         )
+    return findings, attributed
 
-    return ret, passed
+
+def run_many(
+    notebooks,
+    rules=None,
+    executable=None,
+    noqa_regex=None,
+    run_python_linter=False,
+    validate=False,
+    cache=None,
+    linter="flake8",
+):
+    """
+    Like run (without html), for many notebooks, but running the python
+    linter once for all of them, and reporting each of its findings for
+    the cell it's in. Returns a list of (notebook, LintMessages, passed);
+    a notebook that couldn't be read or analysed gets an error message.
+    """
+    if linter not in LINTERS:
+        raise ValueError("Unknown linter %r (expected one of %s)" % (linter, ", ".join(LINTERS)))
+    started = time.time()
+    notebooks = list(notebooks)
+    results = {}
+    to_lint = {}
+    # notebook: RunHistory path (if recording its run)
+    histories = {}
+    for notebook in notebooks:
+        histories[notebook] = (rules or {}).get("run_history")
+        try:
+            with tracing.span("read", notebook=notebook):
+                nb = read(notebook, validate=validate)
+            with tracing.span("extract_extrametadata", notebook=notebook):
+                extra_metadata = extract_extrametadata(nb, noqa_regex=noqa_regex, cache=cache)
+            resolve_metadata_paths(extra_metadata, notebook)
+            results[notebook] = check_rules(extra_metadata, rules)
+        except Exception as e:
+            results[notebook] = (["ERROR: %s: %s" % (type(e).__name__, e)], False)
+            continue
+        histories[notebook] = extra_metadata.get("run_history")
+        to_lint[notebook] = nb
+
+    if run_python_linter and to_lint:
+        paths = {notebook: notebook for notebook in to_lint}
+        with tracing.span("lint_batch", linter=linter, notebooks=len(to_lint)):
+            findings, _ = lint_batch(to_lint, executable, linter, paths=paths)
+        for notebook in to_lint:
+            messages, passed = results[notebook]
+            messages.extend(linter_messages(findings[notebook]))
+            results[notebook] = (messages, passed and not findings[notebook])
+
+    for notebook in notebooks:
+        if histories[notebook]:
+            # (notebooks are linted together, so have no time of their own)
+            record_run(histories[notebook], notebook, to_lint.get(notebook), results[notebook][0], started)
+
+    return [(notebook,) + tuple(results[notebook]) for notebook in notebooks]
 
 
 def _run_and_capture_utf8(args):
@@ -0,0 +1,174 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Linting of individual cells, quick enough to run while typing.
+
+Cells are checked in memory with pyflakes, plus the lint rules that
+apply to a single cell (lines_per_cell, magics). Names defined by other
+cells (the "context") are treated as defined. Results are returned as
+structured diagnostics rather than html, and are cached per cell
+source and context.
+"""
+
+import ast
+import functools
+from pyflakes import messages
+from pyflakes.checker import Checker
+
+from ..shared import code_facts, ipython_to_python
+from .rules import lint_lines_per_cell, lint_magics
+
+# cells whose results are kept
+CACHE_SIZE = 4096
+
+# reported by the whole-notebook lint instead, as (unlike undefined
+# names) other cells decide whether they're a problem
+IGNORED = (messages.UnusedImport,)
+
+# names defined in every IPython kernel
+IPYTHON_NAMES = frozenset(["get_ipython", "display", "In", "Out", "exit", "quit"])
+
+
+class _NameCollector(ast.NodeVisitor):
+    """Collects names a cell defines at the top level."""
+
+    def __init__(self):
+        self.names = set()
+        self.star_import = False
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self.names.add(node.id)
+
+    def _visit_definition(self, node):
+        # the body is a different scope
+        self.names.add(node.name)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_definition
+
+    def visit_Lambda(self, node):
+        return
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.names.add(alias.asname or alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                self.star_import = True
+            else:
+                self.names.add(alias.asname or alias.name)
+
+
+_code_facts = functools.lru_cache(maxsize=CACHE_SIZE)(code_facts)
+
+
+def _parse(source):
+    # None for code pyflakes can't check (cell magics' contents aren't python)
+    code = ipython_to_python(source)
+    if code.lstrip().startswith("get_ipython().run_cell_magic("):
+        return None
+    return ast.parse(code)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def defined_names(source):
+    """(names defined by a cell, whether it has a star import)."""
+    try:
+        tree = _parse(source)
+    except SyntaxError:
+        return frozenset(), False
+    if tree is None:
+        return frozenset(), False
+    collector = _NameCollector()
+    collector.visit(tree)
+    return frozenset(collector.names), collector.star_import
+
+
+def _diagnostic(cell, line, column, message, type, code, severity="warning"):
+    return {
+        "cell": cell,
+        "line": line,
+        "column": column,
+        "message": message,
+        "type": type,
+        "code": code,
+        "severity": severity,
+    }
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _pyflakes(source, context, star_import):
+    # (line, column, message, code, severity) tuples
+    try:
+        tree = _parse(source)
+    except SyntaxError as e:
+        return ((e.lineno, e.offset, e.msg, "SyntaxError", "error"),)
+    if tree is None:
+        return ()
+    checker = Checker(tree, filename="<cell>", builtins=context | IPYTHON_NAMES)
+    found = []
+    for message in sorted(checker.messages, key=lambda message: (message.lineno, message.col)):
+        if isinstance(message, IGNORED):
+            continue
+        if star_import and isinstance(message, messages.UndefinedName):
+            # could come from another cell's star import
+            continue
+        severity = "error" if isinstance(message, messages.UndefinedName) else "warning"
+        found.append(
+            (message.lineno, message.col + 1, message.message % message.message_args, type(message).__name__, severity)
+        )
+    return tuple(found)
+
+
+def lint_cells(cells, context=(), rules=None):
+    """
+    Lint cells, a list of {"index": ..., "source": ...} (index
+    identifying the cell in the results), with the names in context
+    (and IPython's) treated as defined.
+
+    context may also include the sources of other cells (as
+    {"source": ...}), whose top level definitions are added.
+
+    Returns a list of diagnostics: {"cell", "line", "column" (both
+    1-based; None for rules about the whole cell), "message", "type"
+    (a LintType value), "code" (the pyflakes message, or the rule),
+    "severity" ("error" or "warning")}.
+    """
+    rules = rules or {}
+    names, star_import = set(), False
+    for item in context:
+        if isinstance(item, dict):
+            cell_names, cell_star_import = defined_names(item.get("source", ""))
+            names.update(cell_names)
+            star_import = star_import or cell_star_import
+        else:
+            names.add(item)
+    names = frozenset(names)
+
+    diagnostics = []
+    for cell in cells:
+        index, source = cell.get("index"), cell.get("source", "")
+        for line, column, message, code, severity in _pyflakes(source, names, star_import):
+            diagnostics.append(_diagnostic(index, line, column, message, "linter", code, severity))
+
+        try:
+            facts = _code_facts(source)
+        except SyntaxError:
+            continue
+        results = []
+        if "lines_per_cell" in rules and not facts["empty"]:
+            results.extend(lint_lines_per_cell([facts["lines"]], max_lines_per_cell=rules["lines_per_cell"])[0])
+        if "magics_allowlist" in rules or "magics_denylist" in rules:
+            results.extend(lint_magics(facts["magics"], rules.get("magics_allowlist"), rules.get("magics_denylist"))[0])
+        for result in results:
+            if not result.passed:
+                diagnostics.append(
+                    _diagnostic(index, None, None, result.message, result.type.value, result.type.value, "error")
+                )
+    return diagnostics
@@ -0,0 +1,265 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""pytest plugin collecting celltests directly from notebooks.
+
+Enable with --nbcelltests, e.g.
+
+  pytest --nbcelltests path/to/notebooks
+
+Each notebook becomes a collector with one test_code_cell_N item per
+code cell (plus test_cell_coverage if the cell_coverage rule is set,
+and test_code_coverage if a code coverage rule is set). The items
+share one kernel per notebook, started before the notebook's first
+item runs and stopped after its last, and have the same cumulative
+semantics as the generated test scripts (see TestNotebookBase).
+
+Under pytest-xdist, a notebook's items are kept together on one worker
+(--dist load is switched to loadgroup, using an xdist_group per
+notebook), and each worker starts the next notebook's kernel while the
+current one runs.
+"""
+
+import json
+import pytest
+import unittest
+
+from .kernels import prestart_kernels, shutdown_kernels
+from .reader import read
+from .shared import get_test_settings
+from .tests_vendored import CellTimeoutError, MiB, TestNotebookBase, get_celltests
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("nbcelltests", "cell-by-cell notebook tests")
+    group.addoption(
+        "--nbcelltests",
+        action="store_true",
+        help="Collect celltests from .ipynb files",
+    )
+    group.addoption(
+        "--nbcelltests-current-env",
+        action="store_true",
+        help="Run notebooks using a kernel from the current environment (exclusive with --nbcelltests-kernel-name)",
+    )
+    group.addoption(
+        "--nbcelltests-kernel-name",
+        default="",
+        help="Kernel to run notebooks with (default: the notebook's kernelspec)",
+    )
+    group.addoption(
+        "--nbcelltests-rules",
+        default=None,
+        help="JSON object of extra rules to enforce, overriding the notebooks' celltests metadata",
+    )
+    group.addoption(
+        "--nbcelltests-fail-fast",
+        action="store_true",
+        help="Stop testing a notebook at its first failing cell",
+    )
+    group.addoption(
+        "--nbcelltests-validate",
+        action="store_true",
+        help="Fail notebooks that don't match the nbformat schema",
+    )
+    group.addoption(
+        "--nbcelltests-prestart-kernels",
+        action="store_true",
+        help="Start the next notebook's kernel while the current notebook runs (default on pytest-xdist workers)",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "xdist_group(name): run tests in the same group on the same xdist worker")
+
+    # keep each notebook on one worker, so it's executed once in one kernel
+    if config.getoption("nbcelltests") and getattr(config.option, "dist", "no") == "load":
+        config.option.dist = "loadgroup"
+
+    # workers parse their own options, so need telling
+    if hasattr(config, "workerinput") and config.workerinput.get("nbcelltests_loadgroup"):
+        config.option.loadgroup = True
+    if _prestarting(config):
+        prestart_kernels()
+
+
+def _prestarting(config):
+    # (by default only on workers of xdist runs collecting notebooks)
+    return config.getoption("nbcelltests_prestart_kernels") or (
+        hasattr(config, "workerinput") and config.getoption("nbcelltests")
+    )
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    # pytest-xdist hook: called on the controller for each worker
+    node.workerinput["nbcelltests_loadgroup"] = node.config.getoption("dist") == "loadgroup"
+
+
+def pytest_unconfigure(config):
+    shutdown_kernels()
+
+
+def pytest_terminal_summary(terminalreporter):
+    # resources used by each cell
+    if terminalreporter.verbosity < 1:
+        return
+    lines = []
+    for reports in terminalreporter.stats.values():
+        for report in reports:
+            metrics = dict(getattr(report, "user_properties", ())).get("nbcelltests_metrics")
+            if not metrics:
+                continue
+            resources = []
+            if "seconds" in metrics:
+                resources.append("%.2fs" % metrics["seconds"])
+            if metrics.get("peak_memory") is not None:
+                resources.append(
+                    "peak memory %.1f MiB (%+.1f MiB)"
+                    % (metrics["peak_memory"] / MiB, (metrics["peak_memory"] - metrics["start_memory"]) / MiB)
+                )
+            if resources:
+                lines.append("%s: %s" % (report.nodeid, ", ".join(resources)))
+    if lines:
+        terminalreporter.write_sep("-", "nbcelltests cell resources")
+        for line in sorted(lines):
+            terminalreporter.write_line(line)
+
+
+def pytest_collect_file(file_path, parent):
+    config = parent.config
+    if config.getoption("nbcelltests") and file_path.suffix == ".ipynb" and ".ipynb_checkpoints" not in file_path.parts:
+        return CelltestsFile.from_parent(parent, path=file_path)
+
+
+class CelltestsFile(pytest.File):
+    """A notebook's celltests."""
+
+    def collect(self):
+        config = self.config
+        notebook = str(self.path)
+        rules = config.getoption("nbcelltests_rules")
+        nb = read(notebook, validate=config.getoption("nbcelltests_validate"))
+        settings = get_test_settings(nb, json.loads(rules) if rules else None, path=notebook)
+        celltests = get_celltests(notebook)
+
+        self.testcase_cls = type(
+            "TestNotebook",
+            (TestNotebookBase,),
+            {
+                "_current_env": config.getoption("nbcelltests_current_env"),
+                "_kernel_name": config.getoption("nbcelltests_kernel_name"),
+                "_notebook": notebook,
+                "_cell_timeout": settings["cell_timeout"],
+                "_timeout_policy": settings["timeout_policy"],
+                "_fail_fast": config.getoption("nbcelltests_fail_fast"),
+                "_measure_code_coverage": bool(settings["code_coverage"]),
+                "_limits": settings["limits"],
+                "_memory_top_allocators": settings["memory_top_allocators"],
+                "_timing_history": settings["timing_history"],
+                "_snapshot_cell": settings["snapshot_cell"],
+                "_checkpoints": settings["checkpoints"],
+                "_run_history": settings["run_history"],
+                "_profile": settings["profile"],
+                "celltests": celltests,
+            },
+        )
+
+        items = [
+            CellCoverageItem.from_parent(self, name="test_cell_coverage", actual=actual, required=required)
+            for actual, required in settings["coverage"]
+        ]
+        items += [CelltestItem.from_parent(self, name="test_code_cell_%d" % cell, cell=cell) for cell in celltests]
+        # last, so all cells have run
+        items += [
+            CodeCoverageItem.from_parent(
+                self, name="test_code_coverage", min_notebook=min_notebook, min_per_cell=min_per_cell
+            )
+            for min_notebook, min_per_cell in settings["code_coverage"]
+        ]
+        for item in items:
+            item.add_marker(pytest.mark.xdist_group(name=self.nodeid))
+        return items
+
+    def _more_notebooks(self):
+        """Whether another notebook's items may still run in this process."""
+        if hasattr(self.config, "workerinput"):
+            # (pytest-xdist decides as it goes which items a worker runs)
+            return True
+        items = self.session.items
+        last = max(i for i, item in enumerate(items) if item.parent is self)
+        return any(isinstance(item.parent, CelltestsFile) for item in items[last + 1 :])
+
+    def setup(self):
+        if _prestarting(self.config):
+            # (no spare kernel after the last notebook)
+            prestart_kernels(self._more_notebooks())
+        # one kernel per notebook, shared by all its items
+        self.testcase_cls.setUpClass()
+        self.testcase = self.testcase_cls()
+
+    def teardown(self):
+        self.testcase_cls.tearDownClass()
+
+
+class _CelltestsItem(pytest.Item):
+    # abstract
+
+    def runtest(self):
+        try:
+            self._runtest(self.parent.testcase)
+        except unittest.SkipTest as e:
+            pytest.skip(str(e))
+
+    def repr_failure(self, excinfo):
+        if type(excinfo.value) in (Exception, CellTimeoutError):
+            # failures reported from the kernel
+            return str(excinfo.value).replace("\\n", "\n")
+        return super().repr_failure(excinfo)
+
+    def reportinfo(self):
+        return self.path, None, self.name
+
+
+class CelltestItem(_CelltestsItem):
+    """Runs one code cell's cell+test (and any preceding cells not yet run)."""
+
+    def __init__(self, *, cell, **kwargs):
+        super().__init__(**kwargs)
+        self.cell = cell
+
+    def _runtest(self, testcase):
+        try:
+            testcase.run_test(self.cell)
+        finally:
+            metrics = testcase.cell_metrics.get(self.cell)
+            if metrics:
+                self.user_properties.append(("nbcelltests_metrics", metrics))
+
+
+class CellCoverageItem(_CelltestsItem):
+    """Checks the notebook's cell coverage."""
+
+    def __init__(self, *, actual, required, **kwargs):
+        super().__init__(**kwargs)
+        self.actual = actual
+        self.required = required
+
+    def _runtest(self, testcase):
+        testcase.assert_coverage(self.actual, self.required)
+
+
+class CodeCoverageItem(_CelltestsItem):
+    """Checks the notebook's code coverage (running any cells not yet run)."""
+
+    def __init__(self, *, min_notebook, min_per_cell, **kwargs):
+        super().__init__(**kwargs)
+        self.min_notebook = min_notebook
+        self.min_per_cell = min_per_cell
+
+    def _runtest(self, testcase):
+        testcase.assert_code_coverage(self.min_notebook, self.min_per_cell)
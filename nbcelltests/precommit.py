@@ -0,0 +1,238 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Linting the notebooks staged for a commit.
+
+Notebooks are read from git's index (i.e. what will be committed, not
+what's in the working tree), all in one go. Results are cached on disk
+in the repository's git directory, so a commit only analyses the cells
+whose source changed since a previous commit, and only runs the python
+linter on notebooks whose cells changed (e.g. not on notebooks that were
+just re-run). The python linter runs once, on all of those notebooks.
+
+The linter's findings can depend on any cell of a notebook (e.g. names
+defined in one cell and used in another), so they are cached per
+notebook's cells rather than per cell, and on the linter's version and
+configuration, which are part of the key.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+from .lint import DEFAULT_LINTER, DEFAULT_RUFF, check_rules, lint_batch, linter_messages
+from .reader import reads
+from .shared import extract_extrametadata
+
+# the cache, in the git directory
+CACHE_NAME = os.path.join("nbcelltests", "precommit-cache.json")
+CACHE_VERSION = 4
+
+# files flake8 and ruff read their configuration from (in the directory
+# the linter runs in)
+LINTER_CONFIG_FILES = (".flake8", "setup.cfg", "tox.ini", "pyproject.toml", "ruff.toml", ".ruff.toml")
+
+# entries kept of each kind (the least recently used are dropped)
+MAX_CACHE_ENTRIES = 20000
+
+
+def _git(args, input=None):
+    return subprocess.run(
+        ["git"] + list(args), input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    ).stdout
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()
+
+
+def _linter_setup(linter, executable):
+    """
+    What the linter's findings depend on apart from the notebook: the
+    linter, how it's run, its --version output and its configuration.
+    """
+    command = list(executable)
+    if linter == "ruff" and "check" in command:
+        # (ruff's --version isn't an option of ruff check)
+        command = command[: command.index("check")]
+    try:
+        version = subprocess.run(command + ["--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    except OSError as e:
+        version = str(e).encode("utf-8")
+    config = {}
+    for name in LINTER_CONFIG_FILES:
+        try:
+            with open(name, "rb") as f:
+                config[name] = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            pass
+    return [linter, executable, version.decode("utf-8", "replace"), config]
+
+
+def staged_notebooks(paths=()):
+    """
+    (path, blob id) of each notebook added or modified in the index
+    (limited to paths, if supplied); paths are relative to the top of
+    the repository.
+    """
+    output = _git(
+        ["diff", "--cached", "--raw", "-z", "--no-renames", "--diff-filter=AMT", "--", *(paths or [":/*.ipynb"])]
+    )
+    fields = output.decode("utf-8").split("\0")
+    staged = []
+    # ":<mode> <mode> <blob> <blob> <status>", path
+    for info, path in zip(fields[::2], fields[1::2]):
+        if path.endswith(".ipynb"):
+            staged.append((path, info.split()[3]))
+    return staged
+
+
+def read_blobs(blobs):
+    """{blob id: contents} of blobs, read with one git process."""
+    if not blobs:
+        return {}
+    output = _git(["cat-file", "--batch"], input="".join(blob + "\n" for blob in blobs).encode("ascii"))
+    contents = {}
+    pos = 0
+    for blob in blobs:
+        header_end = output.index(b"\n", pos)
+        # "<blob> blob <size>"
+        size = int(output[pos:header_end].split()[2])
+        contents[blob] = output[header_end + 1 : header_end + 1 + size]
+        pos = header_end + 1 + size + 1
+    return contents
+
+
+class ResultCache(object):
+    """Per-cell analysis and per-notebook linter findings, kept in a json file."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.facts = {}
+        self.linter = {}
+        self.changed = False
+        if path is None:
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        for key, facts in data.get("facts", {}).items():
+            self.facts[key] = dict(facts, magics=frozenset(facts["magics"]))
+        self.linter = data.get("linter", {})
+
+    def cell_facts(self, sources):
+        """{source: analysis} for the cached ones of sources."""
+        found = {}
+        for source in sources:
+            facts = self.facts.pop(_hash(source), None)
+            if facts is not None:
+                # most recently used last
+                self.facts[_hash(source)] = found[source] = facts
+        return found
+
+    def add_cell_facts(self, analyses):
+        for source, facts in analyses.items():
+            key = _hash(source)
+            if key not in self.facts:
+                self.facts[key] = facts
+                self.changed = True
+
+    def linter_output(self, key):
+        output = self.linter.pop(key, None)
+        if output is not None:
+            self.linter[key] = output
+        return output
+
+    def add_linter_output(self, key, output):
+        self.linter[key] = output
+        self.changed = True
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        for entries in (self.facts, self.linter):
+            for key in list(entries)[: max(0, len(entries) - MAX_CACHE_ENTRIES)]:
+                del entries[key]
+        data = {
+            "version": CACHE_VERSION,
+            "facts": {key: dict(facts, magics=sorted(facts["magics"])) for key, facts in self.facts.items()},
+            "linter": self.linter,
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # written in full then renamed, so concurrent commits never see half a cache
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+
+def cache_path():
+    """Where the cache is kept in the current repository."""
+    return os.path.abspath(_git(["rev-parse", "--git-path", CACHE_NAME]).decode("utf-8").strip())
+
+
+def lint_staged(paths=(), rules=None, executable=None, run_python_linter=True, use_cache=True, linter="flake8"):
+    """
+    Lint the staged notebooks (those of paths, if supplied); returns a
+    list of (path, LintMessages, passed), in the order git lists them.
+
+    As with lint.run, output from the python linter fails a notebook.
+    """
+    staged = staged_notebooks(paths)
+    contents = read_blobs(sorted(set(blob for _, blob in staged)))
+    cache = ResultCache(cache_path() if use_cache else None)
+    executable = list(executable or (DEFAULT_LINTER if linter == "flake8" else DEFAULT_RUFF))
+
+    results = []
+    to_lint = {}
+    setup = None
+    for path, blob in staged:
+        try:
+            nb = reads(contents[blob])
+            sources = [cell.source for cell in nb.cells if cell.cell_type == "code"]
+            facts = cache.cell_facts(sources)
+            extra_metadata = extract_extrametadata(nb, cache=facts)
+            cache.add_cell_facts(facts)
+            messages, passed = check_rules(extra_metadata, rules)
+        except Exception as e:
+            results.append([path, ["ERROR: %s: %s" % (type(e).__name__, e)], False, None])
+            continue
+        # (plus the key of its linter output)
+        results.append([path, messages, passed, None])
+
+        if run_python_linter:
+            # everything the script is made from (and the cells' positions)
+            code = [(cell.cell_type, cell.source) for cell in nb.cells if cell.cell_type != "raw"]
+            if setup is None:
+                setup = _linter_setup(linter, executable)
+            key = results[-1][3] = _hash([setup, code])
+            if cache.linter_output(key) is None and key not in to_lint:
+                to_lint[key] = nb
+
+    linted = {}
+    if to_lint:
+        linted, attributed = lint_batch(to_lint, executable, linter)
+        if attributed:
+            for key, findings in linted.items():
+                cache.add_linter_output(key, findings)
+
+    for result in results:
+        key = result.pop()
+        if key is not None:
+            findings = linted[key] if key in linted else cache.linter_output(key)
+            # (findings name the notebook by key)
+            result[1].extend(linter_messages([(cell, text.replace(key, result[0], 1)) for cell, text in findings]))
+            result[2] = result[2] and not findings
+
+    cache.save()
+    return [tuple(result) for result in results]
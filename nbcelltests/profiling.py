@@ -0,0 +1,97 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Writing profiles of a notebook's cells as flame graphs.
+
+A profile is a dictionary of stacks (frames separated by ";", outermost
+first) to microseconds spent in them, as sampled in the kernel (see
+kernelside.sampler). They're written as either:
+
+  * collapsed stacks ("frame;frame;frame microseconds" lines), a file
+    per cell plus one of all the cells, for flamegraph.pl, inferno,
+    speedscope, etc.
+
+  * one speedscope file (https://www.speedscope.app), with a profile
+    of all the cells followed by one per cell
+"""
+
+import json
+import os
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+def merge(profiles):
+    """One profile of all of profiles."""
+    merged = {}
+    for profile in profiles:
+        for stack, microseconds in profile.items():
+            merged[stack] = merged.get(stack, 0) + microseconds
+    return merged
+
+
+def collapsed(profile):
+    """A profile in collapsed stack format."""
+    return "".join("%s %d\n" % (stack, microseconds) for stack, microseconds in sorted(profile.items()))
+
+
+def speedscope(profiles, name):
+    """
+    A speedscope file (as a dictionary) of profiles, a list of
+    (name, profile).
+    """
+    frames = {}
+    result = []
+    for profile_name, profile in profiles:
+        samples, weights = [], []
+        for stack, microseconds in sorted(profile.items()):
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack.split(";")])
+            weights.append(microseconds)
+        result.append(
+            {
+                "type": "sampled",
+                "name": profile_name,
+                "unit": "microseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        )
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "exporter": "nbcelltests",
+        "shared": {"frames": [{"name": frame} for frame in frames]},
+        "profiles": result,
+    }
+
+
+def write_profiles(path, notebook, profiles, format="collapsed"):
+    """
+    Write profiles ({code cell number: profile}) of notebook's cells to
+    the directory path, named after the notebook, in format (one of
+    shared.PROFILE_FORMATS); returns the paths written.
+    """
+    os.makedirs(path, exist_ok=True)
+    name = os.path.splitext(os.path.basename(notebook))[0]
+    cells = sorted(profiles)
+    if format == "speedscope":
+        written = os.path.join(path, name + ".speedscope.json")
+        named = [("all cells", merge(profiles.values()))] + [("code cell %d" % cell, profiles[cell]) for cell in cells]
+        with open(written, "w", encoding="utf-8") as f:
+            json.dump(speedscope(named, name), f)
+        return [written]
+
+    written = [os.path.join(path, name + ".collapsed")]
+    with open(written[0], "w", encoding="utf-8") as f:
+        f.write(collapsed(merge(profiles.values())))
+    for cell in cells:
+        written.append(os.path.join(path, "%s.cell%d.collapsed" % (name, cell)))
+        with open(written[-1], "w", encoding="utf-8") as f:
+            f.write(collapsed(profiles[cell]))
+    return written
@@ -0,0 +1,206 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Fast notebook reading for linting and testing.
+
+Linting and testing only need cells' types, sources and metadata, but
+notebooks can contain many megabytes of outputs (e.g. base64 images).
+read() scans the notebook's JSON without decoding cells' outputs and
+attachments: it only looks for the quote ending each string (so a
+large image is skipped with a single search), and only the parts that
+are kept are passed to json.
+"""
+
+import json
+import mmap
+import nbformat
+import re
+
+# cell keys whose values are skipped
+SKIPPED_CELL_KEYS = ("outputs", "attachments")
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+# anything up to the next bracket or long string (regular
+# expressions are slow at scanning long strings, so they're skipped
+# using find)
+_CONTAINER_CONTENT = re.compile(rb'(?:[^"{}\[\]]+|"(?:[^"\\]|\\.){0,1024}")*')
+_SCALAR_END = re.compile(rb"[ \t\n\r,}\]]")
+
+
+class _Scanner(object):
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def error(self, expected):
+        raise ValueError("Invalid notebook JSON: expected %s at position %d" % (expected, self.pos))
+
+    def skip_whitespace(self):
+        self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+
+    def expect(self, char):
+        self.skip_whitespace()
+        if self.buf[self.pos : self.pos + 1] != char:
+            self.error(repr(char.decode()))
+        self.pos += 1
+
+    def next_is(self, char):
+        self.skip_whitespace()
+        return self.buf[self.pos : self.pos + 1] == char
+
+    def _string_end(self, start):
+        # start is the opening quote
+        pos = start + 1
+        while True:
+            end = self.buf.find(b'"', pos)
+            if end < 0:
+                self.error("end of string")
+            escapes = end
+            while self.buf[escapes - 1] == 0x5C:  # backslash
+                escapes -= 1
+            if (end - escapes) % 2 == 0:
+                return end + 1
+            pos = end + 1
+
+    def skip_value(self):
+        """Move past the next value, returning where it started."""
+        self.skip_whitespace()
+        start = self.pos
+        char = self.buf[start : start + 1]
+        if char == b'"':
+            self.pos = self._string_end(start)
+        elif char in (b"{", b"["):
+            depth = 0
+            pos = start
+            while True:
+                pos = _CONTAINER_CONTENT.match(self.buf, pos).end()
+                found = self.buf[pos : pos + 1]
+                if not found:
+                    self.error("end of %s" % ("object" if char == b"{" else "array"))
+                if found == b'"':
+                    pos = self._string_end(pos)
+                    continue
+                depth += 1 if found in (b"{", b"[") else -1
+                pos += 1
+                if depth == 0:
+                    break
+            self.pos = pos
+        else:
+            match = _SCALAR_END.search(self.buf, start)
+            self.pos = match.start() if match else len(self.buf)
+            if self.pos == start:
+                self.error("value")
+        return start
+
+    def value(self):
+        start = self.skip_value()
+        return json.loads(self.buf[start : self.pos])
+
+    def items(self):
+        """Iterate over the keys of the object starting at the current position.
+
+        The caller must consume (or skip) each key's value.
+        """
+        self.expect(b"{")
+        if self.next_is(b"}"):
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(b":")
+            yield key
+            if self.next_is(b","):
+                self.pos += 1
+                continue
+            self.expect(b"}")
+            return
+
+    def elements(self):
+        """Iterate over the elements of the array starting at the current position."""
+        self.expect(b"[")
+        if self.next_is(b"]"):
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.next_is(b","):
+                self.pos += 1
+                continue
+            self.expect(b"]")
+            return
+
+
+def _cell(scanner):
+    cell = {}
+    for key in scanner.items():
+        if key in SKIPPED_CELL_KEYS:
+            scanner.skip_value()
+        else:
+            cell[key] = scanner.value()
+    if isinstance(cell.get("source"), list):
+        cell["source"] = "".join(cell["source"])
+    if cell.get("cell_type") == "code":
+        cell["outputs"] = []
+    return cell
+
+
+def _parse(buf):
+    scanner = _Scanner(buf)
+    nb = {}
+    for key in scanner.items():
+        if key == "cells":
+            nb["cells"] = [_cell(scanner) for _ in scanner.elements()]
+        else:
+            nb[key] = scanner.value()
+    scanner.skip_whitespace()
+    if scanner.pos != len(buf):
+        scanner.error("end of notebook")
+    return nb
+
+
+def read(path, validate=False):
+    """
+    Read the notebook at path, like nbformat.read(path, 4) but leaving
+    out code cells' outputs and cells' attachments (neither of which
+    are decoded).
+
+    If validate is True, nbformat.ValidationError is raised if the
+    (remaining) notebook doesn't match the nbformat schema.
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            buf = b""
+        try:
+            nb = _parse(buf)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    return _finish(nb, lambda: nbformat.read(path, 4), validate)
+
+
+def reads(data, validate=False):
+    """Like read(), but of a notebook's contents (bytes), e.g. from git."""
+    return _finish(_parse(data), lambda: nbformat.reads(data.decode("utf-8"), 4), validate)
+
+
+def _finish(nb, read_with_nbformat, validate):
+    if nb.get("nbformat") != 4:
+        # older notebooks need converting; leave that to nbformat
+        nb = read_with_nbformat()
+        for cell in nb.cells:
+            cell.pop("attachments", None)
+            if cell.cell_type == "code":
+                cell.outputs = []
+    else:
+        nb = nbformat.from_dict(nb)
+
+    if validate:
+        nbformat.validate(nb)
+    return nb
@@ -0,0 +1,166 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Server-side copies of notebooks being edited in the frontend.
+
+The frontend uploads a notebook's sources once, then only the cells that
+changed since the revision the server holds ("deltas"). Analysis of
+each cell, and the latest lint result, are kept alongside the copy, so
+repeated lint runs while editing cost work proportional to the edit
+rather than to the notebook.
+
+Deltas are applied in order, each to the result of the previous one:
+
+  {"op": "insert", "index": i, "cell": {...}}  (new cell at index i)
+  {"op": "delete", "index": i}
+  {"op": "modify", "index": i, "cell": {...}}  (replaces cell i)
+
+where cells are in the sources-only format (see
+extension.notebook_from_sources).
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import uuid
+
+# notebooks the server keeps copies of (the least recently used are dropped)
+MAX_SESSIONS = 32
+
+DELTA_OPS = ("insert", "delete", "modify")
+
+
+class RevisionMismatch(Exception):
+    """
+    Deltas were made against a revision the server doesn't hold (e.g.
+    it restarted, or dropped the copy); the whole notebook must be sent.
+    """
+
+    def __init__(self, path, revision, held):
+        super().__init__("Revision %r of %s is not held by the server (holding %r)" % (revision, path, held))
+        self.held = held
+
+
+def _new_revision():
+    # unique rather than counting, so a revision can't be mistaken for
+    # one of an earlier copy (e.g. from before the server restarted)
+    return uuid.uuid4().hex
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class NotebookSession(object):
+    """
+    A copy of one notebook's sources at some revision, plus what has
+    been worked out from it.
+    """
+
+    def __init__(self, sources):
+        self.revision = _new_revision()
+        # cell source: analysis (see shared.extract_extrametadata)
+        self.lint_cache = {}
+        # kind ("lint"): (content key, result)
+        self.results = {}
+        # held while reading or updating the caches (not while running)
+        self.lock = threading.Lock()
+        self._set(sources.get("metadata", {}), list(sources.get("cells", [])))
+
+    def _set(self, metadata, cells, hashes=None):
+        # cells are replaced rather than changed, so runs can keep
+        # using a previous sources() while deltas are applied
+        self.metadata = metadata
+        self.cells = cells
+        # last_modified of the saved file the copy was read from (if it was)
+        self.saved = None
+        self._hashes = hashes if hashes is not None else [_hash(cell) for cell in cells]
+
+    def replace(self, sources):
+        """Replace the whole notebook (keeping caches of unchanged cells)."""
+        self._set(sources.get("metadata", {}), list(sources.get("cells", [])))
+        self.revision = _new_revision()
+
+    def apply(self, deltas, metadata=None):
+        """
+        Apply deltas (and replace the notebook's metadata, if supplied).
+
+        Raises ValueError for an invalid delta, in which case nothing
+        is changed.
+        """
+        cells, hashes = list(self.cells), list(self._hashes)
+        for delta in deltas:
+            op, index = delta.get("op"), delta.get("index")
+            if op not in DELTA_OPS:
+                raise ValueError("Unknown delta op %r" % (op,))
+            last = len(cells) if op == "insert" else len(cells) - 1
+            if not isinstance(index, int) or not 0 <= index <= last:
+                raise ValueError("Delta index %r out of range for %d cells" % (index, len(cells)))
+            if op == "delete":
+                del cells[index]
+                del hashes[index]
+                continue
+            cell = delta.get("cell")
+            if not isinstance(cell, dict):
+                raise ValueError("Delta %r has no cell" % (op,))
+            if op == "insert":
+                cells.insert(index, cell)
+                hashes.insert(index, _hash(cell))
+            else:
+                cells[index] = cell
+                hashes[index] = _hash(cell)
+        self._set(self.metadata if metadata is None else metadata, cells, hashes)
+        self.revision = _new_revision()
+
+    def sources(self):
+        """The notebook, in the sources-only format."""
+        return {"metadata": self.metadata, "cells": self.cells}
+
+    def key(self):
+        """Hash of the notebook's content, computed from per-cell hashes."""
+        return _hash([self.metadata, self._hashes])
+
+    def prune(self):
+        """Drop cached analysis of cells no longer in the notebook."""
+        live = set(cell.get("source", "") for cell in self.cells)
+        for source in [source for source in self.lint_cache if source not in live]:
+            del self.lint_cache[source]
+
+
+class SessionStore(object):
+    """NotebookSessions by notebook path."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()
+
+    def get(self, path):
+        return self._sessions.get(path)
+
+    def update(self, path, body):
+        """
+        Return path's session, updated from a request body containing
+        either the whole notebook ("sources"), or "deltas" (plus,
+        optionally, new notebook "metadata") against "revision".
+        """
+        session = self._sessions.get(path)
+        if "sources" in body:
+            if session is None:
+                session = NotebookSession(body["sources"])
+            else:
+                session.replace(body["sources"])
+        else:
+            if session is None or session.revision != body.get("revision"):
+                raise RevisionMismatch(path, body.get("revision"), session and session.revision)
+            session.apply(body.get("deltas", []), body.get("metadata"))
+
+        self._sessions[path] = session
+        self._sessions.move_to_end(path)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
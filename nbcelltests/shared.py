@@ -6,9 +6,12 @@
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
 import ast
-import nbconvert
+import functools
+import os
 import re
-import sys
+
+# cells whose conversion to python, and magics, are kept
+CACHE_SIZE = 4096
 
 
 # note: could consider combining these separate classes
@@ -56,13 +59,81 @@ class MagicsRecorder(ast.NodeVisitor):
         self.seen = set()
 
     def visit_Call(self, node):
-        if hasattr(node.func, "attr") and node.func.attr in self.magic_fn_names:
-            # should maybe find ipython's own parsing code and use that instead
-            if node.func.value.func.id == "get_ipython":
-                magic_name = node.args[0].s
-                if node.func.attr in self.magic_fn_names_py2:
-                    magic_name = magic_name.split()[0]  # (again, find ipython's parsing?)
-                self.seen.add(magic_name)
+        func = node.func
+        if (
+            isinstance(func, ast.Attribute)
+            and func.attr in self.magic_fn_names
+            and isinstance(func.value, ast.Call)
+            and isinstance(func.value.func, ast.Name)
+            and func.value.func.id == "get_ipython"
+            and node.args
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            magic_name = node.args[0].value
+            if func.attr in self.magic_fn_names_py2:
+                magic_name = magic_name.split(None, 1)[0] if magic_name.strip() else magic_name
+            self.seen.add(magic_name)
+        self.generic_visit(node)
+
+
+_transformer = None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def ipython_to_python(source):
+    """
+    A cell's source, in IPython's syntax (e.g. with magics), as python;
+    done by IPython's own transformer (as nbconvert's ipython2python
+    filter does, without needing nbconvert).
+    """
+    global _transformer
+    if _transformer is None:
+        from IPython.core.inputtransformer2 import TransformerManager
+
+        _transformer = TransformerManager()
+    return _transformer.transform_cell(source)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def cell_magics(source):
+    """
+    The names of the magics a cell's source uses (a frozenset).
+
+    Raises SyntaxError if the cell isn't valid IPython.
+    """
+    # magics all start with % (apart from help: x? is the pinfo magic),
+    # unless called explicitly
+    if "%" not in source and "?" not in source and "get_ipython" not in source:
+        return frozenset()
+    magics_recorder = MagicsRecorder()
+    magics_recorder.visit(ast.parse(ipython_to_python(source)))
+    return frozenset(magics_recorder.seen)
+
+
+def code_facts(source):
+    """
+    What extract_extrametadata needs to know about one code cell's
+    source (which doesn't depend on the rest of the notebook).
+    """
+    # note: no attempt to be clever here (so e.g. "%time def f: pass" would be missed, as would the contents of
+    # a cell using %%capture cell magics; possible to handle those scenarios but would take more effort)
+    parsed_source = ast.parse(ipython_to_python(source))
+
+    fn_def_counter = FnDefCounter()
+    fn_def_counter.visit(parsed_source)
+
+    class_counter = ClassDefCounter()
+    class_counter.visit(parsed_source)
+
+    empty = empty_ast(source)
+    return {
+        "functions": fn_def_counter.count,
+        "classes": class_counter.count,
+        "magics": cell_magics(source),
+        "empty": empty,
+        "lines": 0 if empty else sum(1 for line in source.split("\n") if not empty_ast(line)),
+    }
 
 
 # Note: I think it's confusing to insert the actual counts into the
@@ -71,37 +142,30 @@ class MagicsRecorder(ast.NodeVisitor):
 # Note: this always does everything, which might be unnecessary
 # (e.g. if haven't asked for magics checking, don't need to extract
 # them)
-def extract_extrametadata(notebook, override=None, noqa_regex=None):
+def extract_extrametadata(notebook, override=None, noqa_regex=None, cache=None):
+    """
+    Counts etc of the notebook's contents, plus its celltests metadata.
+
+    Code cells are analyzed independently; cache, if supplied, is a
+    dictionary of cell source to analysis that is used and filled in,
+    so repeatedly analyzing an edited notebook only analyzes the
+    changed cells.
+    """
     if noqa_regex is not None:
         noqa_regex = re.compile(noqa_regex)
         if not noqa_regex.groups == 1:
             raise ValueError("noqa_regex must contain one capture group (specifying the rule)")
 
+    cache = {} if cache is None else cache
     base = notebook.metadata.get("celltests", {})
     override = override or {}
     base["lines"] = 0  # TODO: is this used?
     base["kernelspec"] = notebook.metadata.get("kernelspec", {})
 
     # "python code" things (e.g. number of function definitions)...
-    # note: no attempt to be clever here (so e.g. "%time def f: pass" would be missed, as would the contents of
-    # a cell using %%capture cell magics; possible to handle those scenarios but would take more effort)
-    code = nbconvert.PythonExporter(exclude_raw=True).from_notebook_node(notebook)[0]
-    # notebooks start with "coding: utf-8"
-    parsed_source = ast.parse(code.encode("utf8") if sys.version_info[0] == 2 else code)
-
-    fn_def_counter = FnDefCounter()
-    fn_def_counter.visit(parsed_source)
-    base["functions"] = fn_def_counter.count
-
-    class_counter = ClassDefCounter()
-    class_counter.visit(parsed_source)
-    base["classes"] = class_counter.count
-
-    # alternative to doing it this way would be to check the ipython
-    # souce for %magic, %%magics before it's converted to regular python
-    magics_recorder = MagicsRecorder()
-    magics_recorder.visit(parsed_source)
-    base["magics"] = magics_recorder.seen
+    base["functions"] = 0
+    base["classes"] = 0
+    base["magics"] = set()
 
     # "notebook structure" things...
     base["cell_count"] = 0
@@ -114,6 +178,13 @@ def extract_extrametadata(notebook, override=None, noqa_regex=None):
         if c["cell_type"] != "code":
             continue
 
+        facts = cache.get(c["source"])
+        if facts is None:
+            facts = cache[c["source"]] = code_facts(c["source"])
+        base["functions"] += facts["functions"]
+        base["classes"] += facts["classes"]
+        base["magics"].update(facts["magics"])
+
         # noqa comments can be in otherwise code-less cells
         if noqa_regex:
             for line in c["source"].split("\n"):
@@ -121,17 +192,14 @@ def extract_extrametadata(notebook, override=None, noqa_regex=None):
                 if noqa_match:
                     base["noqa"].add(noqa_match.group(1))
 
-        if empty_ast(c["source"]):
+        if facts["empty"]:
             continue
 
-        base["cell_lines"].append(0)
+        base["cell_lines"].append(facts["lines"])
         base["cell_tested"].append(False)
         base["cell_count"] += 1
+        base["lines"] += facts["lines"]
 
-        for line in c["source"].split("\n"):
-            if not empty_ast(line):
-                base["lines"] += 1
-                base["cell_lines"][-1] += 1
         if cell_injected_into_test(get_test(c)):
             base["test_count"] += 1
             base["cell_tested"][-1] = True
@@ -147,6 +215,54 @@ def get_test(cell):
     return lines2source(cell.get("metadata", {}).get("celltests", []))
 
 
+# what to do with the rest of a notebook's tests once a cell times out
+TIMEOUT_POLICIES = ("continue", "abort")
+
+# how many recent timings of a cell to compare its timing with
+DEFAULT_TIMING_HISTORY_WINDOW = 20
+
+# fewest previous runs needed to judge whether a cell got slower (so
+# the smallest timing_history_window)
+MIN_RUNS = 5
+
+# ways of saving checkpoints of the kernel's user namespace
+CHECKPOINT_SERIALIZERS = ("pickle", "dill")
+
+# ways of writing profiles of cells (see profiling)
+PROFILE_FORMATS = ("collapsed", "speedscope")
+
+# default seconds between samples of the kernel's stack when profiling
+DEFAULT_PROFILE_INTERVAL = 0.001
+
+# rules limiting the resources a cell+test may use (checked by its test)
+LIMITS = ("max_memory_per_cell", "max_memory_per_notebook", "max_seconds_per_cell", "max_seconds_per_notebook")
+
+# rules naming files or directories: relative to the notebook's directory
+# when in its celltests metadata, or to the current directory when passed
+# as rules
+PATH_RULES = ("timing_history", "checkpoint_dir", "run_history", "profile")
+
+
+def resolve_metadata_paths(extra_metadata, notebook_path):
+    """
+    Make the PATH_RULES of extra_metadata (see extract_extrametadata)
+    relative to notebook_path's directory.
+    """
+    directory = os.path.dirname(os.path.abspath(notebook_path))
+    for rule in PATH_RULES:
+        if extra_metadata.get(rule):
+            extra_metadata[rule] = os.path.join(directory, extra_metadata[rule])
+    return extra_metadata
+
+
+def get_cell_timeout(cell):
+    """Per-cell execution timeout (seconds) from the cell's metadata, or None."""
+    timeout = cell.get("metadata", {}).get("celltests_timeout", None)
+    if timeout is not None and not timeout > 0:
+        raise ValueError("celltests_timeout must be greater than 0, not %r" % (timeout,))
+    return timeout
+
+
 def empty_ast(source):
     """
     Whether the supplied source string has an empty ast.
@@ -243,3 +359,220 @@ def get_coverage(metadata):
     if metadata["cell_count"] == 0:
         return 0
     return 100.0 * metadata["test_count"] / metadata["cell_count"]
+
+
+def get_test_settings(notebook, rules=None, path=None):
+    """
+    Notebook-wide settings for running the supplied notebook's
+    celltests, from the notebook's celltests metadata overridden by
+    rules. Paths in the metadata are relative to the directory of
+    path (the notebook's file), if supplied. Raises ValueError if a
+    rule is invalid, or can't be combined with another.
+
+    Returns a dictionary containing:
+
+      * 'coverage' list of (actual, required) cell coverage checks
+
+      * 'cell_timeout' and 'timeout_policy' (see _timeout_settings)
+
+      * 'code_coverage' (see _code_coverage_settings)
+
+      * 'limits' and 'memory_top_allocators' (see _limit_settings)
+
+      * 'timing_history' (see _timing_history_settings)
+
+      * 'snapshot_cell' (see _snapshot_settings)
+
+      * 'checkpoints' (see _checkpoint_settings)
+
+      * 'run_history' None, or the path of the SQLite database to
+        record the run in
+
+      * 'profile' (see _profile_settings)
+    """
+    extra_metadata = extract_extrametadata(notebook)
+    if path is not None:
+        resolve_metadata_paths(extra_metadata, path)
+    extra_metadata.update(rules or {})
+
+    # TODO: Coverage shouldn't be recorded at generation time as it
+    # will go stale if the notebook changes. Should move to same
+    # mechanism as source/tests. (code_coverage below is measured
+    # during test execution.)
+    coverage = []
+    if "cell_coverage" in extra_metadata:
+        coverage.append((get_coverage(extra_metadata), extra_metadata["cell_coverage"]))
+
+    settings = {
+        "coverage": coverage,
+        "run_history": os.path.abspath(extra_metadata["run_history"]) if extra_metadata.get("run_history") else None,
+    }
+    for settings_of in (
+        _timeout_settings,
+        _code_coverage_settings,
+        _limit_settings,
+        _timing_history_settings,
+        _snapshot_settings,
+        _checkpoint_settings,
+        _profile_settings,
+    ):
+        settings.update(settings_of(extra_metadata))
+    _check_combinations(settings)
+    return settings
+
+
+def _timeout_settings(extra_metadata):
+    """
+    'cell_timeout' seconds each cell+test may run for (or None), and
+    'timeout_policy' ("continue" or "abort" after a timeout).
+    """
+    cell_timeout = extra_metadata.get("cell_timeout", None)
+    if cell_timeout is not None and not cell_timeout > 0:
+        raise ValueError("cell_timeout must be greater than 0, not %r" % (cell_timeout,))
+    timeout_policy = extra_metadata.get("timeout_policy", "continue")
+    if timeout_policy not in TIMEOUT_POLICIES:
+        raise ValueError("timeout_policy must be one of %s, not %r" % (TIMEOUT_POLICIES, timeout_policy))
+    return {"cell_timeout": cell_timeout, "timeout_policy": timeout_policy}
+
+
+def _code_coverage_settings(extra_metadata):
+    """
+    'code_coverage' list of (notebook minimum, per cell minimum) code
+    coverage checks (percentages, either may be None).
+    """
+    code_coverage = []
+    min_code_coverage = [extra_metadata.get(rule, None) for rule in ("code_coverage", "code_coverage_per_cell")]
+    for rule, minimum in zip(("code_coverage", "code_coverage_per_cell"), min_code_coverage):
+        if minimum is not None and not 0 <= minimum <= 100:
+            raise ValueError("%s must be between 0 and 100, not %r" % (rule, minimum))
+    if min_code_coverage != [None, None]:
+        code_coverage.append(tuple(min_code_coverage))
+    return {"code_coverage": code_coverage}
+
+
+def _limit_settings(extra_metadata):
+    """
+    'limits' dictionary of the LIMITS rules that are set, and
+    'memory_top_allocators' how many of the lines allocating the most
+    memory to report for each cell (0 for none).
+    """
+    limits = {rule: extra_metadata[rule] for rule in LIMITS if extra_metadata.get(rule, None) is not None}
+    for rule, limit in limits.items():
+        if not limit > 0:
+            raise ValueError("%s must be greater than 0, not %r" % (rule, limit))
+    memory_top_allocators = extra_metadata.get("memory_top_allocators", 0)
+    if not (isinstance(memory_top_allocators, int) and memory_top_allocators >= 0):
+        raise ValueError("memory_top_allocators must be a non-negative integer, not %r" % (memory_top_allocators,))
+    return {"limits": limits, "memory_top_allocators": memory_top_allocators}
+
+
+def _timing_history_settings(extra_metadata):
+    """
+    'timing_history' None, or dictionary of 'path' (of the timing
+    history database), 'environment' (None for the default),
+    'threshold' (standard deviations above recent timings counting as
+    a regression; None to only record) and 'window' (how many recent
+    timings to compare with).
+    """
+    if not extra_metadata.get("timing_history", None):
+        return {"timing_history": None}
+    timing_history = {
+        "path": os.path.abspath(extra_metadata["timing_history"]),
+        "environment": extra_metadata.get("timing_history_environment", None),
+        "threshold": extra_metadata.get("timing_regression_threshold", None),
+        "window": extra_metadata.get("timing_history_window", DEFAULT_TIMING_HISTORY_WINDOW),
+    }
+    if timing_history["threshold"] is not None and not timing_history["threshold"] > 0:
+        raise ValueError("timing_regression_threshold must be greater than 0, not %r" % (timing_history["threshold"],))
+    # (with fewer recent timings than MIN_RUNS, nothing could ever be flagged)
+    if not (isinstance(timing_history["window"], int) and timing_history["window"] >= MIN_RUNS):
+        raise ValueError(
+            "timing_history_window must be an integer of at least %d, not %r" % (MIN_RUNS, timing_history["window"])
+        )
+    return {"timing_history": timing_history}
+
+
+def _snapshot_settings(extra_metadata):
+    """
+    'snapshot_cell' None, or the code cell after which each cell+test
+    runs in its own fork of the kernel.
+    """
+    snapshot_cell = extra_metadata.get("snapshot_cell", None)
+    if snapshot_cell is not None and not (isinstance(snapshot_cell, int) and snapshot_cell > 0):
+        raise ValueError("snapshot_cell must be a positive integer, not %r" % (snapshot_cell,))
+    return {"snapshot_cell": snapshot_cell}
+
+
+def _checkpoint_settings(extra_metadata):
+    """
+    'checkpoints' None, or dictionary of 'path' (of the directory
+    checkpoints are kept in), 'cells' (code cells to save checkpoints
+    after), 'serializer' ("pickle" or "dill") and 'exclude' (globs of
+    names not to save).
+    """
+    if not extra_metadata.get("checkpoint_dir", None):
+        return {"checkpoints": None}
+    checkpoints = {
+        "path": os.path.abspath(extra_metadata["checkpoint_dir"]),
+        "cells": extra_metadata.get("checkpoint_cells", []),
+        "serializer": extra_metadata.get("checkpoint_serializer", "pickle"),
+        "exclude": extra_metadata.get("checkpoint_exclude", []),
+    }
+    if not (
+        isinstance(checkpoints["cells"], list)
+        and checkpoints["cells"]
+        and all(isinstance(cell, int) and cell > 0 for cell in checkpoints["cells"])
+    ):
+        raise ValueError(
+            "checkpoint_cells must be a non-empty list of positive integers, not %r" % (checkpoints["cells"],)
+        )
+    if checkpoints["serializer"] not in CHECKPOINT_SERIALIZERS:
+        raise ValueError(
+            "checkpoint_serializer must be one of %s, not %r" % (CHECKPOINT_SERIALIZERS, checkpoints["serializer"])
+        )
+    if not (isinstance(checkpoints["exclude"], list) and all(isinstance(n, str) for n in checkpoints["exclude"])):
+        raise ValueError("checkpoint_exclude must be a list of strings, not %r" % (checkpoints["exclude"],))
+    return {"checkpoints": checkpoints}
+
+
+def _profile_settings(extra_metadata):
+    """
+    'profile' None, or dictionary of 'path' (of the directory profiles
+    are written to), 'format' (one of PROFILE_FORMATS) and 'interval'
+    (seconds between samples).
+    """
+    if not extra_metadata.get("profile", None):
+        return {"profile": None}
+    profile = {
+        "path": os.path.abspath(extra_metadata["profile"]),
+        "format": extra_metadata.get("profile_format", "collapsed"),
+        "interval": extra_metadata.get("profile_interval", DEFAULT_PROFILE_INTERVAL),
+    }
+    if profile["format"] not in PROFILE_FORMATS:
+        raise ValueError("profile_format must be one of %s, not %r" % (PROFILE_FORMATS, profile["format"]))
+    if not (isinstance(profile["interval"], (int, float)) and profile["interval"] > 0):
+        raise ValueError("profile_interval must be greater than 0, not %r" % (profile["interval"],))
+    return {"profile": profile}
+
+
+def _check_combinations(settings):
+    """Raise ValueError if settings combines rules that can't be used together."""
+    if settings["checkpoints"] and settings["code_coverage"]:
+        # cells restored from a checkpoint don't run
+        raise ValueError("checkpoint_dir can't be combined with code coverage")
+
+    snapshot_cell = settings["snapshot_cell"]
+    if snapshot_cell is None:
+        return
+    # forked cells' coverage, memory use, profiles and state are lost
+    # with their processes (only their execution time is reported)
+    if settings["code_coverage"]:
+        raise ValueError("snapshot_cell can't be combined with code coverage")
+    for rule in ("max_memory_per_cell", "max_memory_per_notebook"):
+        if rule in settings["limits"]:
+            raise ValueError("snapshot_cell can't be combined with %s" % rule)
+    for rule in ("memory_top_allocators", "profile"):
+        if settings[rule]:
+            raise ValueError("snapshot_cell can't be combined with %s" % rule)
+    if settings["checkpoints"] and max(settings["checkpoints"]["cells"]) > snapshot_cell:
+        raise ValueError("checkpoint_cells can't be after snapshot_cell")
@@ -6,93 +6,176 @@
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
 import json
-import nbformat
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
 
+from . import tracing
 from .define import TestMessage, TestType
-from .shared import extract_extrametadata, get_coverage
-from .tests_vendored import BASE, JSON_CONFD
-
-
-def generateTests(notebook, rules=None, filename=None, kernel_name="", current_env=False):
+from .reader import read
+from .shared import get_test_settings
+from .tests_vendored import BASE, JSON_CONFD, PHASES_ENV
+
+
+@tracing.traced("generateTests")
+def generateTests(
+    notebook,
+    rules=None,
+    filename=None,
+    kernel_name="",
+    current_env=False,
+    fail_fast=False,
+    validate=False,
+    origin=None,
+):
     """Runs no tests: just generates test script for supplied notebook. kernel_name and current_env 'will be passed to nbval'.
 
+    The rules (overriding any in the notebook's celltests metadata) are
+    checked by shared.get_test_settings; the README describes each.
+
     Args:
         notebook (str): Path to notebook to run
         rules (list): list of extra rules to enforce
         filename (Optional[str]): filename to output the tests in, if not provided will use the name of the notebook prefixed with a "_" and .py ending
         kernel_name (Optional[str]): optional kernel name to use
         current_env (bool):
+        fail_fast (bool): stop at the first failing test, shutting the kernel down and skipping the remaining tests
+        validate (bool): raise nbformat.ValidationError if the notebook doesn't match the nbformat schema
+        origin (Optional[str]): if notebook is a copy, the notebook's own path (paths in its metadata are relative to it, and histories and checkpoints are of it)
     Returns:
         str: name of file where tests were output
     """
-    nb = nbformat.read(notebook, 4)
+    with tracing.span("read"):
+        nb = read(notebook, validate=validate)
     path = os.path.splitext(notebook)[0].split(os.path.sep)
     py_path = filename or os.path.join(os.path.sep.join(path[:-1]), "_{}_test.py".format(path[-1]))
-    extra_metadata = extract_extrametadata(nb)
-    rules = rules or {}
-    extra_metadata.update(rules)
-
-    # TODO: Coverage shouldn't be recorded at generation time as it
-    # will go stale if the notebook changes. Should move to same
-    # mechanism as source/tests. However, we plan to replace coverage
-    # with code coverage measured during test execution.
-    coverage = []
-    if "cell_coverage" in extra_metadata:
-        coverage.append((get_coverage(extra_metadata), extra_metadata["cell_coverage"]))
+    with tracing.span("get_test_settings"):
+        settings = get_test_settings(nb, rules, path=origin or notebook)
 
     # output tests to test file
-    with open(py_path, "w", encoding="utf-8") as fp:
+    with tracing.span("write", path=py_path), open(py_path, "w", encoding="utf-8") as fp:
         fp.write(
             BASE.format(
                 kernel_name=kernel_name,
                 current_env=current_env,
                 path_to_notebook=notebook,
-                coverage=coverage,
+                origin=os.path.abspath(origin) if origin else None,
+                coverage=settings["coverage"],
+                cell_timeout=settings["cell_timeout"],
+                timeout_policy=settings["timeout_policy"],
+                fail_fast=bool(fail_fast),
+                code_coverage=settings["code_coverage"],
+                measure_code_coverage=bool(settings["code_coverage"]),
+                limits=settings["limits"],
+                memory_top_allocators=settings["memory_top_allocators"],
+                timing_history=settings["timing_history"],
+                snapshot_cell=settings["snapshot_cell"],
+                checkpoints=settings["checkpoints"],
+                run_history=settings["run_history"],
+                profile=settings["profile"],
             )
         )
 
     return py_path
 
 
-def run(notebook, html=False, executable=None, **kwargs):
+@tracing.traced("test.run")
+def run(notebook, html=False, executable=None, phases=None, **kwargs):
     """Run notebook's celltests in a subprocess and optionally return html report using pytest's --self-contained-html.
 
     Note - htlm report leaves behind the following generated files for
     "/path/to/notebook.ipynb":
       * /path/to/_notebook_test.py (notebook test script)
       * /path/to/_notebook_test.html (pytest's html report)
+
+    If phases (a dictionary) is supplied, the seconds taken by each
+    phase of the run are added to it: generate (the test script),
+    startup (pytest's own time, mostly starting up), kernel_start, and
+    execution (of the tests). Without a report from the tests (e.g.
+    they failed to start), all of pytest's time is startup.
     """
+    generate_started = time.monotonic()
     name = generateTests(notebook, **kwargs)
     executable = executable or [sys.executable, "-m", "pytest", "-vvv"]
 
+    env = None
+    if phases is not None:
+        phases["generate"] = time.monotonic() - generate_started
+        phases_file = name.replace(".py", ".phases.json")
+        env = dict(os.environ, **{PHASES_ENV: phases_file})
+
     if html:
         # return html report
         html = name.replace(".py", ".html")
         argv = executable + ["--html=" + html, "--self-contained-html", name]
-        subprocess.call(argv)
+        _call(argv, env, phases, subprocess.call)
         with open(html, "r", encoding="utf-8") as fp:
             return fp.read()
 
     # otherwise run inline
     argv = executable + [name]
-    return subprocess.check_call(argv)
+    return _call(argv, env, phases, subprocess.check_call)
+
+
+def _call(argv, env, phases, call):
+    if phases is None:
+        with tracing.span("pytest"):
+            return call(argv)
+    phases_file = env[PHASES_ENV]
+    started = time.monotonic()
+    try:
+        with tracing.span("pytest"):
+            return call(argv, env=env)
+    finally:
+        seconds = time.monotonic() - started
+        try:
+            with open(phases_file, encoding="utf-8") as f:
+                reported = json.load(f)
+            os.remove(phases_file)
+        except (OSError, ValueError):
+            reported = {}
+        phases.update(reported)
+        phases["startup"] = max(0.0, seconds - sum(reported.values()))
+
+
+@tracing.traced("runWithOutput")
+def runWithOutput(notebook, executable=None, **run_kw):
+    """
+    Run notebook's celltests in a subprocess, returning (pytest's
+    output, whether the tests passed).
+    """
+    tmpd = tempfile.mkdtemp()
+    py_file = os.path.join(tmpd, os.path.basename(notebook).replace(".ipynb", ".py"))
+    try:
+        generateTests(notebook, filename=py_file, **run_kw)
+        executable = executable or [sys.executable, "-m", "pytest", "-q", "--tb=line"]
+        with tracing.span("pytest"):
+            proc = subprocess.run(
+                executable + [py_file],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding="utf-8",
+                errors="replace",
+            )
+    finally:
+        shutil.rmtree(tmpd)
+    return proc.stdout, proc.returncode == 0
 
 
 def _pytest_nodeid_prefix(path):
     return os.path.splitdrive(path)[1][1:].replace(os.path.sep, "/") + "/"
 
 
+@tracing.traced("runWithReport")
 def runWithReport(notebook, executable=None, collect_only=False, **run_kw):
     """Run notebook's celltests in a subprocess and return exit status."""
     tmpd = tempfile.mkdtemp()
     py_file = os.path.join(tmpd, os.path.basename(notebook).replace(".ipynb", ".py"))
     json_file = os.path.join(tmpd, os.path.basename(notebook).replace(".ipynb", ".json"))
-    _ = run(notebook, filename=py_file, **run_kw)
+    _ = generateTests(notebook, filename=py_file, **run_kw)
     ret = []
     try:
         # enable collecting info via json
@@ -102,7 +185,8 @@ def runWithReport(notebook, executable=None, collect_only=False, **run_kw):
         argv = executable + ["--internal-json-report=" + json_file, py_file]
         if collect_only:
             argv.append("--collect-only")
-        subprocess.call(argv)
+        with tracing.span("pytest"):
+            subprocess.call(argv)
         with open(json_file, "r", encoding="utf-8") as f:
             # load json from file
             data = json.load(f)
@@ -119,13 +203,16 @@ def runWithReport(notebook, executable=None, collect_only=False, **run_kw):
 
             if node.get("outcome") == "passed":
                 outcome = 1
-            elif "outcome" not in node:
+            elif node.get("outcome", "skipped") == "skipped":
+                # e.g. remaining cells after an aborted run
                 outcome = 0
             else:
                 outcome = -1
 
             if "test_cell_coverage" in node["nodeid"]:
                 ret.append(TestMessage(-1, "Testing cell coverage", TestType.CELL_COVERAGE, outcome))
+            elif "test_code_coverage" in node["nodeid"]:
+                ret.append(TestMessage(-1, "Testing code coverage", TestType.CODE_COVERAGE, outcome))
             elif "test_cell" in node["nodeid"]:
                 cell_no = node["nodeid"].rsplit("_", 1)[-1]
                 ret.append(TestMessage(int(cell_no) + 1, "Testing cell", TestType.CELL_TEST, outcome))
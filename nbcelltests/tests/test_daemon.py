@@ -0,0 +1,135 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import os
+import pytest
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from nbcelltests import daemon
+
+BASIC_NB = os.path.join(os.path.dirname(__file__), "basic.ipynb")
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs unix sockets")
+
+
+@pytest.fixture
+def daemon_socket():
+    # short path: unix socket paths are limited to ~100 characters
+    path = os.path.join(tempfile.mkdtemp(), "d.sock")
+    # (a separate process, as the daemon redirects its stdout)
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from nbcelltests.daemon import serve; serve(%r)" % path], stdout=subprocess.DEVNULL
+    )
+    for _ in range(200):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    assert daemon.stop(path)
+    process.wait(30)
+    assert not os.path.exists(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def test_no_daemon(tmp_path):
+    assert daemon.request(["lint", BASIC_NB], path=str(tmp_path / "none.sock")) is None
+    assert not daemon.stop(str(tmp_path / "none.sock"))
+
+
+def test_request(daemon_socket, capsys):
+    status = daemon.request(["lint", os.path.basename(BASIC_NB), "--lines_per_cell", "1"], path=daemon_socket)
+    out = capsys.readouterr().out
+    # in the client's directory (so nothing found here)
+    assert status == 1
+    assert "FileNotFoundError" in out
+
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(BASIC_NB))
+    try:
+        status = daemon.request(["lint", os.path.basename(BASIC_NB), "--lines_per_cell", "1"], path=daemon_socket)
+    finally:
+        os.chdir(cwd)
+    out = capsys.readouterr().out
+    assert "PASSED: Checking lines in cell (max=1; actual=1) (Cell 1)" in out
+    # as without a daemon: the rules passed, but flake8 finds problems
+    assert status == 1
+
+
+def test_request_usage_error(daemon_socket, capsys):
+    assert daemon.request(["lint"], path=daemon_socket) == 2
+    assert "required: notebook" in capsys.readouterr().out
+
+
+@pytest.fixture
+def fake_daemon(tmp_path):
+    # answers every request with exit status 42
+    import socketserver
+    import threading
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.rfile.readline()
+            self.wfile.write(b'{"status": 42}\n')
+
+    path = str(tmp_path / "d.sock")
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    os.chmod(path, 0o600)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_private_socket(fake_daemon):
+    assert daemon.request(["lint", BASIC_NB], path=fake_daemon) == 42
+
+
+@pytest.mark.parametrize("untrusted", ["mode", "owner", "directory"])
+def test_untrusted_socket(fake_daemon, untrusted, monkeypatch, capsys):
+    if untrusted == "mode":
+        os.chmod(fake_daemon, 0o666)
+    elif untrusted == "owner":
+        monkeypatch.setattr(daemon.os, "getuid", lambda: os.stat(fake_daemon).st_uid + 1)
+    else:
+        os.chmod(os.path.dirname(fake_daemon), 0o777)
+    assert daemon.request(["lint", BASIC_NB], path=fake_daemon) is None
+    assert "ignoring %s" % fake_daemon in capsys.readouterr().err
+
+    # the command runs in this process instead
+    from nbcelltests.__main__ import main
+
+    monkeypatch.setenv(daemon.SOCKET_ENV, fake_daemon)
+    monkeypatch.delenv(daemon.NO_DAEMON_ENV, raising=False)
+    with pytest.raises(SystemExit) as e:
+        main(["lint", BASIC_NB, "--lines_per_cell", "1"])
+    assert e.value.code == 1
+    assert "PASSED: Checking lines in cell" in capsys.readouterr().out
+
+
+def test_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv(daemon.SOCKET_ENV, raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert daemon.socket_path() == str(tmp_path / ("nbcelltests-%d.sock" % os.getuid()))
+    # (not directly in the shared temporary directory)
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    directory = os.path.join(tempfile.gettempdir(), "nbcelltests-%d" % os.getuid())
+    assert daemon.socket_path() == os.path.join(directory, "daemon.sock")
+
+
+def test_serve_in_shared_directory(tmp_path):
+    os.chmod(str(tmp_path), 0o777)
+    with pytest.raises(RuntimeError, match="others can write to"):
+        daemon.serve(str(tmp_path / "d.sock"))
+
+
+def test_one_daemon_per_socket(daemon_socket):
+    with pytest.raises(RuntimeError, match="already running"):
+        daemon.serve(daemon_socket)
@@ -0,0 +1,82 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import os
+import pytest
+
+from nbcelltests.discover import IgnoreRule, find_notebooks, ignored
+
+
+def _tree(root, files):
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def _found(root, **kw):
+    return sorted(os.path.relpath(path, root).replace(os.path.sep, "/") for path in find_notebooks(str(root), **kw))
+
+
+@pytest.mark.parametrize(
+    "pattern, path, is_directory, expected",
+    [
+        ("*.ipynb", "a/b/c.ipynb", False, True),
+        ("c.ipynb", "a/b/c.ipynb", False, True),
+        ("/c.ipynb", "a/b/c.ipynb", False, False),
+        ("/c.ipynb", "c.ipynb", False, True),
+        ("a/*.ipynb", "a/b/c.ipynb", False, False),
+        ("a/**/c.ipynb", "a/b/c.ipynb", False, True),
+        ("**/b", "a/b", True, True),
+        ("a/**", "a/b/c.ipynb", False, True),
+        ("b/", "a/b", True, True),
+        ("b/", "a/b", False, False),
+        ("[ab].ipynb", "x/a.ipynb", False, True),
+        ("[!ab].ipynb", "x/a.ipynb", False, False),
+        ("?.ipynb", "x/ab.ipynb", False, False),
+    ],
+)
+def test_ignore_rule(tmp_path, pattern, path, is_directory, expected):
+    rule = IgnoreRule(str(tmp_path), pattern)
+    assert rule.matches(str(tmp_path / path), is_directory) is expected
+
+
+def test_ignored_negation(tmp_path):
+    rules = [IgnoreRule(str(tmp_path), "*.ipynb"), IgnoreRule(str(tmp_path), "!keep.ipynb")]
+    assert ignored(str(tmp_path / "x.ipynb"), False, rules)
+    assert not ignored(str(tmp_path / "keep.ipynb"), False, rules)
+
+
+def test_find_notebooks(tmp_path):
+    _tree(
+        tmp_path,
+        {
+            ".gitignore": "# comment\nbuild/\nscratch*.ipynb\n!scratch_keep.ipynb\n",
+            "a.ipynb": "",
+            "a.py": "",
+            "sub/b.ipynb": "",
+            "sub/.gitignore": "/b2.ipynb\n",
+            "sub/b2.ipynb": "",
+            "sub/deeper/b2.ipynb": "",
+            "sub/.ipynb_checkpoints/b-checkpoint.ipynb": "",
+            "build/c.ipynb": "",
+            "scratch.ipynb": "",
+            "scratch_keep.ipynb": "",
+        },
+    )
+    assert _found(tmp_path) == ["a.ipynb", "scratch_keep.ipynb", "sub/b.ipynb", "sub/deeper/b2.ipynb"]
+    assert _found(tmp_path, gitignore=False) == [
+        "a.ipynb",
+        "build/c.ipynb",
+        "scratch.ipynb",
+        "scratch_keep.ipynb",
+        "sub/b.ipynb",
+        "sub/b2.ipynb",
+        "sub/deeper/b2.ipynb",
+    ]
+    assert _found(tmp_path, include=["sub/*"]) == ["sub/b.ipynb", "sub/deeper/b2.ipynb"]
+    assert _found(tmp_path, exclude=["sub/deeper", "scratch*"]) == ["a.ipynb", "sub/b.ipynb"]
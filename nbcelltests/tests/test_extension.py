@@ -6,9 +6,23 @@
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
 # for Coverage
+import nbformat
+import os
+import pytest
+import tornado.ioloop
+from jupyter_server.services.contents.filemanager import FileContentsManager
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 
-from nbcelltests import load_jupyter_server_extension
+from nbcelltests import extension, load_jupyter_server_extension
+from nbcelltests.extension import (
+    MetricsHandler,
+    RunCelltestsHandler,
+    RunLintsHandler,
+    notebook_from_sources,
+    sources_from_notebook,
+)
+from nbcelltests.sessions import RevisionMismatch, SessionStore
 
 
 class TestExtension:
@@ -18,3 +32,126 @@ class TestExtension:
         m.web_app.settings = {}
         m.web_app.settings["base_url"] = "/test"
         load_jupyter_server_extension(m)
+
+
+def test_notebook_from_sources():
+    sources = {
+        "metadata": {"celltests": {"lines_per_cell": 2}, "kernelspec": {"name": "python3", "display_name": "Python 3"}},
+        "cells": [
+            {"cell_type": "markdown", "source": "# Title", "metadata": {}},
+            {
+                "cell_type": "code",
+                "source": "x = 1",
+                "metadata": {"celltests": ["%cell\n", "assert x == 1"], "celltests_timeout": 5, "other": 1},
+            },
+        ],
+    }
+    nb = notebook_from_sources(sources)
+    nbformat.validate(nb)
+    assert nb.metadata == sources["metadata"]
+    assert [cell.cell_type for cell in nb.cells] == ["markdown", "code"]
+    assert nb.cells[1].source == "x = 1"
+    assert nb.cells[1].outputs == []
+    assert nb.cells[1].metadata == {"celltests": ["%cell\n", "assert x == 1"], "celltests_timeout": 5}
+
+
+def test_notebook_from_sources_unknown_cell_type():
+    with pytest.raises(ValueError, match="Unknown cell type 'other'"):
+        notebook_from_sources({"cells": [{"cell_type": "other", "source": ""}]})
+
+
+def test_sources_from_notebook():
+    nb = nbformat.v4.new_notebook(
+        cells=[
+            nbformat.v4.new_code_cell(
+                "x = 1", metadata={"celltests": ["%cell"], "tags": ["a"]}, outputs=[nbformat.v4.new_output("stream")]
+            ),
+            nbformat.v4.new_markdown_cell("# Title"),
+        ],
+        metadata={"kernelspec": {"name": "python3", "display_name": "Python 3"}},
+    )
+    sources = sources_from_notebook(nb)
+    assert sources["cells"][0] == {"cell_type": "code", "source": "x = 1", "metadata": {"celltests": ["%cell"]}}
+    assert sources_from_notebook(notebook_from_sources(sources)) == sources
+
+
+def test_saved_session(tmp_path):
+    contents = FileContentsManager(root_dir=str(tmp_path))
+    nbformat.write(nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell("x = 1")]), str(tmp_path / "a.ipynb"))
+    saved = contents.get("a.ipynb", content=False)["last_modified"].isoformat().replace("+00:00", "Z")
+    handler = SimpleNamespace(contents_manager=contents, sessions=SessionStore())
+    path = os.path.join(str(tmp_path), "a.ipynb")
+
+    def saved_session(token):
+        return tornado.ioloop.IOLoop.current().run_sync(
+            lambda: RunLintsHandler._saved_session(handler, path, {"path": "a.ipynb", "saved": token})
+        )
+
+    session = saved_session(saved)
+    assert [cell["source"] for cell in session.cells] == ["x = 1"]
+    # unchanged file: not read again
+    contents.get = None
+    assert saved_session(saved) is session
+    assert saved_session(saved).revision == session.revision
+
+    del contents.get
+    with pytest.raises(RevisionMismatch):
+        saved_session("2000-01-01T00:00:00Z")
+
+
+def test_metrics(tmp_path):
+    sessions = SessionStore()
+    sources = {"metadata": {}, "cells": [{"cell_type": "code", "source": "x = 1"}, {"cell_type": "code", "source": "x"}]}
+    session = sessions.update("a.ipynb", {"sources": sources})
+    handler = SimpleNamespace(executable=None, rules={}, _phases={}, _origin=None)
+    path = str(tmp_path / "a.ipynb")
+    nbformat.write(notebook_from_sources(sources), path)
+
+    hits, misses = (extension.CACHE_REQUESTS.value(cache="cells", result=result) for result in ("hit", "miss"))
+    RunLintsHandler._run_notebook(handler, path, session, session.sources())
+    assert extension.CACHE_REQUESTS.value(cache="cells", result="miss") == misses + 2
+    assert handler._phases["lint"] > 0
+
+    sources["cells"][1]["source"] = "y = x"
+    session = sessions.update("a.ipynb", {"sources": sources})
+    RunLintsHandler._run_notebook(handler, path, session, session.sources())
+    assert extension.CACHE_REQUESTS.value(cache="cells", result="hit") == hits + 1
+    assert extension.CACHE_REQUESTS.value(cache="cells", result="miss") == misses + 3
+
+    handler = SimpleNamespace(set_header=MagicMock(), finish=MagicMock())
+    MetricsHandler.get.__wrapped__(handler)
+    handler.set_header.assert_called_once_with("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    rendered = handler.finish.call_args[0][0]
+    assert 'nbcelltests_executor_threads{kind="lint"} 4\n' in rendered
+    assert 'nbcelltests_executor_threads{kind="test"} 4\n' in rendered
+    assert '\nnbcelltests_cache_requests_total{cache="cells",result="hit"} ' in rendered
+
+
+class _Runner(object):
+    # a handler running nothing, counting runs
+    def __init__(self, handler_class):
+        self.kind, self.cache_results = handler_class.kind, handler_class.cache_results
+        self._phases, self._queued, self.runs = {}, 0, 0
+
+    def _write_notebook(self, path, to_notebook, request):
+        nbformat.write(to_notebook(request), path)
+
+    def _run_notebook(self, path, session=None, sources=None):
+        self.runs += 1
+        return self.runs
+
+
+@pytest.mark.parametrize("handler_class, runs", [(RunLintsHandler, 1), (RunCelltestsHandler, 2)])
+def test_cached_results(handler_class, runs):
+    session = SessionStore().update("a.ipynb", {"sources": {"metadata": {}, "cells": [{"cell_type": "code", "source": "x = 1"}]}})
+    handler = _Runner(handler_class)
+    key = session.key() if handler.cache_results else None
+    for _ in range(2):
+        handler_class._run.__wrapped__(handler, {}, "a.ipynb", session, session.sources(), key)
+    # (test runs always run again)
+    assert handler.runs == runs
+    assert not session.lock.locked()
+
+
+def test_separate_executors():
+    assert RunCelltestsHandler.executor is not RunLintsHandler.executor
@@ -0,0 +1,117 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import json
+import os
+import pytest
+
+from nbcelltests.__main__ import run
+from nbcelltests.history import MIN_RUNS, RunHistory, TimingHistory, regression
+
+
+def test_regression():
+    previous = [1.0, 1.1, 0.9, 1.0, 1.0]
+    assert regression(1.2, previous, threshold=3) is None
+    mean, stdev = regression(2.0, previous, threshold=3)
+    assert mean == 1.0
+    assert 0.07 < stdev < 0.08
+
+
+def test_regression_needs_history():
+    assert regression(100, [1.0] * (MIN_RUNS - 1), threshold=3) is None
+
+
+def test_regression_minimum_spread():
+    # identical timings: small changes aren't regressions
+    assert regression(1.1, [1.0] * MIN_RUNS, threshold=3) is None
+    assert regression(1.2, [1.0] * MIN_RUNS, threshold=3) is not None
+
+
+def test_timing_history(tmp_path):
+    history = TimingHistory(tmp_path / "history.db", "env")
+    history.record("a.ipynb", "x = 1", 1.0)
+    history.record("a.ipynb", "x = 1", 2.0)
+    history.record("a.ipynb", "x = 2", 3.0)
+    history.record("b.ipynb", "x = 1", 4.0)
+    TimingHistory(tmp_path / "history.db", "other env").record("a.ipynb", "x = 1", 5.0)
+
+    assert history.recent("a.ipynb", "x = 1", window=10) == [2.0, 1.0]
+    assert history.recent("a.ipynb", "x = 1", window=1) == [2.0]
+    assert history.recent(os.path.abspath("a.ipynb"), "x = 1", window=10) == [2.0, 1.0]
+    assert history.recent("a.ipynb", "x = 3", window=10) == []
+
+
+def _test_run(history, notebook, started, *outcomes, **kwargs):
+    # outcomes: (cell, outcome, seconds) of each cell's test
+    results = [
+        dict(cell=cell, cell_hash="hash%d" % cell, name="test_code_cell_%d" % cell, outcome=outcome, seconds=seconds)
+        for cell, outcome, seconds in outcomes
+    ]
+    return history.record("test", notebook, results, started, **kwargs)
+
+
+@pytest.fixture
+def runs(tmp_path, monkeypatch):
+    # (notebooks are recorded relative to the database)
+    monkeypatch.chdir(tmp_path)
+    history = RunHistory("runs.db")
+    day = 24 * 60 * 60
+    start = 1700000000
+    _test_run(history, "a.ipynb", start, (1, "passed", 1.0), (2, "passed", 3.0), seconds=5)
+    _test_run(history, "a.ipynb", start + 1, (1, "passed", 2.0), (2, "failed", 5.0), seconds=8)
+    _test_run(history, "a.ipynb", start + 2, (1, "passed", 3.0), (2, "passed", None), (3, "skipped", None), seconds=5)
+    _test_run(history, "b.ipynb", start + day, (1, "failed", 0.5), (2, "passed", 0.1), seconds=1)
+    _test_run(history, "b.ipynb", start + day + 1, (1, "failed", 0.5), (2, "failed", 0.1), seconds=1)
+    history.record("lint", "b.ipynb", [dict(name="linter", outcome="passed")], start + day)
+    return history
+
+
+def test_slowest(runs):
+    slowest = runs.slowest()
+    assert [(r["notebook"], r["cell"], r["runs"], r["mean_seconds"], r["max_seconds"]) for r in slowest] == [
+        ("a.ipynb", 2, 2, 4.0, 5.0),
+        ("a.ipynb", 1, 3, 2.0, 3.0),
+        ("b.ipynb", 1, 2, 0.5, 0.5),
+        ("b.ipynb", 2, 2, 0.1, 0.1),
+    ]
+    assert len(runs.slowest(limit=1)) == 1
+    assert [r["cell"] for r in runs.slowest(notebook="b.ipynb")] == [1, 2]
+    assert [r["notebook"] for r in runs.slowest(since=1700000000 + 60)] == ["b.ipynb", "b.ipynb"]
+
+
+def test_flakiest(runs):
+    # (b's cell 1 always fails; skips don't count)
+    assert runs.flakiest() == [
+        {"notebook": "a.ipynb", "cell": 2, "runs": 3, "failures": 1, "flips": 2},
+        {"notebook": "b.ipynb", "cell": 2, "runs": 2, "failures": 1, "flips": 1},
+    ]
+
+
+def test_trends(runs):
+    trends = runs.trends()
+    assert [(r["kind"], r["runs"], r["failed"], r["mean_seconds"]) for r in trends] == [
+        ("test", 3, 1, 6.0),
+        ("lint", 1, 0, None),
+        ("test", 2, 2, 1.0),
+    ]
+    assert trends[0]["period"] < trends[1]["period"] == trends[2]["period"]
+    assert [r["runs"] for r in runs.trends("month", kind="test")] == [5]
+    with pytest.raises(ValueError, match="period must be one of"):
+        runs.trends("year")
+
+
+def test_history_cli(runs, capsys):
+    assert run(["history", "slowest", runs.path, "--limit", "2"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ["notebook", "cell", "runs", "mean", "max", "peak", "memory"]
+    assert lines[1].split() == ["a.ipynb", "2", "2", "4.00s", "5.00s", "-"]
+    assert len(lines) == 3
+
+    assert run(["history", "flakiest", runs.path, "--json"]) == 0
+    assert json.loads(capsys.readouterr().out) == runs.flakiest()
+
+    assert run(["history", "trends", os.path.join(os.path.dirname(runs.path), "missing.db")]) == 1
@@ -0,0 +1,75 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+from nbval.kernel import CURRENT_ENV_KERNEL_NAME
+
+from nbcelltests.kernels import KernelPool
+
+
+def _cwd(kernel):
+    msg_id = kernel.kc.execute("", silent=True, user_expressions={"cwd": "__import__('os').getcwd()"})
+    while True:
+        reply = kernel.kc.get_shell_msg(timeout=10)
+        if reply["parent_header"].get("msg_id") == msg_id:
+            return eval(reply["content"]["user_expressions"]["cwd"]["data"]["text/plain"])
+
+
+def test_no_prestart(tmp_path):
+    pool = KernelPool()
+    kernel = pool.acquire(CURRENT_ENV_KERNEL_NAME, str(tmp_path))
+    try:
+        assert _cwd(kernel) == str(tmp_path)
+        assert pool._spares == {}
+    finally:
+        kernel.stop()
+
+
+def test_prestart(tmp_path):
+    first_dir = tmp_path / "first"
+    second_dir = tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    pool = KernelPool(prestart=True)
+    try:
+        first = pool.acquire(CURRENT_ENV_KERNEL_NAME, str(first_dir))
+        spare = pool._spares[CURRENT_ENV_KERNEL_NAME]
+        second = pool.acquire(CURRENT_ENV_KERNEL_NAME, str(second_dir))
+
+        # the spare was handed out, moved to the notebook's directory, and replaced
+        assert second is spare.result()
+        assert second is not first
+        assert _cwd(first) == str(first_dir)
+        assert _cwd(second) == str(second_dir)
+        assert pool._spares[CURRENT_ENV_KERNEL_NAME] is not spare
+        first.stop()
+        second.stop()
+    finally:
+        pool.shutdown()
+    assert pool._spares == {}
+    assert not spare.result().is_alive()
+
+
+def test_keep(tmp_path):
+    pool = KernelPool()
+    pool.keep = True
+    try:
+        pool.warm(CURRENT_ENV_KERNEL_NAME)
+        spare = pool._spares[CURRENT_ENV_KERNEL_NAME]
+        # warming again doesn't start another
+        pool.warm(CURRENT_ENV_KERNEL_NAME)
+        assert pool._spares[CURRENT_ENV_KERNEL_NAME] is spare
+        pool.shutdown()
+        assert pool._spares[CURRENT_ENV_KERNEL_NAME] is spare
+
+        kernel = pool.acquire(CURRENT_ENV_KERNEL_NAME, str(tmp_path))
+        assert kernel is spare.result()
+        assert _cwd(kernel) == str(tmp_path)
+        kernel.stop()
+    finally:
+        pool.shutdown(force=True)
+    assert pool._spares == {}
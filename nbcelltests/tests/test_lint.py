@@ -5,14 +5,20 @@
 # This file is part of the nbcelltests library, distributed under the terms of
 # the Apache License 2.0.  The full license can be found in the LICENSE file.
 #
+import nbformat
 import os
 import pytest
+import shutil
+import sys
 from bs4 import BeautifulSoup
 from collections import namedtuple
 from operator import itemgetter
 
+from nbcelltests.__main__ import run as cli_run
 from nbcelltests.define import LintType
+from nbcelltests.history import RunHistory
 from nbcelltests.lint import (
+    lint_batch,
     lint_cells_per_notebook,
     lint_class_definitions,
     lint_function_definitions,
@@ -20,7 +26,10 @@ from nbcelltests.lint import (
     lint_lines_per_cell,
     lint_magics,
     run,
+    run_many,
+    run_ruff,
 )
+from nbcelltests.lint.live import lint_cells
 
 LR = namedtuple("lint_result", ["passed", "type"])
 
@@ -262,6 +271,131 @@ def test_runWithHTMLReturn_fail():
     )
 
 
+@pytest.mark.skipif(shutil.which("ruff") is None, reason="needs ruff")
+def test_run_ruff():
+    nb = os.path.join(os.path.dirname(__file__), "basic.ipynb")
+    ret, passed = run(
+        nb,
+        rules={"cells_per_notebook": 10},
+        run_python_linter=True,
+        linter="ruff",
+        executable=["ruff", "check", "--isolated"],
+    )
+    # the linter's findings fail the notebook (as with flake8)
+    assert passed is False
+    linter = [r for r in ret if r.type == LintType.LINTER]
+    # each problem, in its cell
+    assert str(linter[0]).startswith("FAILED: Checking lint: %s:1:8: E701 " % nb)
+    assert [r.cell for r in linter] == [3, 4, 4, 5, 5]
+    assert "F821 Undefined name `x` (Cell 5)" in str(linter[3])
+
+
+@pytest.mark.skipif(shutil.which("ruff") is None, reason="needs ruff")
+def test_run_ruff_many(tmp_path):
+    nb = os.path.join(os.path.dirname(__file__), "basic.ipynb")
+    clean = os.path.join(os.path.dirname(__file__), "_cell_counting.ipynb")
+    found = run_ruff([nb, clean], executable=["ruff", "check", "--isolated", "--select", "F821"])
+    assert [d["code"] for d in found[nb]] == ["F821"]
+    assert found[clean] == []
+    ret, passed = run(clean, run_python_linter=True, linter="ruff", executable=["ruff", "check", "--isolated"])
+    assert [str(r) for r in ret] == ["PASSED: Checking lint"]
+    assert passed is True
+
+    with pytest.raises(RuntimeError, match="ruff failed"):
+        run_ruff([nb], executable=["ruff", "check", "--select", "NOTARULE"])
+    with pytest.raises(ValueError, match="Unknown linter"):
+        run(nb, linter="pylint")
+
+
+def test_run_many(tmp_path):
+    basic = os.path.join(os.path.dirname(__file__), "basic.ipynb")
+    magics = os.path.join(os.path.dirname(__file__), "magics.ipynb")
+    missing = str(tmp_path / "missing.ipynb")
+    results = run_many([basic, magics, missing], rules={"lines_per_cell": 1}, run_python_linter=True)
+    # (basic passes its rules, but flake8 finds problems)
+    assert [(notebook, passed) for notebook, _, passed in results] == [(basic, False), (magics, False), (missing, False)]
+
+    # flake8's findings, each for its cell (and row in the cell)
+    linter = [str(r) for r in results[0][1] if r.type == LintType.LINTER]
+    assert linter[0] == "FAILED: Checking lint: %s:2:1: E704 multiple statements on one line (def) (Cell 1)" % basic
+    assert "%s:1:4: F821 undefined name 'x' (Cell 5)" % basic in linter[5]
+    # (the markdown cell is in the script as comments)
+    assert linter[-1] == "FAILED: Checking lint: %s (as a script):38:2: W291 trailing whitespace" % basic
+    assert [r.cell for r in results[1][1] if r.type == LintType.LINTER] == [1, 1, 2, 3]
+    assert results[2][1] == ["ERROR: FileNotFoundError: [Errno 2] No such file or directory: %r" % missing]
+
+    # the same as one at a time (including the linter's findings)
+    single, passed = run(basic, rules={"lines_per_cell": 1}, run_python_linter=True)
+    assert [str(r) for r in single] == [str(r) for r in results[0][1]]
+    assert passed is False
+
+
+def test_cli_exit_status(tmp_path):
+    clean, unclean = tmp_path / "clean", tmp_path / "unclean"
+    for directory, source in ((clean, "x = 1"), (unclean, "import os")):
+        directory.mkdir()
+        nbformat.write(nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)]), str(directory / "a.ipynb"))
+
+    assert cli_run(["lint", str(clean / "a.ipynb")]) == 0
+    assert cli_run(["lint", str(clean)]) == 0
+    # flake8's findings fail the notebook, in either mode
+    assert cli_run(["lint", str(unclean / "a.ipynb")]) == 1
+    assert cli_run(["lint", str(unclean)]) == 1
+
+
+def test_run_history(tmp_path):
+    magics = os.path.join(os.path.dirname(__file__), "magics.ipynb")
+    missing = str(tmp_path / "missing.ipynb")
+    db = str(tmp_path / "runs.db")
+    run(magics, rules={"lines_per_cell": 1, "run_history": db})
+    run_many([magics, missing], rules={"lines_per_cell": 1, "run_history": db})
+
+    history = RunHistory(db)
+    runs = history._query("SELECT * FROM runs ORDER BY id", [])
+    key = os.path.relpath(magics, str(tmp_path)).replace(os.path.sep, "/")
+    assert [(r["kind"], r["notebook"], r["passed"]) for r in runs] == [
+        ("lint", key, 0),
+        ("lint", key, 0),
+        ("lint", "missing.ipynb", 0),
+    ]
+    assert runs[0]["seconds"] is not None and runs[1]["seconds"] is None
+    assert runs[0]["notebook_hash"] == runs[1]["notebook_hash"] and runs[2]["notebook_hash"] is None
+    results = history._query("SELECT * FROM run_results WHERE run = ? ORDER BY cell", [runs[0]["id"]])
+    assert [(r["cell"], r["name"], r["outcome"]) for r in results] == [
+        (1, "lines_per_cell", "failed"),
+        (2, "lines_per_cell", "passed"),
+        (3, "lines_per_cell", "failed"),
+        (4, "lines_per_cell", "failed"),
+    ]
+    assert results[0]["message"] == "Checking lines in cell (max=1; actual=2)"
+    (error,) = history._query("SELECT * FROM run_results WHERE run = ?", [runs[2]["id"]])
+    assert (error["name"], error["outcome"]) == ("error", "failed")
+
+
+def test_run_history_origin(tmp_path):
+    # (as the server extension lints a copy)
+    origin = str(tmp_path / "notebooks" / "a.ipynb")
+    (tmp_path / "notebooks").mkdir()
+    copy = tmp_path / "copy"
+    copy.mkdir()
+    nb = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell("x = 1")], metadata={"celltests": {"run_history": "runs.db"}}
+    )
+    nbformat.write(nb, str(copy / "a.ipynb"))
+
+    run(str(copy / "a.ipynb"), origin=origin)
+    assert not (copy / "runs.db").exists()
+    runs = RunHistory(str(tmp_path / "notebooks" / "runs.db"))._query("SELECT * FROM runs", [])
+    assert [r["notebook"] for r in runs] == ["a.ipynb"]
+
+
+def test_lint_batch_unattributed():
+    nb = nbformat.read(os.path.join(os.path.dirname(__file__), "more.ipynb"), 4)
+    findings, attributed = lint_batch({"a": nb, "b": nb}, executable=[sys.executable, "-c", "print('broken')"])
+    assert not attributed
+    assert findings == {"a": [(-1, "broken")], "b": [(-1, "broken")]}
+
+
 def _check(html, expected_results):
     # quick checking html matches expected results
     soup = BeautifulSoup(html, "html.parser")
@@ -273,3 +407,43 @@ def _check(html, expected_results):
     ):
         assert actual.text.startswith(expected[0])
         assert actual.text.endswith(expected[1])
+
+
+def _codes(diagnostics):
+    return [(d["cell"], d["line"], d["code"]) for d in diagnostics]
+
+
+def test_lint_cells():
+    cells = [{"index": 2, "source": "import os\nx = y + 1\nprint(z)\ndisplay(x)"}]
+    assert _codes(lint_cells(cells)) == [(2, 2, "UndefinedName"), (2, 3, "UndefinedName")]
+    # names from context, given directly or defined by other cells
+    context = ["z", {"source": "import numpy as y\nfor i in range(3):\n    pass"}]
+    assert lint_cells(cells, context) == []
+
+
+def test_lint_cells_star_import():
+    cells = [{"index": 1, "source": "print(z)"}]
+    assert lint_cells(cells, [{"source": "from os.path import *"}]) == []
+
+
+def test_lint_cells_magics():
+    assert lint_cells([{"index": 0, "source": "%matplotlib inline\nx = 1"}]) == []
+    # not python
+    assert lint_cells([{"index": 0, "source": "%%bash\nls $undefined"}]) == []
+    denied = lint_cells([{"index": 0, "source": "%%bash\nls"}], rules={"magics_denylist": ["bash"]})
+    assert _codes(denied) == [(0, None, "magics")]
+
+
+def test_lint_cells_syntax_error():
+    (diagnostic,) = lint_cells([{"index": 0, "source": "x = 1\ny = (\n"}])
+    assert diagnostic["line"] == 2
+    assert diagnostic["code"] == "SyntaxError"
+    assert diagnostic["severity"] == "error"
+
+
+def test_lint_cells_lines_per_cell():
+    cells = [{"index": 0, "source": "x = 1\ny = 2"}, {"index": 1, "source": "z = 3"}]
+    (diagnostic,) = lint_cells(cells, rules={"lines_per_cell": 1})
+    assert diagnostic["cell"] == 0
+    assert diagnostic["type"] == LintType.LINES_PER_CELL.value
+    assert diagnostic["message"] == "Checking lines in cell (max=1; actual=2)"
@@ -0,0 +1,55 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import pytest
+
+from nbcelltests.metrics import Registry
+
+
+def test_render():
+    metrics = Registry()
+    requests = metrics.counter("requests_total", "Requests.", ("handler", "status"))
+    queued = metrics.gauge("queued", "Waiting.")
+    seconds = metrics.histogram("seconds", 'Time "taken".', ("phase",), buckets=(0.5, 1))
+
+    requests.inc(handler="test/run", status=200)
+    requests.inc(2, handler="test/run", status=200)
+    requests.inc(handler='a"b\\c\nd', status=500)
+    queued.inc()
+    queued.inc()
+    queued.dec()
+    seconds.observe(0.25, phase="parse")
+    seconds.observe(0.75, phase="parse")
+    seconds.observe(5, phase="parse")
+
+    assert metrics.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{handler="a\\"b\\\\c\\nd",status="500"} 1',
+        'requests_total{handler="test/run",status="200"} 3',
+        "# HELP queued Waiting.",
+        "# TYPE queued gauge",
+        "queued 1",
+        '# HELP seconds Time "taken".',
+        "# TYPE seconds histogram",
+        'seconds_bucket{phase="parse",le="0.5"} 1',
+        'seconds_bucket{phase="parse",le="1"} 2',
+        'seconds_bucket{phase="parse",le="+Inf"} 3',
+        'seconds_sum{phase="parse"} 6',
+        'seconds_count{phase="parse"} 3',
+    ]
+    assert requests.value(handler="test/run", status=200) == 3
+    assert seconds.value(phase="parse") == 3
+    assert seconds.value(phase="other") == 0
+
+
+def test_labels_checked():
+    requests = Registry().counter("requests_total", "Requests.", ("handler",))
+    with pytest.raises(ValueError, match="has labels"):
+        requests.inc(status=200)
+    with pytest.raises(ValueError, match="can't be decreased"):
+        requests.inc(-1, handler="a")
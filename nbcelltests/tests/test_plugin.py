@@ -0,0 +1,142 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import json
+import os
+import pytest
+import re
+import shutil
+from collections import defaultdict
+from importlib.metadata import entry_points
+from types import SimpleNamespace
+
+from nbcelltests import kernels, plugin
+
+pytest_plugins = "pytester"
+
+CUMULATIVE_RUN = os.path.join(os.path.dirname(__file__), "_cumulative_run.ipynb")
+TEST_FAIL = os.path.join(os.path.dirname(__file__), "_test_fail.ipynb")
+COVERAGE = os.path.join(os.path.dirname(__file__), "_cell_coverage.ipynb")
+CODE_COVERAGE = os.path.join(os.path.dirname(__file__), "_code_coverage.ipynb")
+MEMORY = os.path.join(os.path.dirname(__file__), "_memory.ipynb")
+
+# Default to using kernel from current environment (like --current-env of nbval).
+CURRENT_ENV = int(os.environ.get("NBCELLTESTS_TESTS_CURRENT_ENV", "1"))
+KERNEL_NAME = os.environ.get("NBCELLTESTS_TESTS_KERNEL_NAME", "")
+
+
+def _runpytest(pytester, *notebooks, args=()):
+    """Copy notebooks into pytester's dir, and run pytest on them with the plugin enabled."""
+    for nb in notebooks:
+        shutil.copy(nb, pytester.path)
+    argv = ["--nbcelltests", "-p", "no:cacheprovider"]
+    # not registered if nbcelltests isn't installed (e.g. running from a checkout)
+    if "nbcelltests" not in {ep.name for ep in entry_points(group="pytest11")}:
+        argv += ["-p", "nbcelltests.plugin"]
+    if CURRENT_ENV:
+        argv.append("--nbcelltests-current-env")
+    elif KERNEL_NAME:
+        argv.append("--nbcelltests-kernel-name=%s" % KERNEL_NAME)
+    return pytester.runpytest_subprocess(*argv, *args)
+
+
+def test_collects_notebook(pytester):
+    result = _runpytest(pytester, CUMULATIVE_RUN, args=["--collect-only", "-q"])
+    result.stdout.fnmatch_lines(["_cumulative_run.ipynb::test_code_cell_%d" % i for i in range(1, 9)])
+
+
+def test_not_collected_without_option(pytester):
+    shutil.copy(CUMULATIVE_RUN, pytester.path)
+    result = pytester.runpytest_subprocess("-p", "nbcelltests.plugin", "--collect-only", "-q")
+    result.stdout.no_fnmatch_line("*test_code_cell*")
+
+
+def test_cumulative_run(pytester):
+    """All cells share one kernel and run only once (see TestCumulativeRun in test_test.py)."""
+    result = _runpytest(pytester, CUMULATIVE_RUN)
+    result.assert_outcomes(passed=8)
+
+
+def test_failure(pytester):
+    result = _runpytest(pytester, TEST_FAIL)
+    result.assert_outcomes(failed=2)
+    result.stdout.fnmatch_lines(["*x should have been -1 but was 1*"])
+
+
+def test_fail_fast(pytester):
+    result = _runpytest(pytester, TEST_FAIL, args=["--nbcelltests-fail-fast", "-rs"])
+    result.assert_outcomes(failed=1, skipped=1)
+    result.stdout.fnmatch_lines(["*Not run: stopped after the test for code cell 1 failed (fail fast)*"])
+
+
+def test_rules(pytester):
+    result = _runpytest(pytester, COVERAGE, args=["--nbcelltests-rules", json.dumps({"cell_coverage": 100})])
+    result.assert_outcomes(passed=4, failed=1)
+    result.stdout.fnmatch_lines(["*test_cell_coverage*"])
+
+
+def test_code_coverage(pytester):
+    result = _runpytest(pytester, CODE_COVERAGE, args=["--nbcelltests-rules", json.dumps({"code_coverage_per_cell": 70})])
+    result.assert_outcomes(passed=3, failed=1)
+    result.stdout.fnmatch_lines(["*Code cell 3 code coverage 66.7% < minimum required of 70% (lines not run: 4)*"])
+
+
+def test_memory(pytester):
+    result = _runpytest(pytester, MEMORY, args=["-v", "--nbcelltests-rules", json.dumps({"max_memory_per_cell": 50})])
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*Code cell 2 used * MiB of memory > maximum allowed of 50 MiB*",
+            "*nbcelltests cell resources*",
+            "_memory.ipynb::test_code_cell_1: *s, peak memory * MiB (+* MiB)",
+        ]
+    )
+
+
+def test_multiple_notebooks(pytester):
+    result = _runpytest(pytester, CUMULATIVE_RUN, COVERAGE)
+    # _cell_coverage.ipynb requires 50% coverage in its metadata
+    result.assert_outcomes(passed=12, failed=1)
+    result.stdout.fnmatch_lines(["FAILED _cell_coverage.ipynb::test_cell_coverage*"])
+
+
+def test_xdist_keeps_notebooks_together(pytester):
+    pytest.importorskip("xdist")
+    result = _runpytest(pytester, CUMULATIVE_RUN, COVERAGE, TEST_FAIL, args=["-n", "2", "-v"])
+    result.assert_outcomes(passed=12, failed=3)
+
+    workers = defaultdict(set)
+    for line in result.stdout.lines:
+        match = re.match(r"\[(gw\d+)\].* (\w+\.ipynb)::", line)
+        if match:
+            workers[match.group(2)].add(match.group(1))
+    assert sorted(workers) == ["_cell_coverage.ipynb", "_cumulative_run.ipynb", "_test_fail.ipynb"]
+    assert all(len(w) == 1 for w in workers.values()), workers
+
+
+def test_prestart_only_before_another_notebook(pytester):
+    pytester.makeconftest(
+        """
+from nbcelltests import kernels
+
+def pytest_runtest_call(item):
+    print("prestart %s %s" % (item.path.name, kernels._pool.prestart))
+"""
+    )
+    result = _runpytest(pytester, CUMULATIVE_RUN, TEST_FAIL, args=["--nbcelltests-prestart-kernels", "-s"])
+    result.stdout.fnmatch_lines(["*prestart _cumulative_run.ipynb True*", "*prestart _test_fail.ipynb False*"])
+
+
+def test_no_prestart_without_nbcelltests(monkeypatch):
+    # e.g. another project's xdist worker, with nbcelltests installed
+    monkeypatch.setattr(kernels._pool, "prestart", False)
+    options = {"nbcelltests": False, "nbcelltests_prestart_kernels": False}
+    config = SimpleNamespace(
+        workerinput={}, option=SimpleNamespace(), getoption=options.get, addinivalue_line=lambda *args: None
+    )
+    plugin.pytest_configure(config)
+    assert not kernels._pool.prestart
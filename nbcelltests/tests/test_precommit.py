@@ -0,0 +1,214 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import nbformat
+import os
+import pytest
+import shutil
+import subprocess
+import sys
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
+
+from nbcelltests import precommit, shared
+from nbcelltests.__main__ import run
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+
+def _git(*args):
+    subprocess.run(["git"] + list(args), check=True, stdout=subprocess.PIPE)
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _git("init", "-q")
+    return tmp_path
+
+
+def _write(path, *sources):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nb = new_notebook(cells=[new_markdown_cell("# title")] + [new_code_cell(source) for source in sources])
+    nbformat.write(nb, str(path))
+
+
+def _summary(results):
+    return [(path, [str(message) for message in messages], passed) for path, messages, passed in results]
+
+
+def _analysed(monkeypatch):
+    analysed = []
+    code_facts = shared.code_facts
+
+    def recording(source):
+        analysed.append(source)
+        return code_facts(source)
+
+    monkeypatch.setattr(shared, "code_facts", recording)
+    return analysed
+
+
+def test_staged_notebooks(repo):
+    _write(repo / "a.ipynb", "x = 1")
+    _write(repo / "sub" / "b.ipynb", "y = 2")
+    _write(repo / "unstaged.ipynb", "z = 3")
+    (repo / "c.py").write_text("")
+    _git("add", "a.ipynb", "sub/b.ipynb", "c.py")
+    assert [path for path, _ in precommit.staged_notebooks()] == ["a.ipynb", "sub/b.ipynb"]
+    assert [path for path, _ in precommit.staged_notebooks(["sub"])] == ["sub/b.ipynb"]
+
+    _git("-c", "user.name=a", "-c", "user.email=a@b", "commit", "-q", "-m", "x")
+    assert precommit.staged_notebooks() == []
+    os.remove("a.ipynb")
+    _git("add", "a.ipynb")
+    assert precommit.staged_notebooks() == []
+
+
+def test_reads_index(repo):
+    _write(repo / "a.ipynb", "x = 1\ny = 2")
+    _git("add", "a.ipynb")
+    # not staged
+    _write(repo / "a.ipynb", "x = 1")
+
+    ((path, messages, passed),) = precommit.lint_staged(rules={"lines_per_cell": 1}, run_python_linter=False)
+    assert path == "a.ipynb"
+    assert not passed
+    assert [str(message) for message in messages] == ["FAILED: Checking lines in cell (max=1; actual=2) (Cell 1)"]
+
+
+def test_cache(repo, monkeypatch):
+    analysed = _analysed(monkeypatch)
+    _write(repo / "a.ipynb", "import os", "os.getcwd()")
+    _write(repo / "b.ipynb", "x = 1", "print(y)")
+    _git("add", ".")
+
+    results = precommit.lint_staged()
+    assert [(path, passed) for path, _, passed in results] == [("a.ipynb", True), ("b.ipynb", False)]
+    assert "b.ipynb:" in str(results[1][1][-1]) and "undefined name 'y'" in str(results[1][1][-1])
+    assert sorted(analysed) == ["import os", "os.getcwd()", "print(y)", "x = 1"]
+    assert os.path.exists(precommit.cache_path())
+
+    # nothing changed: nothing analysed or linted again
+    lint_batch = precommit.lint_batch
+    del analysed[:]
+    monkeypatch.setattr(precommit, "lint_batch", None)
+    assert _summary(precommit.lint_staged()) == _summary(results)
+    assert analysed == []
+
+    # only the changed cell is analysed, and only its notebook linted
+    linted = []
+
+    def recording(notebooks, executable, linter):
+        linted.extend(notebooks.values())
+        return lint_batch(notebooks, executable, linter)
+
+    monkeypatch.setattr(precommit, "lint_batch", recording)
+    _write(repo / "b.ipynb", "y = 1", "print(y)")
+    _git("add", "b.ipynb")
+    del analysed[:]
+    results = precommit.lint_staged()
+    assert [(path, passed) for path, _, passed in results] == [("a.ipynb", True), ("b.ipynb", True)]
+    assert analysed == ["y = 1"]
+    assert len(linted) == 1 and linted[0].cells[1].source == "y = 1"
+
+    # (but not with use_cache=False)
+    del analysed[:]
+    precommit.lint_staged(use_cache=False)
+    assert len(analysed) == 4
+
+
+def test_cache_outputs_only_changed(repo, monkeypatch):
+    _write(repo / "a.ipynb", "x = 1")
+    _git("add", "a.ipynb")
+    precommit.lint_staged()
+
+    nb = nbformat.read("a.ipynb", 4)
+    nb.cells[1].execution_count = 7
+    nb.cells[1].outputs = [nbformat.v4.new_output("execute_result", data={"text/plain": "1"}, execution_count=7)]
+    nbformat.write(nb, "a.ipynb")
+    _git("add", "a.ipynb")
+    monkeypatch.setattr(precommit, "lint_batch", None)
+    ((_, _, passed),) = precommit.lint_staged()
+    assert passed
+
+
+def test_cache_linter_config(repo, monkeypatch):
+    _write(repo / "a.ipynb", "import os")
+    _git("add", "a.ipynb")
+    ((_, _, passed),) = precommit.lint_staged()
+    assert not passed
+
+    # the linter's configuration changed: linted again
+    (repo / "setup.cfg").write_text("[flake8]\nextend-ignore = F401\n")
+    ((_, _, passed),) = precommit.lint_staged()
+    assert passed
+
+    # (and after upgrading the linter)
+    linted = []
+    lint_batch, linter_setup = precommit.lint_batch, precommit._linter_setup
+
+    def recording(notebooks, executable, linter):
+        linted.extend(notebooks.values())
+        return lint_batch(notebooks, executable, linter)
+
+    monkeypatch.setattr(precommit, "lint_batch", recording)
+    precommit.lint_staged()
+    assert linted == []
+    monkeypatch.setattr(precommit, "_linter_setup", lambda *args: linter_setup(*args) + ["upgraded"])
+    precommit.lint_staged()
+    assert len(linted) == 1
+
+
+def test_linter_error_not_cached(repo):
+    _write(repo / "a.ipynb", "x = 1")
+    _git("add", "a.ipynb")
+    executable = [sys.executable, "-c", "print('linter broken')"]
+    ((_, messages, passed),) = precommit.lint_staged(executable=executable)
+    assert not passed
+    assert "linter broken" in str(messages[-1])
+    assert precommit.ResultCache(precommit.cache_path()).linter == {}
+
+
+@pytest.mark.skipif(shutil.which("ruff") is None, reason="needs ruff")
+def test_ruff(repo, monkeypatch):
+    _write(repo / "a.ipynb", "import os", "print(y)")
+    _write(repo / "b.ipynb", "x = 1")
+    _git("add", ".")
+    (a, a_messages, a_passed), (b, b_messages, b_passed) = precommit.lint_staged(linter="ruff")
+    assert not a_passed
+    # a message per problem, in its cell
+    assert [(message.cell, message.passed) for message in a_messages] == [(2, False), (3, False)]
+    assert a_messages[0].message.startswith("Checking lint: a.ipynb:1:8: F401")
+    assert b_passed
+    assert [str(message) for message in b_messages] == ["PASSED: Checking lint"]
+
+    # cached (separately from flake8's results)
+    monkeypatch.setattr(precommit, "lint_batch", None)
+    assert _summary(precommit.lint_staged(linter="ruff"))[0][1] == [str(message) for message in a_messages]
+    with pytest.raises(TypeError):
+        precommit.lint_staged()
+
+
+def test_broken_notebook(repo):
+    _write(repo / "a.ipynb", "x = ")
+    _git("add", "a.ipynb")
+    ((_, messages, passed),) = precommit.lint_staged()
+    assert not passed
+    assert messages[0].startswith("ERROR: SyntaxError")
+
+
+def test_cli(repo, capsys):
+    _write(repo / "a.ipynb", "x = 1\ny = 2")
+    _write(repo / "b.ipynb", "x = 1")
+    _git("add", ".")
+    assert run(["pre-commit", "--lines_per_cell", "1"]) == 1
+    out = capsys.readouterr().out
+    assert "FAILED a.ipynb" in out
+    assert "PASSED b.ipynb" in out
+    assert out.endswith("1 of 2 staged notebooks failed\n")
+
+    assert run(["pre-commit", "--lines_per_cell", "1", "b.ipynb"]) == 0
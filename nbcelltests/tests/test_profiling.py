@@ -0,0 +1,49 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import json
+import os
+
+from nbcelltests.profiling import SPEEDSCOPE_SCHEMA, collapsed, merge, speedscope, write_profiles
+
+PROFILES = {
+    1: {"<module> (code cell 1:1)": 5},
+    2: {"<module> (code cell 2:1);f (code cell 1:3)": 10, "<module> (code cell 2:1)": 2},
+}
+
+
+def test_collapsed():
+    assert merge(PROFILES.values()) == {
+        "<module> (code cell 1:1)": 5,
+        "<module> (code cell 2:1);f (code cell 1:3)": 10,
+        "<module> (code cell 2:1)": 2,
+    }
+    assert collapsed(PROFILES[2]) == "<module> (code cell 2:1) 2\n<module> (code cell 2:1);f (code cell 1:3) 10\n"
+
+
+def test_speedscope():
+    result = speedscope([("code cell %d" % cell, profile) for cell, profile in sorted(PROFILES.items())], "nb")
+    assert result["$schema"] == SPEEDSCOPE_SCHEMA
+    assert [frame["name"] for frame in result["shared"]["frames"]] == [
+        "<module> (code cell 1:1)",
+        "<module> (code cell 2:1)",
+        "f (code cell 1:3)",
+    ]
+    cell1, cell2 = result["profiles"]
+    assert (cell1["name"], cell1["samples"], cell1["weights"], cell1["endValue"]) == ("code cell 1", [[0]], [5], 5)
+    assert (cell2["samples"], cell2["weights"], cell2["unit"]) == ([[1], [1, 2]], [2, 10], "microseconds")
+
+
+def test_write_profiles(tmp_path):
+    written = write_profiles(str(tmp_path / "profiles"), "/a/b/nb.ipynb", PROFILES)
+    assert [os.path.basename(path) for path in written] == ["nb.collapsed", "nb.cell1.collapsed", "nb.cell2.collapsed"]
+    with open(written[0], encoding="utf-8") as f:
+        assert f.read() == collapsed(merge(PROFILES.values()))
+
+    (written,) = write_profiles(str(tmp_path / "profiles"), "/a/b/nb.ipynb", PROFILES, "speedscope")
+    with open(written, encoding="utf-8") as f:
+        assert [profile["name"] for profile in json.load(f)["profiles"]] == ["all cells", "code cell 1", "code cell 2"]
@@ -0,0 +1,87 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import glob
+import json
+import nbformat
+import os
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+from nbcelltests.reader import read, reads
+
+
+def _without_outputs(nb):
+    for cell in nb.cells:
+        cell.pop("attachments", None)
+        if cell.cell_type == "code":
+            cell.outputs = []
+    return nb
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.ipynb"))))
+def test_same_as_nbformat(path):
+    assert read(path) == _without_outputs(nbformat.read(path, 4))
+
+
+def test_outputs_and_attachments_skipped(tmp_path):
+    nb = new_notebook()
+    code = new_code_cell('print("a \\"quoted\\" \\\\ string")\n{"[": 1}', metadata={"celltests": ["%cell\n", "# ]}"]})
+    code.outputs = [
+        new_output("stream", name="stdout", text='a "quoted" \\ string\n'),
+        new_output("display_data", data={"image/png": "A" * 100000, "text/plain": ["[{", '"}]\\']}),
+    ]
+    markdown = new_markdown_cell("![x](attachment:x.png)")
+    markdown.attachments = {"x.png": {"image/png": "B" * 100000}}
+    nb.cells = [code, markdown]
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(nb, path)
+
+    read_nb = read(path)
+    assert read_nb == _without_outputs(nbformat.read(path, 4))
+    assert read_nb.cells[0].source == code.source
+    assert read_nb.cells[0].outputs == []
+    assert "attachments" not in read_nb.cells[1]
+
+
+def test_old_notebook_format(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(new_notebook(cells=[new_code_cell("x = 1")]), path, version=3)
+    assert nbformat.read(path, nbformat.NO_CONVERT).nbformat == 3
+
+    read_nb = read(path)
+    assert read_nb.nbformat == 4
+    assert read_nb.cells[0].source == "x = 1"
+    with open(path, "rb") as f:
+        # (cell ids are made up when converting)
+        assert [cell.source for cell in reads(f.read()).cells] == ["x = 1"]
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.ipynb")))[:3])
+def test_reads(path):
+    with open(path, "rb") as f:
+        assert reads(f.read()) == read(path)
+
+
+def test_validate(tmp_path):
+    nb = new_notebook(cells=[new_code_cell("x = 1")])
+    nb.cells[0].cell_type = "not a cell type"
+    path = str(tmp_path / "nb.ipynb")
+    with open(path, "w") as f:
+        json.dump(nb, f)
+
+    read(path)
+    with pytest.raises(nbformat.ValidationError):
+        read(path, validate=True)
+
+
+def test_invalid_json(tmp_path):
+    path = str(tmp_path / "nb.ipynb")
+    with open(path, "w") as f:
+        f.write('{"cells": [{"source": "x = 1"')
+    with pytest.raises(ValueError, match="Invalid notebook JSON"):
+        read(path)
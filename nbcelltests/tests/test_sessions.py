@@ -0,0 +1,93 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import pytest
+
+from nbcelltests.sessions import RevisionMismatch, SessionStore
+
+
+def _cell(source, cell_type="code"):
+    return {"cell_type": cell_type, "source": source, "metadata": {}}
+
+
+def _sources(*sources):
+    return {"metadata": {"kernelspec": {"name": "python3"}}, "cells": [_cell(source) for source in sources]}
+
+
+def test_deltas():
+    store = SessionStore()
+    session = store.update("a.ipynb", {"sources": _sources("a", "b", "c")})
+    revision = session.revision
+
+    deltas = [
+        {"op": "delete", "index": 0},
+        {"op": "modify", "index": 1, "cell": _cell("C")},
+        {"op": "insert", "index": 2, "cell": _cell("d")},
+        {"op": "insert", "index": 0, "cell": _cell("# z", "markdown")},
+    ]
+    assert store.update("a.ipynb", {"revision": revision, "deltas": deltas}) is session
+    assert session.revision != revision
+    assert [cell["source"] for cell in session.sources()["cells"]] == ["# z", "b", "C", "d"]
+
+
+def test_deltas_against_other_revision():
+    store = SessionStore()
+    with pytest.raises(RevisionMismatch):
+        store.update("a.ipynb", {"revision": "abc", "deltas": []})
+    session = store.update("a.ipynb", {"sources": _sources("a")})
+    revision = session.revision
+    store.update("a.ipynb", {"revision": revision, "deltas": []})
+    with pytest.raises(RevisionMismatch):
+        store.update("a.ipynb", {"revision": revision, "deltas": []})
+
+
+@pytest.mark.parametrize(
+    "delta, message",
+    [
+        ({"op": "move", "index": 0}, "Unknown delta op 'move'"),
+        ({"op": "delete", "index": 2}, "Delta index 2 out of range"),
+        ({"op": "insert", "index": 3, "cell": _cell("x")}, "Delta index 3 out of range"),
+        ({"op": "modify", "index": 0}, "Delta 'modify' has no cell"),
+    ],
+)
+def test_invalid_delta(delta, message):
+    store = SessionStore()
+    session = store.update("a.ipynb", {"sources": _sources("a")})
+    revision = session.revision
+    with pytest.raises(ValueError, match=message):
+        store.update("a.ipynb", {"revision": revision, "deltas": [{"op": "insert", "index": 0, "cell": _cell("b")}, delta]})
+    # unchanged
+    assert session.revision == revision
+    assert [cell["source"] for cell in session.cells] == ["a"]
+
+
+def test_key():
+    session = SessionStore().update("a.ipynb", {"sources": _sources("a", "b")})
+    key = session.key()
+    session.apply([{"op": "insert", "index": 1, "cell": _cell("# b", "markdown")}])
+    assert session.key() != key
+    key = session.key()
+    session.apply([], metadata={"kernelspec": {"name": "other"}})
+    assert session.key() != key
+
+
+def test_prune():
+    session = SessionStore().update("a.ipynb", {"sources": _sources("a", "b")})
+    session.lint_cache.update({"a": {}, "b": {}})
+    session.apply([{"op": "modify", "index": 0, "cell": _cell("A")}])
+    session.prune()
+    assert list(session.lint_cache) == ["b"]
+
+
+def test_least_recently_used_dropped():
+    store = SessionStore(max_sessions=2)
+    store.update("a.ipynb", {"sources": _sources()})
+    store.update("b.ipynb", {"sources": _sources()})
+    store.update("a.ipynb", {"sources": _sources()})
+    store.update("c.ipynb", {"sources": _sources()})
+    assert store.get("a.ipynb") is not None
+    assert store.get("b.ipynb") is None
@@ -11,10 +11,12 @@ import pytest
 
 from nbcelltests.shared import (
     cell_injected_into_test,
+    cell_magics,
     empty_ast,
     extract_extrametadata,
     get_cell_inj_span,
     get_coverage,
+    get_test_settings,
     only_whitespace,
 )
 
@@ -335,3 +337,55 @@ def test_cell_injected_into_test(test_source, expected, exception):
     else:
         with pytest.raises(exception[0], match=exception[1]):
             cell_injected_into_test(test_source)
+
+
+def test_extract_extrametadata_cache():
+    cache = {}
+    first = extract_extrametadata(nbformat.read(MORE_NB, 4), cache=cache)
+    assert cache
+    # cached analysis is used in place of analyzing the cell again
+    source = next(source for source, facts in cache.items() if facts["functions"])
+    cache[source] = dict(cache[source], functions=10)
+    second = extract_extrametadata(nbformat.read(MORE_NB, 4), cache=cache)
+    assert second["functions"] == first["functions"] + 9
+    assert second["cell_lines"] == first["cell_lines"]
+    assert second["magics"] == first["magics"]
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ("x = 1", set()),
+        ("%time x = 1\ny = %who_ls", {"time", "who_ls"}),
+        ("%%capture out\n%time x = 1", {"capture"}),
+        ("\n\n%%bash\necho hi", {"bash"}),
+        ("if True:\n    %cd ..", {"cd"}),
+        ("len?", {"pinfo"}),
+        ("s = '100%'", set()),
+        ("get_ipython().run_line_magic('dirs', '')", {"dirs"}),
+        ("get_ipython().magic('dirs -v')", {"dirs"}),
+        # calls of the same names, but not magics
+        ("self.magic('x')\nf().run_line_magic(name)\nget_ipython().magic(name)", set()),
+    ],
+)
+def test_cell_magics(source, expected):
+    assert cell_magics(source) == expected
+
+
+def test_cell_magics_syntax_error():
+    with pytest.raises(SyntaxError):
+        cell_magics("%time x\nx = ")
+
+
+def test_get_test_settings_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = {"run_history": "runs.db", "profile": "profiles", "timing_history": os.path.join(str(tmp_path), "t.db")}
+    nb = nbformat.v4.new_notebook(metadata={"celltests": metadata})
+    notebook = os.path.join("notebooks", "a.ipynb")
+
+    settings = get_test_settings(nb, {"checkpoint_dir": "checkpoints", "checkpoint_cells": [1]}, path=notebook)
+    # the notebook's relative to its directory, the rules' to the current one
+    assert settings["run_history"] == str(tmp_path / "notebooks" / "runs.db")
+    assert settings["profile"]["path"] == str(tmp_path / "notebooks" / "profiles")
+    assert settings["timing_history"]["path"] == str(tmp_path / "t.db")
+    assert settings["checkpoints"]["path"] == str(tmp_path / "checkpoints")
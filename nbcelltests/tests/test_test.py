@@ -15,7 +15,11 @@ import unittest
 from bs4 import BeautifulSoup
 from nbval.kernel import CURRENT_ENV_KERNEL_NAME
 
-from nbcelltests.test import generateTests, run, runWithReport
+from nbcelltests import tests_vendored
+from nbcelltests.__main__ import run as cli_run
+from nbcelltests.history import RunHistory, TimingHistory, cell_hash
+from nbcelltests.test import generateTests, run, runWithOutput, runWithReport
+from nbcelltests.tests_vendored import CellTimeoutError, _inject_cell_into_test_with_lines
 
 # Some straightforward TODOs:
 #
@@ -55,6 +59,13 @@ CELL_NOT_INJECTED_OR_MOCKED = os.path.join(
 BROKEN_MAGICS = os.path.join(os.path.dirname(__file__), "_broken_magics.ipynb")
 NO_CODE_CELLS = os.path.join(os.path.dirname(__file__), "_no_code_cells.ipynb")
 KERNEL_CWD = os.path.join(os.path.dirname(__file__), "_kernel_cwd.ipynb")
+CELL_TIMEOUT = os.path.join(os.path.dirname(__file__), "_cell_timeout.ipynb")
+CODE_COVERAGE = os.path.join(os.path.dirname(__file__), "_code_coverage.ipynb")
+MEMORY = os.path.join(os.path.dirname(__file__), "_memory.ipynb")
+EXECUTION_TIME = os.path.join(os.path.dirname(__file__), "_execution_time.ipynb")
+SNAPSHOT = os.path.join(os.path.dirname(__file__), "_snapshot.ipynb")
+CHECKPOINT = os.path.join(os.path.dirname(__file__), "_checkpoint.ipynb")
+PROFILE = os.path.join(os.path.dirname(__file__), "_profile.ipynb")
 
 INPUT_CELL_MULTILINE_STRING = os.path.join(
     os.path.dirname(__file__), "_input_cell_multiline_string.ipynb"
@@ -487,6 +498,74 @@ class TestFailureInTest(_TestCellTests):
         t.tearDownClass()
 
 
+class TestFailFast(unittest.TestCase):
+    """First failure stops the run"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=TEST_FAIL,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(TEST_RUN_KW, fail_fast=True),
+        )
+
+    def test_failure_aborts_run(self):
+        t = self.generated_tests.TestNotebook()
+        t.setUpClass()
+        t.setUp()
+
+        with self.assertRaises(Exception) as cm:
+            t.test_code_cell_1()
+        assert cm.exception.args[0].endswith("x should have been -1 but was 1")
+        assert t.kernel is None
+
+        t.tearDown()
+        t.setUp()
+        with self.assertRaises(unittest.SkipTest) as cm:
+            t.test_code_cell_2()
+        assert cm.exception.args[0] == (
+            "Not run: stopped after the test for code cell 1 failed (fail fast)"
+        )
+
+        t.tearDown()
+        t.tearDownClass()
+
+    def test_html_report_not_run(self):
+        generates = [
+            os.path.join(os.path.dirname(__file__), "__test_fail_test.py"),
+            os.path.join(os.path.dirname(__file__), "__test_fail_test.html"),
+        ]
+        exists_check = [os.path.exists(f) for f in generates]
+        if any(exists_check):
+            raise ValueError(
+                "Going to generate %s but already exist(s)"
+                % [f for f, exists in zip(generates, exists_check) if exists]
+            )
+
+        try:
+            html = run(TEST_FAIL, html=True, fail_fast=True, **TEST_RUN_KW)
+        finally:
+            try:
+                for f in generates:
+                    os.remove(f)
+            except Exception:
+                pass
+
+        actual_results = json.loads(
+            BeautifulSoup(html, "html.parser")
+            .find("div", {"id": "data-container"})
+            .get("data-jsonblob")
+        )["tests"]
+        results = {
+            name.rsplit("::", 1)[-1]: data[0]["result"]
+            for name, data in actual_results.items()
+        }
+        assert results == {
+            "test_code_cell_1": "Failed",
+            "test_code_cell_2": "Skipped",
+        }
+
+
 # TODO: see https://github.com/computationalmodelling/nbval/issues/147
 class TestSomeSanity(_TestCellTests):
 
@@ -701,6 +780,614 @@ class TestKernelCwd(_TestCellTests):
                 pass
 
 
+class _TestCellTimeout(unittest.TestCase):
+    """Cells that run for too long are interrupted."""
+
+    # abstract
+
+    NBNAME = CELL_TIMEOUT
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=cls.NBNAME,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(TEST_RUN_KW, rules=cls.RULES),
+        )
+
+    def setUp(self):
+        self.t = self.generated_tests.TestNotebook()
+        self.t.setUpClass()
+        self.t.setUp()
+
+    def tearDown(self):
+        self.t.tearDown()
+        self.t.tearDownClass()
+
+
+class TestCellTimeoutContinue(_TestCellTimeout):
+
+    RULES = {"cell_timeout": 1}
+
+    def test_timeout_interrupts_kernel(self):
+        with self.assertRaises(Exception) as cm:
+            self.t.test_code_cell_2()
+        assert cm.exception.args[0].startswith(
+            "Running cell+test for code cell 2; execution timed out after"
+        )
+        assert cm.exception.args[0].endswith("(timeout=1s), kernel interrupted")
+
+        # kernel is still usable, and later cells fail on the timed out cell
+        self.t._run("assert x == 1")
+        with self.assertRaises(Exception) as cm:
+            self.t.test_code_cell_3()
+        assert cm.exception.args[0].startswith(
+            "Running cell+test for code cell 2; execution timed out after"
+        )
+
+
+class TestCellTimeoutAbort(_TestCellTimeout):
+
+    RULES = {"cell_timeout": 1, "timeout_policy": "abort"}
+
+    def test_timeout_aborts_run(self):
+        with self.assertRaises(Exception):
+            self.t.test_code_cell_2()
+        assert self.t.kernel is None
+
+        with self.assertRaises(unittest.SkipTest) as cm:
+            self.t.test_code_cell_3()
+        assert cm.exception.args[0].startswith("Not run: code cell 2 timed out")
+
+
+class TestCellTimeoutPerCell(_TestCellTimeout):
+
+    RULES = {}
+
+    def test_cell_timeout_from_metadata(self):
+        assert self.t.celltests[1]["timeout"] is None
+        assert self.t.celltests[4]["timeout"] == 1
+        with self.assertRaises(Exception) as cm:
+            self.t._run_cell(4)
+        assert cm.exception.args[0].endswith("(timeout=1s), kernel interrupted")
+
+
+def test_timeout_rules_checked():
+    with pytest.raises(ValueError, match="timeout_policy must be one of"):
+        _generate_test_module(
+            CELL_TIMEOUT,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"timeout_policy": "sometimes"}),
+        )
+
+    with pytest.raises(ValueError, match="cell_timeout must be greater than 0"):
+        _generate_test_module(
+            CELL_TIMEOUT,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"cell_timeout": 0}),
+        )
+
+    # (0 on the command line isn't dropped)
+    with pytest.raises(ValueError, match="cell_timeout must be greater than 0"):
+        cli_run(["test", CELL_TIMEOUT, "--cell_timeout", "0"])
+
+
+class TestCodeCoverage(unittest.TestCase):
+    """Lines of cell code run are recorded in the kernel."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=CODE_COVERAGE,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(TEST_RUN_KW, rules={"code_coverage": 50}),
+        )
+
+    def setUp(self):
+        self.t = self.generated_tests.TestNotebook()
+        self.t.setUpClass()
+        self.t.setUp()
+
+    def tearDown(self):
+        self.t.tearDown()
+        self.t.tearDownClass()
+
+    def test_coverage_per_cell(self):
+        self.t.test_code_coverage()
+        # cell 1's function is called from cell 2; cell 2's test
+        # doesn't count; cell 3's else branch doesn't run
+        assert self.t.get_code_coverage() == {
+            1: ([1, 2, 3], [1, 2, 3, 4]),
+            2: ([1], [1]),
+            3: ([1, 2], [1, 2, 4]),
+        }
+
+    def test_notebook_minimum(self):
+        self.t.assert_code_coverage(75, None)
+        with self.assertRaises(AssertionError) as cm:
+            self.t.assert_code_coverage(80, None)
+        assert cm.exception.args[0] == "Code coverage 75.0% < minimum required of 80%"
+
+    def test_per_cell_minimum(self):
+        with self.assertRaises(AssertionError) as cm:
+            self.t.assert_code_coverage(None, 70)
+        assert cm.exception.args[0] == (
+            "Code cell 3 code coverage 66.7% < minimum required of 70% (lines not run: 4)"
+        )
+
+
+def test_code_coverage_rules_checked():
+    with pytest.raises(ValueError, match="code_coverage_per_cell must be between 0 and 100"):
+        _generate_test_module(
+            CODE_COVERAGE,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"code_coverage_per_cell": 101}),
+        )
+
+
+class TestMemoryLimits(unittest.TestCase):
+    """Cells using too much memory fail."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=MEMORY,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(
+                TEST_RUN_KW,
+                rules={"max_memory_per_cell": 50, "max_memory_per_notebook": 100000, "memory_top_allocators": 3},
+            ),
+        )
+
+    def setUp(self):
+        self.t = self.generated_tests.TestNotebook()
+        self.t.setUpClass()
+        self.t.setUp()
+
+    def tearDown(self):
+        self.t.tearDown()
+        self.t.tearDownClass()
+
+    def test_memory_per_cell(self):
+        self.t.test_code_cell_1()
+        with self.assertRaises(AssertionError) as cm:
+            self.t.test_code_cell_2()
+        message = cm.exception.args[0]
+        assert message.startswith("Code cell 2 used ")
+        assert message.splitlines()[0].endswith("MiB of memory > maximum allowed of 50 MiB")
+        assert 'big = b"x" * (100 * 1024 * 1024)' in message
+        self.t.test_code_cell_3()
+
+        metrics = self.t.cell_metrics[2]
+        assert metrics["peak_memory"] - metrics["start_memory"] >= 100 * 1024 * 1024
+
+    def test_memory_per_notebook(self):
+        self.t._limits = {"max_memory_per_notebook": 1}
+        with self.assertRaises(AssertionError) as cm:
+            self.t.test_code_cell_1()
+        assert cm.exception.args[0].splitlines()[0].endswith(
+            "during code cell 1 > maximum allowed for the notebook of 1 MiB"
+        )
+
+
+class TestTimeLimits(unittest.TestCase):
+    """Cells taking too long to execute fail."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=EXECUTION_TIME,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(TEST_RUN_KW, rules={"max_seconds_per_cell": 0.5}),
+        )
+
+    def setUp(self):
+        self.t = self.generated_tests.TestNotebook()
+        self.t.setUpClass()
+        self.t.setUp()
+
+    def tearDown(self):
+        self.t.tearDown()
+        self.t.tearDownClass()
+
+    def test_seconds_per_cell(self):
+        self.t.test_code_cell_1()
+        with self.assertRaises(AssertionError) as cm:
+            self.t.test_code_cell_2()
+        assert cm.exception.args[0].startswith("Code cell 2 took 1.")
+        assert cm.exception.args[0].endswith("s to execute > maximum allowed of 0.5s")
+        self.t.test_code_cell_3()
+        assert self.t.cell_metrics[1]["seconds"] < 0.5 <= 1 <= self.t.cell_metrics[2]["seconds"]
+
+    def test_seconds_per_notebook(self):
+        self.t._limits = {"max_seconds_per_notebook": 0.8}
+        self.t.test_code_cell_1()
+        with self.assertRaises(AssertionError) as cm:
+            self.t.test_code_cell_2()
+        assert cm.exception.args[0].endswith("s to execute up to code cell 2 > maximum allowed of 0.8s")
+        # still over budget
+        with self.assertRaises(AssertionError) as cm:
+            self.t.test_code_cell_3()
+        assert "up to code cell 3" in cm.exception.args[0]
+
+
+def test_timing_regression(tmp_path):
+    db = str(tmp_path / "history.db")
+    generated_tests = _generate_test_module(
+        notebook=EXECUTION_TIME,
+        module_name="nbcelltests.tests.%s.%s" % (__name__, "test_timing_regression"),
+        run_kw=dict(
+            TEST_RUN_KW,
+            rules={"timing_history": db, "timing_history_environment": "test", "timing_regression_threshold": 3},
+        ),
+    )
+    # cell 2 used to be quick
+    history = TimingHistory(db, "test")
+    for seconds in [0.1, 0.11, 0.09, 0.1, 0.1]:
+        history.record(EXECUTION_TIME, generated_tests.TestNotebook.celltests[2]["source"], seconds)
+
+    t = generated_tests.TestNotebook()
+    t.setUpClass()
+    try:
+        t.test_code_cell_1()
+        with pytest.raises(AssertionError, match=r"Code cell 2 took 1\.\d\ds, slower than its recent timings"):
+            t.test_code_cell_2()
+        t.test_code_cell_3()
+    finally:
+        t.tearDownClass()
+
+    # all timings recorded
+    assert len(history.recent(EXECUTION_TIME, t.celltests[1]["source"], window=10)) == 1
+    assert history.recent(EXECUTION_TIME, t.celltests[2]["source"], window=10)[0] >= 1
+
+
+def test_timing_history_rules_checked(tmp_path):
+    # (a window shorter than MIN_RUNS could never flag a regression)
+    with pytest.raises(ValueError, match="timing_history_window must be an integer of at least 5"):
+        _generate_test_module(
+            EXECUTION_TIME,
+            "module.name.irrelevant",
+            run_kw=dict(
+                TEST_RUN_KW,
+                rules={"timing_history": str(tmp_path / "history.db"), "timing_history_window": 4},
+            ),
+        )
+
+
+def test_run_history(tmp_path):
+    db = str(tmp_path / "runs.db")
+    generated_tests = _generate_test_module(
+        notebook=EXECUTION_TIME,
+        module_name="nbcelltests.tests.%s.%s" % (__name__, "test_run_history"),
+        run_kw=dict(TEST_RUN_KW, rules={"run_history": db, "max_seconds_per_cell": 0.5}),
+    )
+    t = generated_tests.TestNotebook()
+    t.setUpClass()
+    try:
+        t.test_code_cell_1()
+        with pytest.raises(AssertionError):
+            t.test_code_cell_2()
+        t._abort("Not run: stopping")
+        with pytest.raises(unittest.SkipTest):
+            t.test_code_cell_3()
+    finally:
+        t.tearDownClass()
+
+    history = RunHistory(db)
+    ((recorded,),) = [history._query("SELECT * FROM runs", [])]
+    assert (recorded["kind"], recorded["kernel"], recorded["passed"]) == ("test", t.kernel_name, 0)
+    results = history._query("SELECT * FROM run_results ORDER BY cell", [])
+    assert [(r["cell"], r["outcome"]) for r in results] == [(1, "passed"), (2, "failed"), (3, "skipped")]
+    assert results[0]["cell_hash"] == cell_hash(t.celltests[1]["source"])
+    assert results[1]["seconds"] >= 1 and results[1]["message"].startswith("Code cell 2 took")
+    assert results[2]["seconds"] is None and results[2]["message"] == "Not run: stopping"
+
+
+def test_origin(tmp_path):
+    # (as the server extension tests a copy)
+    origin = str(tmp_path / "notebooks" / "_execution_time.ipynb")
+    generated_tests = _generate_test_module(
+        notebook=EXECUTION_TIME,
+        module_name="nbcelltests.tests.%s.%s" % (__name__, "test_origin"),
+        run_kw=dict(TEST_RUN_KW, origin=origin),
+    )
+    assert generated_tests.TestNotebook._history_key() == origin
+
+
+def test_run_phases(tmp_path):
+    phases = {}
+    run(COVERAGE, phases=phases, filename=str(tmp_path / "_test.py"), rules={"cell_coverage": 10}, **TEST_RUN_KW)
+    assert sorted(phases) == ["execution", "generate", "kernel_start", "startup"]
+    assert all(seconds >= 0 for seconds in phases.values())
+    assert phases["kernel_start"] > 0
+    # (the tests' report is removed)
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".json")]
+
+
+def test_limit_rules_checked():
+    with pytest.raises(ValueError, match="max_memory_per_cell must be greater than 0"):
+        _generate_test_module(
+            MEMORY,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"max_memory_per_cell": 0}),
+        )
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="forking the kernel needs linux")
+class TestSnapshot(unittest.TestCase):
+    """Cells after the snapshot cell run in forks of the kernel."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.generated_tests = _generate_test_module(
+            notebook=SNAPSHOT,
+            module_name="nbcelltests.tests.%s.%s" % (__name__, cls.__name__),
+            run_kw=dict(TEST_RUN_KW, rules={"snapshot_cell": 2}),
+        )
+
+    def setUp(self):
+        self.t = self.generated_tests.TestNotebook()
+        self.t.setUpClass()
+        self.t.setUp()
+
+    def tearDown(self):
+        self.t.tearDown()
+        self.t.tearDownClass()
+
+    def test_forked_cells_are_independent(self):
+        assert self.t._snapshot is not None
+        self.t.test_code_cell_5()
+        assert self.t.celltests_run == {1, 2, 5}
+        # all later cells were started; each sees the state after cell 2
+        assert self.t._forked == {3, 4, 6, 7}
+        self.t.test_code_cell_4()
+        self.t.test_code_cell_3()
+        assert self.t.cell_metrics[3]["seconds"] >= 0
+
+        for _ in range(2):
+            # re-running a failed cell runs it again from the snapshot
+            with self.assertRaises(Exception) as cm:
+                self.t.test_code_cell_6()
+            message = cm.exception.args[0]
+            assert message.startswith(
+                "Running cell+test for code cell 6 (forked after code cell 2); execution caused an exception"
+            )
+            assert 'raise ValueError("boom")' in message
+            assert message.endswith("ValueError: boom")
+
+        # the kernel itself is still at the snapshot
+        self.t._run("assert x == 1 and 'y' not in dir()")
+
+    def test_timeout(self):
+        with self.assertRaises(CellTimeoutError) as cm:
+            self.t.test_code_cell_7()
+        assert cm.exception.args[0].endswith("(timeout=1s), forked kernel process killed")
+        self.t._run("assert x == 1")
+
+
+def test_snapshot_rules_checked():
+    with pytest.raises(ValueError, match="snapshot_cell must be a positive integer"):
+        _generate_test_module(
+            SNAPSHOT,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"snapshot_cell": 0}),
+        )
+
+    with pytest.raises(ValueError, match="snapshot_cell can't be combined with code coverage"):
+        _generate_test_module(
+            SNAPSHOT,
+            "module.name.irrelevant",
+            run_kw=dict(TEST_RUN_KW, rules={"snapshot_cell": 2, "code_coverage": 50}),
+        )
+
+    # forked cells' memory use, profiles and state are lost with their processes
+    for rules, message in [
+        ({"max_memory_per_cell": 100}, "snapshot_cell can't be combined with max_memory_per_cell"),
+        ({"memory_top_allocators": 3}, "snapshot_cell can't be combined with memory_top_allocators"),
+        ({"profile": "profiles"}, "snapshot_cell can't be combined with profile"),
+        (
+            {"checkpoint_dir": "checkpoints", "checkpoint_cells": [1, 3]},
+            "checkpoint_cells can't be after snapshot_cell",
+        ),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            _generate_test_module(
+                SNAPSHOT,
+                "module.name.irrelevant",
+                run_kw=dict(TEST_RUN_KW, rules=dict(rules, snapshot_cell=2)),
+            )
+
+
+def _checkpoint_tests(tmp_path, name, **rules):
+    return _generate_test_module(
+        notebook=CHECKPOINT,
+        module_name="nbcelltests.tests.%s.%s" % (__name__, name),
+        run_kw=dict(
+            TEST_RUN_KW,
+            rules=dict({"checkpoint_dir": str(tmp_path), "checkpoint_cells": [2]}, **rules),
+        ),
+    ).TestNotebook
+
+
+def test_checkpoint_restored(tmp_path):
+    TestNotebook = _checkpoint_tests(tmp_path, "test_checkpoint_restored", checkpoint_exclude=["scratch"])
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        assert t._restore is None
+        t.test_code_cell_1()
+        t.test_code_cell_2()
+        t.test_code_cell_3()
+    finally:
+        t.tearDownClass()
+    (checkpoint,) = tmp_path.iterdir()
+    assert checkpoint.name == t._checkpoint_keys[2] + ".pickle"
+
+    # the next run doesn't run the cells up to the checkpoint
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        assert t._restore == 2
+        for cell in (1, 2):
+            with pytest.raises(unittest.SkipTest, match="unchanged since the checkpoint after code cell 2"):
+                t.run_test(cell)
+        t.test_code_cell_3()
+        assert t.celltests_run == {1, 2, 3}
+        assert t.cell_metrics.keys() == {3}
+        # (not the excluded name)
+        t._run("assert x == 1 and 'scratch' not in dir()")
+        # (submodules the notebook imported are imported again too)
+        t._run("xml.etree.ElementTree.fromstring('<a/>')")
+    finally:
+        t.tearDownClass()
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="needs file ownership")
+def test_checkpoint_untrusted(tmp_path, caplog, monkeypatch):
+    TestNotebook = _checkpoint_tests(tmp_path, "test_checkpoint_untrusted", checkpoint_exclude=["scratch"])
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        t.test_code_cell_1()
+        t.test_code_cell_2()
+    finally:
+        t.tearDownClass()
+    (checkpoint,) = tmp_path.iterdir()
+    # (only the user can read it)
+    assert checkpoint.stat().st_mode & 0o777 == 0o600
+
+    # others could have written it: not restored, the cells run as usual
+    checkpoint.chmod(0o666)
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        assert t._restore is None
+        t.test_code_cell_1()
+        t.test_code_cell_3()
+        assert t.celltests_run == {1, 2, 3}
+    finally:
+        t.tearDownClass()
+    assert "Ignoring checkpoint after code cell 2 (%s): writable by others" % checkpoint in caplog.text
+
+    # (and the kernel won't load it either)
+    monkeypatch.setattr(tests_vendored, "untrusted", lambda path: None)
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        assert t._restore == 2
+        t.test_code_cell_3()
+        assert t.celltests_run == {1, 2, 3}
+    finally:
+        t.tearDownClass()
+    assert "not restoring %s: writable by others" % checkpoint in caplog.text
+
+
+def test_checkpoint_not_saved(tmp_path, caplog):
+    # the generator can't be pickled
+    t = _checkpoint_tests(tmp_path, "test_checkpoint_not_saved")()
+    t.setUpClass()
+    try:
+        t.test_code_cell_3()
+    finally:
+        t.tearDownClass()
+    assert list(tmp_path.iterdir()) == []
+    assert "Checkpoint after code cell 2 not saved: can't serialize 'scratch': TypeError" in caplog.text
+
+
+def test_checkpoint_not_kept_over_limit(tmp_path):
+    TestNotebook = _checkpoint_tests(tmp_path, "test_checkpoint_not_kept_over_limit", checkpoint_exclude=["scratch"])
+    t = TestNotebook()
+    t.setUpClass()
+    try:
+        t.test_code_cell_1()
+        # (only cell 2 over the limit)
+        TestNotebook._limits = {"max_seconds_per_cell": 1e-9}
+        with pytest.raises(AssertionError, match="Code cell 2 took"):
+            t.test_code_cell_2()
+    finally:
+        t.tearDownClass()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_checkpoint_rules_checked(tmp_path):
+    with pytest.raises(ValueError, match="checkpoint_cells must be a non-empty list of positive integers"):
+        _checkpoint_tests(tmp_path, "irrelevant", checkpoint_cells=[])
+
+    with pytest.raises(ValueError, match="checkpoint_serializer must be one of"):
+        _checkpoint_tests(tmp_path, "irrelevant", checkpoint_serializer="json")
+
+
+def _profile_tests(tmp_path, name, **rules):
+    return _generate_test_module(
+        notebook=PROFILE,
+        module_name="nbcelltests.tests.%s.%s" % (__name__, name),
+        run_kw=dict(TEST_RUN_KW, rules=dict({"profile": str(tmp_path)}, **rules)),
+    ).TestNotebook
+
+
+def _read_collapsed(path):
+    with open(path, encoding="utf-8") as f:
+        return {stack: int(microseconds) for stack, microseconds in (line.rsplit(" ", 1) for line in f)}
+
+
+def test_profile(tmp_path):
+    t = _profile_tests(tmp_path, "test_profile")()
+    t.setUpClass()
+    try:
+        t.test_code_cell_3()
+    finally:
+        t.tearDownClass()
+
+    # (cell 1 may have run too quickly to be sampled)
+    assert {"_profile.cell2.collapsed", "_profile.cell3.collapsed", "_profile.collapsed"} <= set(
+        os.listdir(str(tmp_path))
+    )
+    cell2 = _read_collapsed(str(tmp_path / "_profile.cell2.collapsed"))
+    # (only the cell's own frames, with functions from earlier cells named after their cell)
+    busy = sum(us for stack, us in cell2.items() if stack.startswith("<module> (code cell 2:1);busy (code cell 1:4)"))
+    assert busy > 0.2e6
+    assert all(stack.startswith("<module> (code cell 2:1)") for stack in cell2)
+    cell3 = _read_collapsed(str(tmp_path / "_profile.cell3.collapsed"))
+    assert sum(cell3.values()) > 0.15e6
+
+    # all the cells
+    assert sum(_read_collapsed(str(tmp_path / "_profile.collapsed")).values()) >= sum(cell2.values()) + sum(
+        cell3.values()
+    )
+
+
+def test_profile_speedscope(tmp_path):
+    t = _profile_tests(tmp_path, "test_profile_speedscope", profile_format="speedscope")()
+    t.setUpClass()
+    try:
+        t.test_code_cell_2()
+    finally:
+        t.tearDownClass()
+
+    assert os.listdir(str(tmp_path)) == ["_profile.speedscope.json"]
+    with open(str(tmp_path / "_profile.speedscope.json"), encoding="utf-8") as f:
+        profile = json.load(f)
+    assert [p["name"] for p in profile["profiles"]][:1] == ["all cells"]
+    assert "code cell 2" in [p["name"] for p in profile["profiles"]]
+    frames = [frame["name"] for frame in profile["shared"]["frames"]]
+    assert "busy (code cell 1:4)" in frames
+
+
+def test_profile_rules_checked(tmp_path):
+    with pytest.raises(ValueError, match="profile_format must be one of"):
+        _profile_tests(tmp_path, "irrelevant", profile_format="svg")
+    with pytest.raises(ValueError, match="profile_interval must be greater than 0"):
+        _profile_tests(tmp_path, "irrelevant", profile_interval=0)
+
+
+def test_cell_lines():
+    celltest, cell_lines = _inject_cell_into_test_with_lines(
+        "x = 1\ny = 2", "if True:\n    %cell # end\nassert x == 1"
+    )
+    assert celltest == "if True:\n    x = 1\n    y = 2 # end\nassert x == 1"
+    assert cell_lines == {2: 1, 3: 2}
+
+
 # some cryptic interface going on here, could be improved :)
 
 
@@ -828,6 +1515,17 @@ class TestCoverage:
             "Testing cell coverage",
         )
 
+    # runWithOutput
+
+    def test_runWithOutput(self):
+        output, passed = runWithOutput(COVERAGE, rules={"cell_coverage": 10}, **TEST_RUN_KW)
+        assert passed
+        assert "passed" in output.splitlines()[-1]
+
+        output, passed = runWithOutput(TEST_FAIL, **TEST_RUN_KW)
+        assert not passed
+        assert "failed" in output.splitlines()[-1]
+
     # def test_basic_runWithReport_fail():
     #    from nbcelltests.define import TestType
     #    # TODO it fails here, but it shouldn't, right? we want to be able to report
@@ -945,3 +1643,4 @@ def _check(html, coverage_result):
 # TODO: either make genuinely abstract, or don't use classes/inheritance at all here (since classes/inheritance are not meaningful here anyway).
 del _TestCellTests
 del _TestInput
+del _TestCellTimeout
@@ -0,0 +1,96 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+import json
+import nbformat
+import os
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook
+
+from nbcelltests import tracing
+from nbcelltests.__main__ import run
+
+
+def _events(path):
+    # (as the trace viewers read the unclosed array)
+    with open(path, encoding="utf-8") as f:
+        return json.loads(f.read().rstrip().rstrip(",") + "]")
+
+
+@pytest.fixture
+def trace(tmp_path, monkeypatch):
+    monkeypatch.delenv(tracing.TRACE_ENV, raising=False)
+    path = str(tmp_path / "trace.json")
+    tracing.start(path, "tests")
+    yield path
+    tracing.stop()
+
+
+def test_not_tracing(monkeypatch):
+    monkeypatch.delenv(tracing.TRACE_ENV, raising=False)
+    with tracing.span("a") as args:
+        args["x"] = 1
+    assert tracing.trace_path() is None
+
+
+def test_spans(trace):
+    with tracing.span("outer", notebook="a.ipynb") as args:
+        args["cells"] = 2
+        with tracing.span("inner", category="cell"):
+            pass
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("no")
+
+    name, inner, outer, failing = _events(trace)
+    assert name == {"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0, "args": {"name": "tests"}}
+    assert (inner["name"], inner["cat"], inner["ph"], inner["pid"]) == ("inner", "cell", "X", os.getpid())
+    assert (outer["name"], outer["cat"], outer["args"]) == ("outer", "nbcelltests", {"notebook": "a.ipynb", "cells": 2})
+    # nested in time
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert failing["args"] == {"exception": "ValueError: no"}
+
+
+def test_traced(trace):
+    @tracing.traced("function")
+    def function(notebook, x):
+        return x
+
+    assert function("a.ipynb", 1) == 1
+    assert function(notebook="b.ipynb", x=2) == 2
+    assert [event["args"] for event in _events(trace)[1:]] == [{"notebook": "a.ipynb"}, {"notebook": "b.ipynb"}]
+
+
+def test_trace_cli(tmp_path, monkeypatch):
+    monkeypatch.delenv(tracing.TRACE_ENV, raising=False)
+    notebook = str(tmp_path / "a.ipynb")
+    nbformat.write(new_notebook(cells=[new_code_cell("x = 1", metadata={"celltests": ["%cell"]})]), notebook)
+    trace = str(tmp_path / "trace.json")
+
+    assert run(["test", notebook, "--trace", trace]) == 0
+    # (only while running)
+    assert tracing.trace_path() is None
+
+    events = _events(trace)
+    processes = {event["pid"]: event["args"]["name"] for event in events if event["ph"] == "M"}
+    assert sorted(processes.values()) == ["kernel", "nbcelltests", "pytest"]
+    spans = {(processes[event["pid"]], event["name"]) for event in events if event["ph"] == "X"}
+    assert {
+        ("nbcelltests", "nbcelltests test"),
+        ("nbcelltests", "test.run"),
+        ("nbcelltests", "generateTests"),
+        ("nbcelltests", "read"),
+        ("nbcelltests", "pytest"),
+        ("pytest", "start_kernel"),
+        ("pytest", "test_code_cell_1"),
+        ("pytest", "code cell 1"),
+        ("kernel", "run_cell"),
+    } <= spans
+
+    assert run(["lint", notebook, "--trace", trace]) == 0
+    spans = {event["name"] for event in _events(trace) if event["ph"] == "X"}
+    assert {"nbcelltests lint", "lint.run", "read", "extract_extrametadata", "lint_batch"} <= spans
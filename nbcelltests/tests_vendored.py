@@ -51,24 +51,54 @@ try:
 except ImportError:
     from queue import Empty
 
+import datetime
+import hashlib
+import json
 import logging
-import nbformat
 import os
+import time
 import unittest
-from nbval.kernel import CURRENT_ENV_KERNEL_NAME, RunningKernel
-
+from nbval.kernel import CURRENT_ENV_KERNEL_NAME
+
+from nbcelltests import tracing
+from nbcelltests.history import RunHistory, TimingHistory, cell_hash, default_environment, notebook_hash, regression
+from nbcelltests.kernels import evaluate, install_module, start_kernel
+from nbcelltests.kernelside.checkpoint import untrusted
+from nbcelltests.profiling import write_profiles
+from nbcelltests.reader import read
 from nbcelltests.shared import (
     CELL_INJ_TOKEN,
     CELL_SKIP_TOKEN,
     cell_injected_into_test,
     empty_ast,
     get_cell_inj_span,
+    get_cell_timeout,
     get_test,
     lines2source,
     only_whitespace,
     source2lines,
 )
 
+# how long to wait for an interrupted kernel to report back before
+# giving up on it
+INTERRUPT_GRACE_PERIOD = 5
+
+# memory rules are in MiB
+MiB = 1024 * 1024
+
+# seconds between checks on a cell running in a fork of the kernel
+SNAPSHOT_POLL_INTERVAL = 0.05
+
+# changed when checkpoints saved by earlier versions can't be restored
+CHECKPOINT_VERSION = 2
+
+# environment variable naming a file to write the run's phase timings to
+PHASES_ENV = "NBCELLTESTS_PHASES"
+
+
+class CellTimeoutError(Exception):
+    """A cell+test did not finish executing within its timeout."""
+
 
 def _inject_cell_into_test(cell_source, test_source):
     """Inserts cell_source into test.
@@ -102,12 +132,23 @@ def _inject_cell_into_test(cell_source, test_source):
         assert x == 10
         assert z == 15
     """
+    return _inject_cell_into_test_with_lines(cell_source, test_source)[0]
+
+
+def _inject_cell_into_test_with_lines(cell_source, test_source):
+    """As _inject_cell_into_test(), but also return a dictionary of
+    {celltest line number: cell line number} for the lines of the
+    celltest that came from the cell.
+    """
     celltest_lines = []
+    # celltest_lines index: cell line number
+    from_cell = {}
     for test_line in source2lines(test_source):
         cell_inj_span = get_cell_inj_span(test_line)
         if cell_inj_span is not None:
             prefix = test_line[0 : cell_inj_span[0]]
-            for cell_line in source2lines(cell_source):
+            for cell_lineno, cell_line in enumerate(source2lines(cell_source), start=1):
+                from_cell[len(celltest_lines)] = cell_lineno
                 celltest_lines.append(prefix + cell_line)
 
             suffix = test_line[cell_inj_span[1] : :]
@@ -117,7 +158,15 @@ def _inject_cell_into_test(cell_source, test_source):
                 celltest_lines[-1] += suffix
         else:
             celltest_lines.append(test_line)
-    return lines2source(celltest_lines)
+
+    # (a suffix may have added a line break to a celltest line)
+    cell_lines = {}
+    lineno = 1
+    for i, celltest_line in enumerate(celltest_lines):
+        if i in from_cell:
+            cell_lines[lineno] = from_cell[i]
+        lineno += celltest_line.count("\n")
+    return lines2source(celltest_lines), cell_lines
 
 
 def get_celltests(path_to_notebook):
@@ -132,8 +181,15 @@ def get_celltests(path_to_notebook):
 
       * 'cell_injected' flag indicating whether the cell was injected
         into the test
+
+      * 'timeout' seconds the cell+test may take to execute (from the
+        cell's celltests_timeout metadata), or None to use the
+        notebook's timeout
+
+      * 'cell_lines' dictionary of {source line number: cell line
+        number} for the lines of source that came from the cell
     """
-    notebook = nbformat.read(path_to_notebook, 4)
+    notebook = read(path_to_notebook)
     celltests = {}
     code_cell = 0
     for i, cell in enumerate(notebook.cells, start=1):
@@ -156,6 +212,7 @@ def get_celltests(path_to_notebook):
 
         if only_whitespace(test_source):
             celltest = cell["source"]
+            cell_lines = {i: i for i in range(1, len(source2lines(celltest)) + 1)}
             cell_injected = True
         elif cell_injected is None:
             raise ValueError(
@@ -165,10 +222,16 @@ def get_celltests(path_to_notebook):
             )
         elif cell_injected is False:
             celltest = test_source
+            cell_lines = {}
         else:
-            celltest = _inject_cell_into_test(cell["source"], test_source)
+            celltest, cell_lines = _inject_cell_into_test_with_lines(cell["source"], test_source)
 
-        celltests[code_cell] = {"source": celltest, "cell_injected": cell_injected}
+        celltests[code_cell] = {
+            "source": celltest,
+            "cell_injected": cell_injected,
+            "timeout": get_cell_timeout(cell),
+            "cell_lines": cell_lines,
+        }
 
     return celltests
 
@@ -228,6 +291,33 @@ class TestNotebookBase(unittest.TestCase):
     non-code cells.
 
 
+    Rules
+    -----
+
+    The notebook's rules are class attributes (see
+    shared.get_test_settings; the README describes what each does):
+    _cell_timeout and _timeout_policy, _fail_fast,
+    _measure_code_coverage, _limits and _memory_top_allocators
+    (checked against cell_metrics by each cell's test),
+    _timing_history, _snapshot_cell, _checkpoints, _run_history and
+    _profile.
+
+    Requesting test_code_cell_9 with a snapshot after cell 6 will
+    result in: executes cells 1 to 6 in the kernel, starts forks of
+    it for cells 7, 8 and 9 (see nbcelltests.kernelside.snapshot),
+    and waits for cell 9.
+
+    Requesting test_code_cell_30 with a checkpoint of cells 1 to 29
+    kept by an earlier run will result in: restores the checkpoint
+    (see nbcelltests.kernelside.checkpoint), executes cell 30. A
+    checkpoint is only kept once the tests of all the cells up to it
+    have passed; saving or restoring one never fails a test.
+
+    If the environment variable NBCELLTESTS_PHASES names a file, the
+    seconds of kernel_start and execution are written to it (as json)
+    when the class is torn down.
+
+
     Notes
     -----
 
@@ -243,9 +333,39 @@ class TestNotebookBase(unittest.TestCase):
     # abstract - subclasses will define KERNEL_NAME and celltests
     # (TODO: make actually abstract...)
 
+    kernel = None
+    _snapshot = None
+    _checkpoint = None
+    _trace = None
+    _profiler = None
+    _phases = None
+
+    # subclasses may override
+    # (the notebook's own path, if _notebook is a copy of it)
+    _origin = None
+    _cell_timeout = None
+    _timeout_policy = "continue"
+    _fail_fast = False
+    _measure_code_coverage = False
+    _limits = {}
+    _memory_top_allocators = 0
+    _timing_history = None
+    _snapshot_cell = None
+    _checkpoints = None
+    _run_history = None
+    _profile = None
+
     @classmethod
     def setUpClass(cls):
         cls.celltests_run = set()
+        cls._aborted = None
+        # outcome of each test so far (for _run_history)
+        cls._run_results = []
+        cls._run_started = time.time()
+        # cell: kernel filename of the cell's code (code coverage only)
+        cls._code_coverage_files = {}
+        # cell: measurements from the cell's last run
+        cls.cell_metrics = {}
         # the rest is like nbval's IPyNbFile.setup() (or will be...)
         if cls._current_env and cls._kernel_name:
             raise ValueError("current_env and kernel_name are mutually exclusive")
@@ -254,13 +374,172 @@ class TestNotebookBase(unittest.TestCase):
         elif cls._kernel_name:
             kernel_name = cls._kernel_name
         else:
-            notebook = nbformat.read(cls._notebook, 4)
+            notebook = read(cls._notebook)
             kernel_name = notebook["metadata"].get("kernelspec", {}).get("name", "python")
-        cls.kernel = RunningKernel(kernel_name, os.path.dirname(cls._notebook))
+        cls.kernel_name = kernel_name
+        cls._history = None
+        if cls._timing_history:
+            cls._history = TimingHistory(
+                cls._timing_history["path"],
+                cls._timing_history["environment"] or default_environment(kernel_name),
+            )
+        tracing.name_process("pytest")
+        kernel_starting = time.monotonic()
+        with tracing.span("start_kernel", kernel=kernel_name):
+            cls.kernel = start_kernel(kernel_name, os.path.dirname(cls._notebook))
+        cls._trace = None
+        if tracing.trace_path():
+            try:
+                cls._trace = install_module(cls.kernel, "trace")
+                evaluate(cls.kernel, "%s.start(%r)" % (cls._trace, tracing.trace_path()))
+            except Exception:
+                cls._trace = None
+                logging.warning("Kernel %s can't be traced; tracing only this process", kernel_name)
+        if cls._measure_code_coverage:
+            cls._coverage = install_module(cls.kernel, "coverage")
+            evaluate(cls.kernel, "%s.start()" % cls._coverage)
+        cls._memory = None
+        if cls._memory_top_allocators or any(rule.startswith("max_memory") for rule in cls._limits):
+            cls._memory = install_module(cls.kernel, "memory")
+        cls._profiler = None
+        # cell: its profile (stack: microseconds)
+        cls._profiles = {}
+        if cls._profile:
+            cls._profiler = install_module(cls.kernel, "sampler")
+        cls._snapshot = None
+        # cells running (or finished) in forks, whose results haven't been collected
+        cls._forked = set()
+        cls._forks_started = False
+        if cls._snapshot_cell is not None:
+            try:
+                snapshot = install_module(cls.kernel, "snapshot")
+                if evaluate(cls.kernel, "%s.supported()" % snapshot):
+                    cls._snapshot = snapshot
+            except Exception:
+                pass
+            if cls._snapshot is None:
+                logging.warning("Kernel %s can't be forked; running all cells in the kernel", kernel_name)
+        cls._setup_checkpoints(kernel_name)
+        cls._kernel_ready = time.monotonic()
+        cls._phases = {"kernel_start": cls._kernel_ready - kernel_starting}
+
+    @classmethod
+    def _setup_checkpoints(cls, kernel_name):
+        # cell: hash naming its checkpoint
+        cls._checkpoint_keys = {}
+        # checkpoint to restore before running a later cell
+        cls._restore = None
+        # cells in that checkpoint
+        cls._checkpointed = set()
+        # cells whose tests passed, and those with checkpoints saved
+        # (as pending) until the tests of all the cells up to them pass
+        cls._passed = set()
+        cls._pending = set()
+        cls._checkpoint = None
+        if not cls._checkpoints:
+            return
+        try:
+            cls._checkpoint = install_module(cls.kernel, "checkpoint")
+            version = evaluate(cls.kernel, "__import__('sys').version")
+        except Exception:
+            cls._checkpoint = None
+            logging.warning("Kernel %s can't save checkpoints; running all cells in the kernel", kernel_name)
+            return
+
+        settings = [CHECKPOINT_VERSION, kernel_name, version, os.path.dirname(os.path.abspath(cls._history_key()))]
+        settings += [cls._checkpoints["serializer"], sorted(cls._checkpoints["exclude"])]
+        for cell in sorted(cls._checkpoints["cells"]):
+            # (cells run in forks aren't saved)
+            if cell in cls.celltests and not (cls._snapshot is not None and cell > cls._snapshot_cell):
+                prefix = [cls.celltests[c]["source"] for c in sorted(cls.celltests) if c <= cell]
+                cls._checkpoint_keys[cell] = hashlib.sha256(json.dumps(settings + prefix).encode("utf-8")).hexdigest()
+        for cell in sorted(cls._checkpoint_keys, reverse=True):
+            path = cls._checkpoint_path(cell)
+            if os.path.exists(path):
+                reason = untrusted(path)
+                if reason is not None:
+                    logging.warning("Ignoring checkpoint after code cell %d (%s): %s", cell, path, reason)
+                    continue
+                cls._restore = cell
+                cls._checkpointed = {c for c in cls.celltests if c <= cell}
+                break
+
+    @classmethod
+    def _history_key(cls):
+        # the notebook that histories and checkpoints are of
+        return cls._origin or cls._notebook
+
+    @classmethod
+    def _checkpoint_path(cls, cell, pending=False):
+        path = os.path.join(cls._checkpoints["path"], cls._checkpoint_keys[cell] + ".pickle")
+        return path + ".pending" if pending else path
+
+    @classmethod
+    def _discard_checkpoint(cls, cell):
+        cls._pending.discard(cell)
+        try:
+            os.remove(cls._checkpoint_path(cell, pending=True))
+        except OSError:
+            pass
+
+    def _passed_test(self, cell):
+        """Note cell's test passed, keeping the checkpoints now known to be of passing cells."""
+        self._passed.add(cell)
+        for pending in sorted(self._pending):
+            if all(c in self._passed or c in self._checkpointed for c in self.celltests if c <= pending):
+                self._pending.discard(pending)
+                os.replace(self._checkpoint_path(pending, pending=True), self._checkpoint_path(pending))
 
     @classmethod
     def tearDownClass(cls):
-        cls.kernel.stop()
+        if cls._phases is not None:
+            cls._phases["execution"] = time.monotonic() - cls._kernel_ready
+        with tracing.span("stop_kernel"):
+            cls._stop_kernel()
+        for cell in list(getattr(cls, "_pending", ())):
+            cls._discard_checkpoint(cell)
+        cls._write_phases()
+        if cls._profile and cls._profiles:
+            profiles, cls._profiles = cls._profiles, {}
+            with tracing.span("write_profiles"):
+                write_profiles(cls._profile["path"], cls._notebook, profiles, cls._profile["format"])
+        if cls._run_history and cls._run_results:
+            results, cls._run_results = cls._run_results, []
+            with tracing.span("record_run_history"):
+                RunHistory(cls._run_history).record(
+                    "test",
+                    cls._history_key(),
+                    results,
+                    cls._run_started,
+                    seconds=time.time() - cls._run_started,
+                    kernel=getattr(cls, "kernel_name", None),
+                    notebook_hash=notebook_hash(cls.celltests[cell]["source"] for cell in sorted(cls.celltests)),
+                )
+
+    @classmethod
+    def _write_phases(cls):
+        path = os.environ.get(PHASES_ENV)
+        if path and cls._phases is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(cls._phases, f)
+
+    @classmethod
+    def _stop_kernel(cls):
+        if cls.kernel is not None:
+            for module in (cls._snapshot, cls._trace):
+                if module is not None:
+                    try:
+                        evaluate(cls.kernel, "%s.stop()" % module)
+                    except Exception:
+                        pass
+            cls.kernel.stop()
+            cls.kernel = None
+
+    @classmethod
+    def _abort(cls, reason):
+        """Shut the kernel down and skip all subsequent tests."""
+        cls._aborted = reason
+        cls._stop_kernel()
 
     def assert_coverage(self, cells_covered, min_required):
         assert cells_covered >= min_required, "Actual cell coverage %s < minimum required of %s" % (
@@ -268,15 +547,128 @@ class TestNotebookBase(unittest.TestCase):
             min_required,
         )
 
+    def assert_code_coverage(self, min_notebook, min_per_cell):
+        """
+        Run any cells not yet run, then check the notebook's code
+        coverage is at least min_notebook, and each cell's at least
+        min_per_cell (percentages; either may be None).
+        """
+        not_run = self.celltests.keys() - self.celltests_run
+        if not_run:
+            self.run_test(max(not_run))
+        elif self._aborted is not None:
+            self.skipTest(self._aborted)
+
+        coverage = self.get_code_coverage()
+        failures = []
+        if min_per_cell is not None:
+            for cell, (executed, executable) in sorted(coverage.items()):
+                percent = _percent(executed, executable)
+                if percent < min_per_cell:
+                    failures.append(
+                        "Code cell %d code coverage %.1f%% < minimum required of %s%% (lines not run: %s)"
+                        % (
+                            cell,
+                            percent,
+                            min_per_cell,
+                            ", ".join(str(line) for line in sorted(set(executable) - set(executed))),
+                        )
+                    )
+        if min_notebook is not None:
+            percent = _percent(
+                [line for executed, _ in coverage.values() for line in executed],
+                [line for _, executable in coverage.values() for line in executable],
+            )
+            if percent < min_notebook:
+                failures.append("Code coverage %.1f%% < minimum required of %s%%" % (percent, min_notebook))
+        assert not failures, "\n".join(failures)
+
+    def get_code_coverage(self):
+        """
+        Return {cell: (executed lines, executable lines)}, in cell line
+        numbers, for each cell whose code has run.
+        """
+        files = self._code_coverage_files
+        report = evaluate(self.kernel, "%s.report(%r)" % (self._coverage, sorted(files.values())))
+        coverage = {}
+        for cell, filename in files.items():
+            cell_lines = self.celltests[cell]["cell_lines"]
+            executable, executed = report[filename]
+            coverage[cell] = (
+                sorted(cell_lines[line] for line in set(executed) if line in cell_lines),
+                sorted(cell_lines[line] for line in set(executable) if line in cell_lines),
+            )
+        return coverage
+
     def run_test(self, cell):
         """
         Run any cells preceding cell (number) that have not already been
         run, then run cell itself.
         """
-        preceding_cells = set(range(1, cell)) & self.celltests.keys()
-        for preceding_cell in sorted(set(preceding_cells) - self.celltests_run):
-            self._run_cell(preceding_cell)
-        self._run_cell(cell)
+        metrics = self.cell_metrics.get(cell)
+        with tracing.span("test_code_cell_%d" % cell, category="test"):
+            try:
+                self._run_test(cell)
+            except unittest.SkipTest as e:
+                self._record_result(cell, "skipped", None, e)
+                raise
+            except Exception as e:
+                # (the cell's measurements only if it ran this time)
+                self._record_result(cell, "failed", self.cell_metrics.get(cell) is not metrics, e)
+                raise
+            self._record_result(cell, "passed", True)
+
+    def _record_result(self, cell, outcome, ran, error=None):
+        """Note the outcome of cell's test, for _run_history."""
+        if not self._run_history:
+            return
+        metrics = self.cell_metrics.get(cell, {}) if ran else {}
+        used = None
+        if metrics.get("peak_memory") is not None:
+            used = metrics["peak_memory"] - metrics["start_memory"]
+        # (first line; kernel tracebacks have escaped newlines)
+        message = str(error or "").replace("\\n", "\n").strip().split("\n")[0] or None
+        self._run_results.append(
+            {
+                "cell": cell,
+                "cell_hash": cell_hash(self.celltests[cell]["source"]),
+                "name": "test_code_cell_%d" % cell,
+                "outcome": outcome,
+                "seconds": metrics.get("seconds"),
+                "peak_memory": metrics.get("peak_memory"),
+                "memory_used": used,
+                "message": message,
+            }
+        )
+
+    def _run_test(self, cell):
+        if self._aborted is not None:
+            self.skipTest(self._aborted)
+        if cell in self._checkpointed:
+            self.skipTest(
+                "Not run: unchanged since the checkpoint after code cell %d was saved (which restores the "
+                "notebook's variables and imports, but not state set inside modules or files written)"
+                % max(self._checkpointed)
+            )
+        if self._restore is not None:
+            self._restore_checkpoint()
+        try:
+            if self._forks(cell):
+                # the fork has the cells up to the snapshot
+                preceding_cells = set(range(1, self._snapshot_cell + 1)) & self.celltests.keys()
+            else:
+                preceding_cells = set(range(1, cell)) & self.celltests.keys()
+            for preceding_cell in sorted(set(preceding_cells) - self.celltests_run):
+                self._run_cell(preceding_cell)
+            self._run_cell(cell)
+            self._check_limits(cell)
+        except Exception:
+            if cell in self._pending:
+                self._discard_checkpoint(cell)
+            if self._fail_fast and self._aborted is None:
+                type(self)._abort("Not run: stopped after the test for code cell %d failed (fail fast)" % cell)
+            raise
+        self._passed_test(cell)
         if not self.celltests[cell]["cell_injected"]:
             # TODO: this will appear in the html report under the test
             # method as captured logging, but it would be better
@@ -286,15 +678,227 @@ class TestNotebookBase(unittest.TestCase):
             # are not being reported in the html we show right now.
             logging.warning("Cell %d was not executed as part of the cell test", cell)
 
+    def _check_limits(self, cell):
+        """Check cell's last run stayed within _limits."""
+        metrics = self.cell_metrics.get(cell, {})
+        failures = []
+
+        limit = self._limits.get("max_memory_per_cell", None)
+        if limit is not None and metrics.get("peak_memory") is not None:
+            used = (metrics["peak_memory"] - metrics["start_memory"]) / MiB
+            if used > limit:
+                failures.append(
+                    "Code cell %d used %.1f MiB of memory > maximum allowed of %s MiB" % (cell, used, limit)
+                )
+
+        limit = self._limits.get("max_memory_per_notebook", None)
+        if limit is not None and metrics.get("peak_memory") is not None:
+            peak = metrics["peak_memory"] / MiB
+            if peak > limit:
+                failures.append(
+                    "Kernel memory reached %.1f MiB during code cell %d > maximum allowed for the notebook of %s MiB"
+                    % (peak, cell, limit)
+                )
+
+        limit = self._limits.get("max_seconds_per_cell", None)
+        if limit is not None and "seconds" in metrics:
+            if metrics["seconds"] > limit:
+                failures.append(
+                    "Code cell %d took %.2fs to execute > maximum allowed of %ss" % (cell, metrics["seconds"], limit)
+                )
+
+        limit = self._limits.get("max_seconds_per_notebook", None)
+        if limit is not None and "seconds" in metrics:
+            seconds = sum(m.get("seconds", 0) for m in self.cell_metrics.values())
+            if seconds > limit:
+                failures.append(
+                    "Notebook took %.2fs to execute up to code cell %d > maximum allowed of %ss"
+                    % (seconds, cell, limit)
+                )
+
+        if metrics.get("timing_regression"):
+            failures.append(metrics["timing_regression"])
+
+        if failures and metrics.get("top_allocators"):
+            failures.append("Top allocations still in use after the cell:")
+            for filename, lineno, source, size in metrics["top_allocators"]:
+                failures.append("  %s:%d: %s (%.1f MiB)" % (filename, lineno, source, size / MiB))
+
+        assert not failures, "\n".join(failures)
+
     def _run_cell(self, cell):
         """Run cell and record its execution"""
-        self._run(self.celltests[cell]["source"], "Running cell+test for code cell %d" % cell)
+        timeout = self.celltests[cell].get("timeout") or self._cell_timeout
+        forked = self._forks(cell)
+        if forked:
+            self.cell_metrics[cell] = {}
+        else:
+            self._begin_measuring(cell)
+        try:
+            with tracing.span("code cell %d" % cell, category="cell", forked=forked):
+                if forked:
+                    seconds = self._run_forked(
+                        cell,
+                        "Running cell+test for code cell %d (forked after code cell %d)" % (cell, self._snapshot_cell),
+                        timeout=timeout,
+                    )
+                else:
+                    seconds = self._run(
+                        self.celltests[cell]["source"], "Running cell+test for code cell %d" % cell, timeout=timeout
+                    )
+            self.cell_metrics[cell]["seconds"] = seconds
+        except CellTimeoutError as e:
+            if self._timeout_policy == "abort":
+                type(self)._abort("Not run: code cell %d timed out (%s)" % (cell, e.args[0]))
+            raise
+        finally:
+            if not forked:
+                self._end_measuring(cell)
+        if (
+            cell in self._checkpoint_keys
+            and cell not in self._pending
+            and not os.path.exists(self._checkpoint_path(cell))
+        ):
+            self._save_checkpoint(cell)
+        if self._history is not None:
+            self._record_timing(cell)
         self.celltests_run.add(cell)
 
-    def _run(self, cell_content, description=""):
+    def _save_checkpoint(self, cell):
+        """
+        Save the kernel's user namespace as the (pending) checkpoint
+        after cell.
+        """
+        try:
+            with tracing.span("save_checkpoint", cell=cell):
+                saved = evaluate(
+                    self.kernel,
+                    "%s.save(%r, %r, %r)"
+                    % (
+                        self._checkpoint,
+                        self._checkpoint_path(cell, pending=True),
+                        self._checkpoints["serializer"],
+                        self._checkpoints["exclude"],
+                    ),
+                    timeout=None,
+                )
+        except Exception as e:
+            saved = {"saved": False, "reason": str(e)}
+        if saved["saved"]:
+            self._pending.add(cell)
+        else:
+            logging.warning("Checkpoint after code cell %d not saved: %s", cell, saved["reason"])
+
+    def _restore_checkpoint(self):
+        """Restore the checkpoint found by setUpClass (or carry on without it)."""
+        cls = type(self)
+        cell, cls._restore = cls._restore, None
+        try:
+            with tracing.span("restore_checkpoint", cell=cell):
+                evaluate(
+                    self.kernel,
+                    "%s.restore(%r, %r)"
+                    % (self._checkpoint, self._checkpoint_path(cell), self._checkpoints["serializer"]),
+                    timeout=None,
+                )
+        except Exception as e:
+            logging.warning("Checkpoint after code cell %d not restored (running the cells instead): %s", cell, e)
+            return
+        self.celltests_run.update(self._checkpointed)
+
+    def _forks(self, cell):
+        """Whether cell runs in a fork of the kernel."""
+        return self._snapshot is not None and cell > self._snapshot_cell
+
+    def _run_forked(self, cell, description="", timeout=None):
+        """
+        Run cell in a fork of the kernel as it was after the snapshot
+        cell, and check it runs without exception (like _run).
+
+        The first time, every cell after the snapshot cell is started;
+        after that, just cell (if its result was already collected).
+        """
+        cls = type(self)
+        if not cls._forks_started:
+            cls._forks_started = True
+            cells = [c for c in sorted(self.celltests) if c > self._snapshot_cell]
+        elif cell not in self._forked:
+            cells = [cell]
+        else:
+            cells = []
+        if cells:
+            started = [
+                [c, self.celltests[c]["source"], self.celltests[c].get("timeout") or self._cell_timeout] for c in cells
+            ]
+            evaluate(self.kernel, "%s.start(%r)" % (self._snapshot, started))
+            self._forked.update(cells)
+
+        while True:
+            result = evaluate(self.kernel, "%s.poll(%d)" % (self._snapshot, cell))
+            if result is not None:
+                break
+            time.sleep(SNAPSHOT_POLL_INTERVAL)
+        self._forked.discard(cell)
+
+        if result["status"] == "timeout":
+            raise CellTimeoutError(
+                "%s; execution timed out after %.1fs (timeout=%ss), forked kernel process killed"
+                % (description, result["seconds"], timeout)
+            )
+        if result["status"] == "error":
+            traceback = "\\n" + "\\n".join(result["traceback"])
+            raise Exception("%s; execution caused an exception" % description + "\\n" + traceback)
+        return result["seconds"]
+
+    def _record_timing(self, cell):
+        """Add cell's timing to the history, noting any regression."""
+        source = self.celltests[cell]["source"]
+        seconds = self.cell_metrics[cell]["seconds"]
+        threshold = self._timing_history["threshold"]
+        if threshold is not None:
+            previous = self._history.recent(self._history_key(), source, self._timing_history["window"])
+            regressed = regression(seconds, previous, threshold)
+            if regressed is not None:
+                self.cell_metrics[cell]["timing_regression"] = (
+                    "Code cell %d took %.2fs, slower than its recent timings (%.2fs +/- %.2fs over %d runs) "
+                    "by more than %s standard deviations" % ((cell, seconds) + regressed + (len(previous), threshold))
+                )
+        self._history.record(self._history_key(), source, seconds)
+
+    def _begin_measuring(self, cell):
+        self.cell_metrics[cell] = {}
+        if self._memory is not None:
+            evaluate(self.kernel, "%s.begin(%d)" % (self._memory, self._memory_top_allocators))
+        if self._profiler is not None:
+            evaluate(self.kernel, "%s.begin(%d, %r)" % (self._profiler, cell, self._profile["interval"]))
+
+    def _end_measuring(self, cell):
+        if self.kernel is None:
+            return
+        if self._measure_code_coverage:
+            # the first new file is the cell+test itself
+            files = evaluate(self.kernel, "%s.new_files()" % self._coverage)
+            if files:
+                self._code_coverage_files[cell] = files[0]
+        if self._memory is not None:
+            self.cell_metrics[cell].update(
+                evaluate(self.kernel, "%s.end(%d)" % (self._memory, self._memory_top_allocators))
+            )
+        if self._profiler is not None:
+            profile = evaluate(self.kernel, "%s.end()" % self._profiler)
+            if profile:
+                self._profiles[cell] = profile
+
+    def _run(self, cell_content, description="", timeout=None):
         """
         Send supplied cell_content (cell source string) to kernel and
         check it runs without exception.
+
+        If timeout (seconds) is supplied and execution takes longer,
+        the kernel is interrupted and CellTimeoutError is raised.
+
+        Returns the number of seconds the kernel spent executing
+        cell_content.
         """
         # Start of code from nbval (with modifications)
         # https://github.com/computationalmodelling/nbval
@@ -303,13 +907,29 @@ class TestNotebookBase(unittest.TestCase):
         #   * ? (things before 2020)
         #   * Add description to exception messages, so it's easy to see which
         #     cell is failing.
+        #   * Interrupt the kernel if the execution timeout expires.
+        #   * Return execution time (from the kernel's status messages).
         msg_id = self.kernel.execute_cell_input(cell_content, allow_stdin=False)
+        start = time.monotonic()
+        started = finished = None
 
         # Poll the shell channel to get a message
         try:
-            self.kernel.await_reply(msg_id)
+            self.kernel.await_reply(msg_id, timeout=timeout)
         except Empty:
-            raise Exception("%s; Kernel timed out waiting for message!" % description)
+            if timeout is None:
+                raise Exception("%s; Kernel timed out waiting for message!" % description)
+            elapsed = time.monotonic() - start
+            self.kernel.interrupt()
+            try:
+                # let the kernel finish with the interrupted cell
+                self.kernel.await_reply(msg_id, timeout=INTERRUPT_GRACE_PERIOD)
+            except Empty:
+                pass
+            raise CellTimeoutError(
+                "%s; execution timed out after %.1fs (timeout=%ss), kernel interrupted"
+                % (description, elapsed, timeout)
+            )
 
         while True:
             # The iopub channel broadcasts a range of messages. We keep reading
@@ -337,8 +957,10 @@ class TestNotebookBase(unittest.TestCase):
             # once at process startup.
             if msg_type == "status":
                 if reply["execution_state"] == "idle":
+                    finished = msg["header"].get("date")
                     break
                 else:
+                    started = msg["header"].get("date")
                     continue
             elif msg_type == "execute_input":
                 continue
@@ -366,23 +988,46 @@ class TestNotebookBase(unittest.TestCase):
 
         # End of code from nbval
 
+        if isinstance(started, datetime.datetime) and isinstance(finished, datetime.datetime):
+            return (finished - started).total_seconds()
+        return time.monotonic() - start
+
+
+def _percent(executed, executable):
+    return 100.0 * len(executed) / len(executable) if executable else 100.0
+
 
 # Fetches notebook source at import time. Don't necessarily think we
 # should do the dynamic test generation this way; first priority was
 # just to clean up so code's not built up in string.
 
 BASE = """
+import pytest
 from parameterized import parameterized
 from nbcelltests.tests_vendored import TestNotebookBase, get_celltests, generate_name
 
 _notebook = r"{path_to_notebook}"
 _celltests = get_celltests(_notebook)
 
+# keep the notebook's tests on one pytest-xdist worker (with --dist loadgroup)
+@pytest.mark.xdist_group(name=_notebook)
 class TestNotebook(TestNotebookBase):
 
     _current_env = {current_env}
     _kernel_name = "{kernel_name}"
     _notebook = _notebook
+    _origin = {origin!r}
+    _cell_timeout = {cell_timeout}
+    _timeout_policy = "{timeout_policy}"
+    _fail_fast = {fail_fast}
+    _measure_code_coverage = {measure_code_coverage}
+    _limits = {limits}
+    _memory_top_allocators = {memory_top_allocators}
+    _timing_history = {timing_history}
+    _snapshot_cell = {snapshot_cell}
+    _checkpoints = {checkpoints}
+    _run_history = {run_history!r}
+    _profile = {profile!r}
     celltests = _celltests
 
     @parameterized.expand([(i,) for i in _celltests], name_func=generate_name, skip_on_empty=True)
@@ -392,6 +1037,10 @@ class TestNotebook(TestNotebookBase):
     @parameterized.expand({coverage}, skip_on_empty=True, name_func=lambda *args: "test_cell_coverage")
     def _test_coverage(self, actual,required):
         self.assert_coverage(actual,required)
+
+    @parameterized.expand({code_coverage}, skip_on_empty=True, name_func=lambda *args: "test_code_coverage")
+    def _test_code_coverage(self, min_notebook, min_per_cell):
+        self.assert_code_coverage(min_notebook, min_per_cell)
 """
 
 JSON_CONFD = '''
@@ -0,0 +1,134 @@
+# *****************************************************************************
+#
+# Copyright (c) 2019, the nbcelltests authors.
+#
+# This file is part of the nbcelltests library, distributed under the terms of
+# the Apache License 2.0.  The full license can be found in the LICENSE file.
+#
+"""Tracing lint and test runs to a file, in Chrome's trace event format.
+
+Tracing is on when the NBCELLTESTS_TRACE environment variable names a
+file (see start), so it carries over to the processes a run starts: the
+pytest process running a notebook's tests, and its kernel (see
+kernelside.trace). Each process appends its spans to the file, as
+complete ("X") events of a JSON array that's never closed, which
+chrome://tracing and https://ui.perfetto.dev both open as it is.
+Spans nest by time within a process and thread.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_ENV = "NBCELLTESTS_TRACE"
+
+_lock = threading.Lock()
+# (path, pid) of processes named in the file so far
+_named = set()
+
+
+def trace_path():
+    """The file being traced to, or None if not tracing."""
+    return os.environ.get(TRACE_ENV) or None
+
+
+def start(path, process_name="nbcelltests"):
+    """
+    Start tracing to path (replacing any existing file), in this
+    process and the ones it starts from now on.
+    """
+    path = os.path.abspath(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+    os.environ[TRACE_ENV] = path
+    name_process(process_name)
+
+
+def stop():
+    """Stop tracing (in this process, and the ones it starts from now on)."""
+    os.environ.pop(TRACE_ENV, None)
+
+
+def now():
+    """The current time, in the trace's microseconds."""
+    return time.time() * 1e6
+
+
+def write(events, path=None):
+    """Append events to the trace (path, or the current one)."""
+    path = path or trace_path()
+    if path is None or not events:
+        return
+    data = "".join(json.dumps(event) + ",\n" for event in events).encode("utf-8")
+    # one write with O_APPEND, so processes writing at once don't interleave
+    with _lock:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def name_process(name):
+    """Name this process in the trace (once)."""
+    path = trace_path()
+    if path is None or (path, os.getpid()) in _named:
+        return
+    _named.add((path, os.getpid()))
+    write([{"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0, "args": {"name": name}}], path)
+
+
+def event(name, start, end, category="nbcelltests", args=None):
+    """A complete event from start to end (see now), in this thread."""
+    return {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start,
+        "dur": max(0.0, end - start),
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": args or {},
+    }
+
+
+@contextlib.contextmanager
+def span(name, category="nbcelltests", **args):
+    """
+    Trace the enclosed code as a span called name (if tracing); args
+    are shown with it, and can be added to from the yielded dictionary.
+    """
+    path = trace_path()
+    if path is None:
+        yield args
+        return
+    name_process(os.path.basename(sys.argv[0]) or "python")
+    start = now()
+    try:
+        yield args
+    except BaseException as e:
+        args["exception"] = "%s: %s" % (type(e).__name__, e)
+        raise
+    finally:
+        write([event(name, start, now(), category, args)], path)
+
+
+def traced(name):
+    """
+    Decorator tracing calls to a function of a notebook (its first
+    argument) as spans called name.
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name, notebook=args[0] if args else kwargs.get("notebook")):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator